@@ -1,6 +1,11 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from modules.mysql import MySQL
+from modules.snapshotModules import SnapshotStore, SNAPSHOT_QUERY_TIMEOUT
+from modules.cubeModules import COUNTRY_LIST, MAKE_COUNTRY_LIST
+from modules.poolModules import ConnectionPool, POOL_SIZE
+from asgiref.wsgi import WsgiToAsgi
 import os
+from datetime import timezone
 from dotenv import load_dotenv
 from flask_cors import CORS
 
@@ -8,109 +13,110 @@ load_dotenv()
 env = os.getenv("ENV_API")
 GCR = True if env is not None else False
 
-sql = MySQL(db = "explorer",
-            credentials_file = "./credentials/explorer_credentials.json",
-            verbose = False,
-            GCR = GCR)
-
-COUNTRY_LIST = ['austria',
-                'belgium',
-                'bulgaria',
-                'china',
-                'croatia',
-                'cyprus',
-                'czechia',
-                'denmark',
-                'estonia',
-                'finland',
-                'france',
-                'germany',
-                'greece',
-                'hungary',
-                'india',
-                'ireland',
-                'italy',
-                'japan',
-                'latvia',
-                'lithuania',
-                'luxembourg',
-                'malta',
-                'netherlands',
-                'norway',
-                'poland',
-                'portugal',
-                'romania',
-                'slovakia',
-                'slovenia',
-                'sweden',
-                'uk',
-                'mexico',
-                'spain',
-                'brazil',
-                'thailand',
-                'canada',
-                'us',
-                'switzerland',
-                'iceland',
-                'australia',
-                'singapore',
-                'turkey',
-                'nz',
-                'hk',
-                'chile',
-                'taiwan']
-
-MAKE_COUNTRY_LIST = ['uk',
-                     'italy',
-                     'china',
-                     'netherlands',
-                     'japan',
-                     'czechia',
-                     'spain',
-                     'portugal',
-                     'india',
-                     'germany',
-                     'sweden',
-                     'finland',
-                     'singapore',
-                     'nz',
-                     'hk']
+# a bounded pool of connectors, so concurrent snapshot loads neither share one connection nor open them ad hoc; only the loads query it, so its queries get the snapshot timeout
+sql = ConnectionPool(connect = lambda : MySQL(db = "explorer",
+                                              credentials_file = "./credentials/explorer_credentials.json",
+                                              verbose = False,
+                                              GCR = GCR),
+                     max_size = POOL_SIZE,
+                     query_timeout = SNAPSHOT_QUERY_TIMEOUT)
+
+# every endpoint is answered from an in-memory snapshot, mapped from the exported cube when there is one and reloaded when the data version changes
+snapshots = SnapshotStore(sql = sql,
+                          country_list = COUNTRY_LIST,
+                          make_country_list = MAKE_COUNTRY_LIST,
+                          load_workers = POOL_SIZE)
 
 app = Flask(__name__)
 CORS(app)
+# ASGI entry point (e.g. "uvicorn API:asgi_app"), alongside the WSGI app
+# WsgiToAsgi only adapts the interface: every request is still served synchronously by the Flask app, one worker thread per request, so it adds no concurrency over a threaded WSGI server
+asgi_app = WsgiToAsgi(app)
+
+CACHE_MAX_AGE = 600
+
+def unavailable():
+    return jsonify({"error": "data temporarily unavailable for the specified country"}), 503
+
+def conditional_response(snapshot,
+                         endpoint : str,
+                         country : str,
+                         payload) -> Response:
+    """
+    Answers a request with validators derived from the data version, or with a 304 when the client already holds the response.
+
+    The payload is only computed and serialised when the client's copy is missing or stale, and the encoded JSON is reused until the snapshot is reloaded.
+
+    :param snapshot: The snapshot answering the request.
+    :param endpoint: The name of the endpoint.
+    :param country: The country of the request, or the comma-separated countries of a batch request.
+    :param payload: A function computing the payload.
+    :return: The response.
+    """
+    etag = snapshot.etag(endpoint, country)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        # HTTP dates are in UTC; older Werkzeug versions parse them as naive datetimes
+        since = request.if_modified_since
+        if since is not None and since.tzinfo is None:
+            since = since.replace(tzinfo = timezone.utc)
+        not_modified = since is not None and since >= snapshot.last_modified
+    response = Response(status = 304) if not_modified else Response(snapshot.encoded(endpoint, country, payload),
+                                                                    mimetype = "application/json")
+    response.set_etag(etag)
+    response.last_modified = snapshot.last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = CACHE_MAX_AGE
+    return response
+
+def batch_countries() -> list:
+    """
+    Reads the countries of a batch request, passed as a comma-separated "countries" argument (e.g. "countries=uk,italy").
+
+    :return: The requested countries without duplicates, or None if the request is not a batch request.
+    """
+    countries = request.args.get("countries")
+    if countries is None:
+        return None
+    return list(dict.fromkeys(country.strip() for country in countries.split(",") if country.strip() != ""))
+
+def batch_response(endpoint : str,
+                   countries : list,
+                   payload) -> Response:
+    """
+    Answers a batch request with the payloads of several countries, keyed by country, in one response.
+
+    :param endpoint: The name of the endpoint.
+    :param countries: The requested countries.
+    :param payload: A function computing the payload of one country from its CountryCube.
+    :return: The response.
+    """
+    invalid = [country for country in countries if country not in COUNTRY_LIST]
+    if len(countries) == 0 or len(invalid) > 0:
+        return jsonify({"error": f"data not available for the specified countries: {', '.join(invalid)}"}), 400
+
+    snapshot = snapshots.get()
+    if snapshot is None or any(country not in snapshot.countries for country in countries):
+        return unavailable()
+    return conditional_response(snapshot, endpoint, ",".join(countries), lambda : {country : payload(snapshot.countries[country]) for country in countries})
 
 @app.route("/historicals", 
            methods = ["GET"])
 def historicals_endpoint():
+    countries = batch_countries()
+    if countries is not None:
+        return batch_response("historicals", countries, lambda cube : cube.historicals())
+
     country = request.args.get("country")
 
     if country not in COUNTRY_LIST:
         return jsonify({"error": "data not available for the specified country"}), 400
 
-    query = f"""
-            SELECT 
-                date,
-                fuelType,
-                SUM(registrations) AS registrations
-            FROM 
-                `{country}`
-            WHERE 
-                date >= '2018-01-01'
-            GROUP BY 
-                date, 
-                fuelType
-            """
-    df = sql.read_df(query)
-    df = df.pivot_table(index = "date", 
-                        columns = "fuelType", 
-                        values = "registrations")
-    df = df.reset_index()
-    df = df.fillna(0)
-    result = {}
-    for column in df.columns:
-        result[column] = df[column].to_list()
-    result["lastUpdate"] = df["date"].max()
-    return jsonify(result), 200
+    snapshot = snapshots.get()
+    if snapshot is None or country not in snapshot.countries:
+        return unavailable()
+    return conditional_response(snapshot, "historicals", country, snapshot.countries[country].historicals)
 
 @app.route("/top_makers", 
            methods = ["GET"])
@@ -120,93 +126,27 @@ def top_makers_endpoint():
     if country not in MAKE_COUNTRY_LIST:
         return jsonify({"error": "make data not available for the specified country"}), 400
     
-    query = f"""
-            SELECT 
-                make,
-                BEV_sales,
-                BEV_percentage
-            FROM 
-                `looker_national_top_makers`
-            WHERE 
-                country = '{country}'
-                AND date = (SELECT MAX(date) FROM `looker_national_top_makers` WHERE country = '{country}')
-            """
-    df = sql.read_df(query)
-    df = df.fillna(0)
-    result = {}
-    for column in df.columns:
-        result[column] = df[column].to_list()
-    return jsonify(result), 200
+    snapshot = snapshots.get()
+    if snapshot is None:
+        return unavailable()
+    return conditional_response(snapshot, "top_makers", country, lambda : snapshot.top_makers_payload(country))
 
 @app.route("/table", 
            methods = ["GET"])
 def table_endpoint():
+    countries = batch_countries()
+    if countries is not None:
+        return batch_response("table", countries, lambda cube : cube.table())
+
     country = request.args.get("country")
 
     if country not in COUNTRY_LIST:
         return jsonify({"error": "data not available for the specified country"}), 400
 
-    query = f"""
-            WITH current_period AS (
-                SELECT 
-                    DISTINCT date
-                FROM 
-                    `{country}`
-                ORDER BY 
-                    date DESC
-                LIMIT 12
-            ),
-            previous_period AS (
-                SELECT
-                    DISTINCT date
-                FROM
-                    `{country}`
-                ORDER BY 
-                    date DESC
-                LIMIT 12 OFFSET 12
-            ),
-            current_period_agg AS (
-                SELECT 
-                    fuelType,
-                    SUM(registrations) AS current_period_reg
-                FROM 
-                    `{country}`
-                WHERE 
-                    date IN (SELECT date FROM current_period)
-                GROUP BY 
-                    fuelType
-            ),
-            previous_period_agg AS (
-                SELECT 
-                    fuelType,
-                    SUM(registrations) AS previous_period_reg
-                FROM 
-                    `{country}`
-                WHERE 
-                    date IN (SELECT date FROM previous_period)
-                GROUP BY 
-                    fuelType
-            )
-            SELECT 
-                current_period_agg.fuelType,
-                current_period_agg.current_period_reg AS total,
-                ((current_period_agg.current_period_reg - previous_period_agg.previous_period_reg) / previous_period_agg.previous_period_reg) * 100 AS perc_change,
-                (current_period_agg.current_period_reg / (SELECT SUM(current_period_reg) FROM `current_period_agg`)) * 100 AS share
-            FROM 
-                `current_period_agg`
-            INNER JOIN
-                `previous_period_agg`
-            ON
-                current_period_agg.fuelType = previous_period_agg.fuelType
-            ORDER BY 
-                total DESC
-            """
-    df = sql.read_df(query)
-    df = df.fillna(0)
-    result = {}
-    for column in df.columns:
-        result[column] = df[column].to_list()
-    return jsonify(result), 200
+    snapshot = snapshots.get()
+    if snapshot is None or country not in snapshot.countries:
+        return unavailable()
+    return conditional_response(snapshot, "table", country, snapshot.countries[country].table)
 
 @app.route("/table2", 
            methods = ["GET"])
@@ -216,49 +156,10 @@ def table2_endpoint():
     if country not in COUNTRY_LIST:
         return jsonify({"error": "data not available for the specified country"}), 400
 
-    query = f"""
-            WITH current_month_agg AS (
-                SELECT 
-                    fuelType,
-                    SUM(registrations) AS current_month_reg
-                FROM 
-                    `{country}`
-                WHERE 
-                    date = (SELECT MAX(date) FROM `{country}`)
-                GROUP BY 
-                    fuelType
-            ),
-            previous_month_agg AS (
-                SELECT 
-                    fuelType,
-                    SUM(registrations) AS previous_month_reg
-                FROM 
-                    `{country}`
-                WHERE 
-                    date = DATE_SUB((SELECT MAX(date) FROM `{country}`), INTERVAL 1 YEAR)
-                GROUP BY 
-                    fuelType
-            )
-            SELECT 
-                current_month_agg.fuelType,
-                current_month_agg.current_month_reg AS total,
-                ((current_month_agg.current_month_reg - previous_month_agg.previous_month_reg) / previous_month_agg.previous_month_reg) * 100 AS perc_change,
-                (current_month_agg.current_month_reg / (SELECT SUM(current_month_reg) FROM `current_month_agg`)) * 100 AS share
-            FROM 
-                `current_month_agg`
-            INNER JOIN
-                `previous_month_agg`
-            ON
-                current_month_agg.fuelType = previous_month_agg.fuelType
-            ORDER BY 
-                total DESC
-            """
-    df = sql.read_df(query)
-    df = df.fillna(0)
-    result = {}
-    for column in df.columns:
-        result[column] = df[column].to_list()
-    return jsonify(result), 200
+    snapshot = snapshots.get()
+    if snapshot is None or country not in snapshot.countries:
+        return unavailable()
+    return conditional_response(snapshot, "table2", country, snapshot.countries[country].table2)
 
 @app.route("/top_makers2", 
            methods = ["GET"])
@@ -268,60 +169,23 @@ def top_makers2_endpoint():
     if country not in MAKE_COUNTRY_LIST:
         return jsonify({"error": "make data not available for the specified country"}), 400
     
-    query = f"""
-            WITH top_five_makes AS (
-                SELECT 
-                    make 
-                FROM 
-                    `{country}` 
-                WHERE 
-                    date = (SELECT MAX(date) FROM `{country}`) 
-                GROUP BY 
-                    make 
-                ORDER BY 
-                    SUM(registrations) DESC 
-                LIMIT 5
-            ),
-            table1 AS (
-                SELECT 
-                    make,
-                    fuelType,
-                    SUM(registrations) AS registrations
-                FROM 
-                    `{country}`
-                WHERE 
-                    date = (SELECT MAX(date) FROM `{country}`) 
-                    AND make IN (SELECT make FROM `top_five_makes`)
-                GROUP BY 
-                    make, 
-                    fuelType
-            ),
-            table2 AS (
-                SELECT
-                    make,
-                    SUM(registrations) AS total_registrations
-                FROM
-                    `table1`
-                GROUP BY 
-                    make
-            )
-            SELECT
-                table1.make,
-                fuelType,
-                ROUND((table1.registrations / table2.total_registrations) * 100, 1) AS market_share
-            FROM
-                `table1`
-            LEFT JOIN
-                `table2`
-            ON 
-                table1.make = table2.make
-            """
-    df = sql.read_df(query)
-    df = df.fillna(0)
-    result = {}
-    for column in df.columns:
-        result[column] = df[column].to_list()
-    return jsonify(result), 200
-
-if not GCR:
+    snapshot = snapshots.get()
+    if snapshot is None or country not in snapshot.makes:
+        return unavailable()
+    return conditional_response(snapshot, "top_makers2", country, snapshot.makes[country].top_makers2)
+
+@app.route("/country_page", 
+           methods = ["GET"])
+def country_page_endpoint():
+    country = request.args.get("country")
+
+    if country not in COUNTRY_LIST:
+        return jsonify({"error": "data not available for the specified country"}), 400
+
+    snapshot = snapshots.get()
+    if snapshot is None or country not in snapshot.countries or (country in MAKE_COUNTRY_LIST and country not in snapshot.makes):
+        return unavailable()
+    return conditional_response(snapshot, "country_page", country, lambda : snapshot.country_page(country))
+
+if not GCR and __name__ == "__main__":
     app.run(debug = True)
@@ -0,0 +1,139 @@
+from modules.cubeModules import COUNTRY_LIST, MAKE_COUNTRY_LIST
+import argparse
+import random
+import threading
+import time
+import numpy as np
+import pandas as pd
+import requests
+
+# create a command-line argument parser
+# seed a local MySQL-compatible server (e.g. a MySQL or MariaDB container), point the API credentials at it, start the API, then run the load
+# no results are recorded in the repository: the latencies of the snapshot-backed API have not been measured against the previous per-request queries yet
+parser = argparse.ArgumentParser(description = 'This script load-tests the API, optionally after seeding a local MySQL-compatible stand-in of the explorer database with synthetic data.')
+parser.add_argument('--url',
+                    help = "Choose the base URL of the API.",
+                    default = 'http://127.0.0.1:5000',
+                    type = str)
+parser.add_argument('--clients',
+                    help = "Choose the number of concurrent clients.",
+                    default = 32,
+                    type = int)
+parser.add_argument('--duration',
+                    help = "Choose the duration of the load in seconds.",
+                    default = 30,
+                    type = int)
+parser.add_argument('--revalidate',
+                    help = "Choose the share of requests sent with the ETag of a previous response (e.g. 0.5).",
+                    default = 0.0,
+                    type = float)
+parser.add_argument('--seed',
+                    help = "Seed the stand-in database before the load, then exit.",
+                    action = 'store_true')
+parser.add_argument('--db-host',
+                    help = "Choose the host of the stand-in database.",
+                    default = '127.0.0.1',
+                    type = str)
+parser.add_argument('--db-port',
+                    help = "Choose the port of the stand-in database.",
+                    default = 3306,
+                    type = int)
+parser.add_argument('--db-user',
+                    help = "Choose the user of the stand-in database.",
+                    default = 'root',
+                    type = str)
+parser.add_argument('--db-password',
+                    help = "Choose the password of the stand-in database.",
+                    default = '',
+                    type = str)
+args = parser.parse_args()
+
+def seed() -> None:
+    """
+    Creates the explorer database on the stand-in server and fills every country table with synthetic monthly registrations since 2015.
+
+    :return: None
+    """
+    import pymysql
+    connection = pymysql.connect(host = args.db_host,
+                                 port = args.db_port,
+                                 user = args.db_user,
+                                 password = args.db_password,
+                                 autocommit = True)
+    months = pd.date_range('2015-01-01', pd.Timestamp.today().normalize().replace(day = 1), freq = 'MS').date
+    fuel_types = ['BEV', 'PHEV', 'HEV', 'Petrol', 'Diesel', 'Other']
+    makes = [f'Make {i}' for i in range(40)]
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE DATABASE IF NOT EXISTS explorer')
+        cursor.execute('USE explorer')
+        for country in COUNTRY_LIST:
+            cursor.execute(f'DROP TABLE IF EXISTS `{country}`')
+            cursor.execute(f'CREATE TABLE `{country}` (date DATE, make VARCHAR(64), fuelType VARCHAR(16), registrations INT, INDEX (date))')
+            country_makes = makes if country in MAKE_COUNTRY_LIST else [None]
+            rows = [(month, make, fuel_type, random.randint(0, 5000)) for month in months for make in country_makes for fuel_type in fuel_types]
+            cursor.executemany(f'INSERT INTO `{country}` VALUES (%s, %s, %s, %s)', rows)
+        cursor.execute('DROP TABLE IF EXISTS `looker_national_top_makers`')
+        cursor.execute('CREATE TABLE `looker_national_top_makers` (date DATE, country VARCHAR(32), make VARCHAR(64), BEV_sales INT, BEV_percentage DOUBLE)')
+        rows = [(months[-1], country, make, random.randint(0, 5000), random.random() * 100) for country in MAKE_COUNTRY_LIST for make in makes[:10]]
+        cursor.executemany('INSERT INTO `looker_national_top_makers` VALUES (%s, %s, %s, %s, %s)', rows)
+    connection.close()
+    print(f'{len(COUNTRY_LIST)} country tables seeded on {args.db_host}:{args.db_port}!')
+    return None
+
+results = []
+results_lock = threading.Lock()
+
+def client(deadline : float) -> None:
+    """
+    Sends requests to random endpoints and countries until the deadline, recording their latency and status.
+
+    :param deadline: The time.monotonic() value at which the client stops.
+    :return: None
+    """
+    session = requests.Session()
+    etags = {}
+    records = []
+    while time.monotonic() < deadline:
+        endpoint = random.choice(['historicals', 'table', 'table2', 'top_makers', 'top_makers2', 'country_page'])
+        country = random.choice(MAKE_COUNTRY_LIST if endpoint.startswith('top_makers') else COUNTRY_LIST)
+        headers = {}
+        if (endpoint, country) in etags and random.random() < args.revalidate:
+            headers['If-None-Match'] = etags[(endpoint, country)]
+        start = time.perf_counter()
+        try:
+            response = session.get(f'{args.url}/{endpoint}',
+                                   params = {'country' : country},
+                                   headers = headers,
+                                   timeout = 30)
+            status = response.status_code
+            if 'ETag' in response.headers:
+                etags[(endpoint, country)] = response.headers['ETag']
+        except requests.RequestException:
+            status = 'error'
+        records.append({'endpoint' : endpoint,
+                        'status' : status,
+                        'ms' : (time.perf_counter() - start) * 1000})
+    with results_lock:
+        results.extend(records)
+    return None
+
+if args.seed:
+    seed()
+else:
+    deadline = time.monotonic() + args.duration
+    threads = [threading.Thread(target = client, args = (deadline,)) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(results) == 0:
+        print('no requests completed...')
+    else:
+        df = pd.DataFrame(results)
+        summary = df.groupby('endpoint')['ms'].agg(requests = 'count',
+                                                  p50 = lambda ms : np.percentile(ms, 50),
+                                                  p95 = lambda ms : np.percentile(ms, 95),
+                                                  p99 = lambda ms : np.percentile(ms, 99))
+        print(summary.round(2).to_string())
+        print(f"\n{len(df)} requests in {args.duration}s ({len(df) / args.duration:.0f}/s)")
+        print(df['status'].astype(str).value_counts().to_string())
@@ -8,18 +8,24 @@ import plotly.graph_objects as go
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 import os
+import re
 from dotenv import load_dotenv
 from flask_caching import Cache
 from modules import COUNTRY_WITH_MAKES, AVAILABLE_COUNTRY_LIST, OPTIONS_MAKE, NO_PLOT
 from modules import SCurve_plot, area_plot, mkt_share_plot, top_makes_plot, generate_plotly_layout, generate_colors
 from layout import layout
 from modules.connector import MySQL
+from modules.cubeModules import get_cube
+from modules.topMakesModules import top_make_names
+from modules.backendModules import make_backend
+from modules.coalesceModules import coalesced
 
 load_dotenv()
 
-sql = MySQL(db = 'explorer', 
-            GCR = os.getenv("ENV") == 'GCR', 
-            credentials_files = './credentials/explorer_credentials.json')
+# the queries run on the explorer database, or on a local Parquet dataset with ECC_BACKEND=duckdb
+backend = make_backend(lambda : MySQL(db = 'explorer', 
+                                      GCR = os.getenv("ENV") == 'GCR', 
+                                      credentials_files = './credentials/explorer_credentials.json'))
 
 app = DashProxy(prevent_initial_callbacks = False, 
                 transforms = [MultiplexerTransform()],
@@ -30,7 +36,12 @@ cache = Cache(app.server,
 
 # S-Curve Like Adoption Data
 @cache.memoize(timeout = 3600)
+@coalesced
 def SCurve_query(country : str) -> DataFrame:
+    cube = get_cube()
+    if cube is not None and country in cube.countries:
+        return cube.scurve_frame(country = country,
+                                 start_date = '2018-01-01')
     if country != 'world':
         query = f"""
                 WITH total_table AS (
@@ -69,7 +80,7 @@ def SCurve_query(country : str) -> DataFrame:
                 ORDER BY 
                     date ASC;
                 """
-        df_total = sql.from_sql_to_pandas(query).set_index('date').sort_index()
+        df_total = backend.read_df(query).set_index('date').sort_index()
     else:
         query = f"""
                 SELECT 
@@ -77,14 +88,40 @@ def SCurve_query(country : str) -> DataFrame:
                 FROM 
                     `world_scurve`
                 """        
-        df_total = sql.from_sql_to_pandas(query).set_index('date').sort_index()
+        df_total = backend.read_df(query).set_index('date').sort_index()
     return df_total
 
+def sql_list(values : list) -> str:
+    """
+    Formats strings as a SQL list of quoted literals.
+
+    :param values: The strings.
+    :return: The comma-separated literals, with their quotes escaped.
+    """
+    return ', '.join("'" + value.replace("'", "''") + "'" for value in values)
+
 # Manufacturers - Comparison Data
+def make_names(make_mapping : str) -> tuple:
+    """
+    Parses the quoted list of make names of a manufacturer option (e.g. "'Tesla', 'TESLA'").
+
+    :param make_mapping: The value of the manufacturer option, a comma-separated list of quoted make names, which may themselves contain commas.
+    :return: A tuple of make names.
+    """
+    return tuple(single.replace("''", "'") if single else double
+                 for single, double in re.findall(r"'((?:[^']|'')*)'|\"([^\"]*)\"", make_mapping))
+
 @cache.memoize(timeout = 3600)
+@coalesced
 def get_national_mkt_share(country : str,
                            fuel_type : str,
-                           make_mapping : str) -> DataFrame:
+                           makes : tuple) -> DataFrame:
+    cube = get_cube()
+    if cube is not None and country in cube.make_offsets:
+        return cube.make_share_frame(country = country,
+                                     fuel_type = fuel_type,
+                                     makes = list(makes),
+                                     start_date = '2019-01-01')
     query_share =   f"""
                     WITH totalSales AS (
                         SELECT 
@@ -93,7 +130,7 @@ def get_national_mkt_share(country : str,
                         FROM 
                             explorer.{country}
                         WHERE 
-                            fuelType = "{fuel_type}"
+                            fuelType = '{fuel_type}'
                         GROUP BY 
                             date
                     )
@@ -108,22 +145,27 @@ def get_national_mkt_share(country : str,
                     ON 
                         B.date = A.date
                     WHERE 
-                        A.fuelType = "{fuel_type}"
-                        AND A.make IN ({make_mapping})
-                        AND A.date >= "2019-01-01"
+                        A.fuelType = '{fuel_type}'
+                        AND A.make IN ({sql_list(makes)})
+                        AND A.date >= '2019-01-01'
                     GROUP BY
                         A.date, 
                         B.total
                     ORDER BY 
                         A.date ASC;
                     """
-    df = sql.from_sql_to_pandas(query_share)
+    df = backend.read_df(query_share)
     return df
 
 # Monthly New Registrations Data
 @cache.memoize(timeout = 3600)
+@coalesced
 def national_area_plot(country : str) -> DataFrame:
-    return sql.from_sql_to_pandas(sql_query =   f"""
+    cube = get_cube()
+    if cube is not None and country in cube.countries:
+        return cube.national_frame(country = country,
+                                   start_date = '2018-01-01')
+    return backend.read_df(sql_query =   f"""
                                                 SELECT
                                                     date,
                                                     fuelType,
@@ -137,10 +179,40 @@ def national_area_plot(country : str) -> DataFrame:
                                                     fuelType
                                                 """)
 
+def top_makes_rows(country : str,
+                   makes : list,
+                   width : str) -> DataFrame:
+    """
+    Selects the BEV rows of the top makes of a country, with every column of the country table.
+
+    :param country: The country.
+    :param makes: The top makes.
+    :param width: The line width of the top makes in the plot ('thick' or 'thin').
+    :return: A Pandas DataFrame with the columns of the country table and the width column.
+    """
+    return backend.read_df(sql_query =   f"""
+                                                SELECT
+                                                    Country.*,
+                                                    '{width}' AS width
+                                                FROM
+                                                    `{country}` AS Country
+                                                WHERE
+                                                    fuelType = 'BEV'
+                                                    AND {f'make IN ({sql_list(makes)})' if len(makes) > 0 else 'FALSE'}
+                                                """)
+
 # Top BEV Manufacturers Data
 @cache.memoize(timeout = 3600)
+@coalesced
 def top_makes_query(country : str) -> DataFrame:
-    return sql.from_sql_to_pandas(sql_query =   f"""
+    cube = get_cube()
+    frame = cube.top_makes(country) if cube is not None else None
+    if frame is not None and frame.shape[0] > 0:
+        # the ranking is precomputed at cube export, the rows keep every column of the country table
+        return top_makes_rows(country,
+                              top_make_names(frame, 'BEV'),
+                              width = 'thick')
+    return backend.read_df(sql_query =   f"""
                                                 WITH TopMakes AS (
                                                     SELECT 
                                                         make
@@ -169,8 +241,15 @@ def top_makes_query(country : str) -> DataFrame:
 
 # Top BEV Manufacturers Data
 @cache.memoize(timeout = 3600)
+@coalesced
 def top_makes_query2(country : str) -> DataFrame:
-    return sql.from_sql_to_pandas(sql_query =   f"""
+    cube = get_cube()
+    if cube is not None and cube.looker_top_makes is not None:
+        # the ranking is precomputed at cube export, the rows keep every column of the country table
+        return top_makes_rows(country,
+                              cube.looker_top_makes.get(country, []),
+                              width = 'thin')
+    return backend.read_df(sql_query =   f"""
                                                 WITH Looker AS (
                                                     SELECT
                                                         *, 
@@ -267,7 +346,7 @@ def update_graph(type_dataset,
             country = country.lower()
             df = get_national_mkt_share(country,
                                         fuelType,
-                                        make_mapping)
+                                        make_names(make_mapping))
             if df.shape[0] == 0:
                 missing_countries.append(country)
             df.set_index('date',
@@ -0,0 +1,196 @@
+import atexit
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from modules.connector import MyBucket
+from modules import BUCKET_NAME
+from modules.timingModules import stage
+
+ARCHIVE_INDEX_FILE = 'data/archive_index.json'
+ARCHIVE_DIR_ENV = 'ECC_ARCHIVE_DIR'
+
+_archiver = None
+_archiver_lock = threading.Lock()
+
+class LocalArchiveStore:
+
+    def __init__(self,
+                 path : str) -> None:
+        """
+        Initialises the LocalArchiveStore class, a local directory standing in for the global_ecc bucket.
+
+        :param path: The directory in which the archived files are stored.
+        :return: None
+        """
+        self.path = path
+        return None
+
+    def put(self,
+            path_file : str,
+            key : str) -> None:
+        """
+        Stores a file under a key.
+
+        :param path_file: The path of the file to store.
+        :param key: The key of the file, used as a relative path.
+        :return: None
+        """
+        destination = os.path.join(self.path, key)
+        os.makedirs(os.path.dirname(destination),
+                    exist_ok = True)
+        shutil.copyfile(path_file, destination)
+        return None
+
+class BucketArchiveStore:
+
+    def __init__(self,
+                 bucket_name : str = BUCKET_NAME) -> None:
+        """
+        Initialises the BucketArchiveStore class, which stores files in a Cloud Storage bucket.
+
+        :param bucket_name: The name of the bucket.
+        :return: None
+        """
+        self.bucket_name = bucket_name
+        self.bucket = None
+        return None
+
+    def put(self,
+            path_file : str,
+            key : str) -> None:
+        """
+        Uploads a file under a key.
+
+        :param path_file: The path of the file to upload.
+        :param key: The key of the file, used as the blob name.
+        :return: None
+        """
+        if self.bucket is None:
+            self.bucket = MyBucket(bucket_name = self.bucket_name)
+        self.bucket.upload_file_to_bucket(path_file = path_file,
+                                          destination_blob_name = key)
+        return None
+
+class Archiver:
+
+    def __init__(self,
+                 store = None,
+                 index_file : str = ARCHIVE_INDEX_FILE) -> None:
+        """
+        Initialises the Archiver class, which compresses raw source files and stores them from a background thread.
+
+        Files are stored under "{country}/{date}/{hash}.{extension}.gz", where the hash is the first 16 characters of the SHA-256 digest of the content, and a content already archived for a country is skipped. Uploads overlap with parsing and loading; pending uploads are waited for on exit.
+
+        :param store: The store in which the files are archived (a BucketArchiveStore or a LocalArchiveStore). Defaults to the global_ecc bucket.
+        :param index_file: The path of the JSON file listing the archived keys.
+        :return: None
+        """
+        self.store = store if store is not None else BucketArchiveStore()
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        if os.path.isfile(index_file):
+            with open(index_file, 'r') as file:
+                self.index = json.load(file)
+        else:
+            self.index = {}
+        self.executor = ThreadPoolExecutor(max_workers = 1)
+        atexit.register(self.close)
+        return None
+
+    def archive(self,
+                country : str,
+                date : str,
+                content : bytes,
+                extension : str,
+                timing_country : str = None) -> Future:
+        """
+        Queues a raw source file for archival, unless the same content has already been archived for the country.
+
+        :param country: The country the file belongs to (e.g. 'finland').
+        :param date: The date the file refers to, or the date it was retrieved.
+        :param content: The content of the file.
+        :param extension: The extension of the file (e.g. 'csv').
+        :param timing_country: An optional country code under which the duration of the upload is recorded.
+        :return: A Future resolving to the key of the archived file, or None if the content was already archived.
+        """
+        content_hash = hashlib.sha256(content).hexdigest()[:16]
+        index_key = f'{country}/{content_hash}'
+        with self.lock:
+            if index_key in self.index:
+                future = Future()
+                future.set_result(None)
+                return future
+            # reserve the entry, so the same content queued twice is only uploaded once
+            self.index[index_key] = None
+        key = f'{country}/{date}/{content_hash}.{extension}.gz'
+        return self.executor.submit(self.upload, index_key, key, content, timing_country)
+
+    def upload(self,
+               index_key : str,
+               key : str,
+               content : bytes,
+               timing_country : str = None) -> str:
+        """
+        Compresses and stores a file, then records it in the index.
+
+        :param index_key: The key of the content in the index.
+        :param key: The key under which the file is stored.
+        :param content: The content of the file.
+        :param timing_country: An optional country code under which the duration of the upload is recorded.
+        :return: The key under which the file is stored.
+        """
+        try:
+            with tempfile.NamedTemporaryFile(suffix = '.gz',
+                                             delete = False) as file:
+                file.write(gzip.compress(content))
+            try:
+                if timing_country is None:
+                    self.store.put(file.name, key)
+                else:
+                    with stage(timing_country, 'archive') as measures:
+                        measures['bytes'] = os.path.getsize(file.name)
+                        self.store.put(file.name, key)
+            finally:
+                os.remove(file.name)
+        except Exception:
+            # release the reservation, so the next run retries the upload
+            with self.lock:
+                self.index.pop(index_key, None)
+            raise
+        with self.lock:
+            self.index[index_key] = key
+            os.makedirs(os.path.dirname(self.index_file) or '.',
+                        exist_ok = True)
+            with open(self.index_file + '.tmp', 'w') as index_file:
+                json.dump({k : v for k, v in self.index.items() if v is not None}, index_file, indent = 4)
+            os.replace(self.index_file + '.tmp', self.index_file)
+        return key
+
+    def close(self) -> None:
+        """
+        Waits for the pending uploads.
+
+        :return: None
+        """
+        self.executor.shutdown(wait = True)
+        return None
+
+def get_archiver() -> Archiver:
+    """
+    Returns the archiver shared by every scraper in the process, creating it on first use.
+
+    The archive is stored in the directory named by the ECC_ARCHIVE_DIR environment variable when it is set, and in the global_ecc bucket otherwise.
+
+    :return: The shared archiver.
+    """
+    global _archiver
+    with _archiver_lock:
+        if _archiver is None:
+            archive_dir = os.getenv(ARCHIVE_DIR_ENV)
+            _archiver = Archiver(store = LocalArchiveStore(archive_dir) if archive_dir is not None else None)
+    return _archiver
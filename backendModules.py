@@ -0,0 +1,116 @@
+import os
+import threading
+import pandas as pd
+
+BACKEND_ENV = 'ECC_BACKEND'
+PARQUET_DIR = 'data/parquet'
+PARQUET_DIR_ENV = 'ECC_PARQUET_DIR'
+DATABASE_NAME = 'explorer'
+
+class MySQLBackend:
+
+    def __init__(self,
+                 sql) -> None:
+        """
+        Initialises the MySQLBackend class, which runs the dashboard queries on the explorer database.
+
+        :param sql: The MySQL connector of the explorer database.
+        :return: None
+        """
+        self.sql = sql
+        return None
+
+    def read_df(self,
+                sql_query : str) -> pd.DataFrame:
+        """
+        Runs a query.
+
+        :param sql_query: The query, in MySQL syntax.
+        :return: A Pandas DataFrame containing the result.
+        """
+        return self.sql.from_sql_to_pandas(sql_query)
+
+class DuckDBBackend:
+
+    def __init__(self,
+                 path : str = PARQUET_DIR) -> None:
+        """
+        Initialises the DuckDBBackend class, which runs the dashboard queries with an embedded DuckDB engine on a local Parquet dataset.
+
+        The dataset holds one directory of Parquet files per table, so each country table is its own partition and a query only scans the files of the countries it reads. Every table is exposed as a view, both unqualified and in the explorer schema, and the views read the files at query time, so a new export is picked up without restarting.
+
+        :param path: The directory of the Parquet dataset, as written by export_parquet().
+        :return: None
+        """
+        # DuckDB is only needed when the dashboard runs offline
+        import duckdb
+        self.path = path
+        self.connection = duckdb.connect()
+        self.connection.execute(f'CREATE SCHEMA IF NOT EXISTS {DATABASE_NAME}')
+        for table_name in sorted(os.listdir(path)):
+            if not os.path.isdir(os.path.join(path, table_name)):
+                continue
+            files = os.path.join(path, table_name, '*.parquet').replace("'", "''")
+            for view_name in [f'"{table_name}"', f'{DATABASE_NAME}."{table_name}"']:
+                self.connection.execute(f"CREATE VIEW {view_name} AS SELECT * FROM read_parquet('{files}')")
+        self.lock = threading.Lock()
+        return None
+
+    def read_df(self,
+                sql_query : str) -> pd.DataFrame:
+        """
+        Runs a query.
+
+        The dashboard queries are written for MySQL; their backtick-quoted identifiers are rewritten with double quotes.
+
+        :param sql_query: The query, in MySQL syntax.
+        :return: A Pandas DataFrame containing the result.
+        """
+        # each thread runs its queries on its own cursor of the shared database
+        with self.lock:
+            cursor = self.connection.cursor()
+        try:
+            return cursor.execute(sql_query.replace('`', '"')).df()
+        finally:
+            cursor.close()
+
+def export_parquet(sql,
+                   tables : list,
+                   path : str = PARQUET_DIR) -> None:
+    """
+    Exports tables of the explorer database to a local Parquet dataset, for the DuckDB backend.
+
+    Each table is written to a directory of its own, and its file replaces the previous export of the table in one rename.
+
+    :param sql: The MySQL connector of the explorer database.
+    :param tables: The names of the tables to export.
+    :param path: The directory of the Parquet dataset.
+    :return: None
+    """
+    for table_name in tables:
+        df = sql.read_df(f"""
+                         SELECT
+                             *
+                         FROM
+                             `{table_name}`
+                         """)
+        if 'date' in df.columns:
+            df['date'] = pd.to_datetime(df['date'])
+        path_file = os.path.join(path, table_name, 'data.parquet')
+        os.makedirs(os.path.dirname(path_file),
+                    exist_ok = True)
+        df.to_parquet(path_file + '.tmp',
+                      index = False)
+        os.replace(path_file + '.tmp', path_file)
+    return None
+
+def make_backend(make_sql) -> object:
+    """
+    Creates the backend of the dashboard queries, as chosen by the ECC_BACKEND environment variable.
+
+    :param make_sql: A function creating the MySQL connector, only called for the MySQL backend.
+    :return: A DuckDBBackend on the Parquet dataset named by the ECC_PARQUET_DIR environment variable (or data/parquet) when ECC_BACKEND is 'duckdb', and a MySQLBackend otherwise.
+    """
+    if os.getenv(BACKEND_ENV, 'mysql').lower() == 'duckdb':
+        return DuckDBBackend(path = os.getenv(PARQUET_DIR_ENV, PARQUET_DIR))
+    return MySQLBackend(sql = make_sql())
@@ -0,0 +1,123 @@
+from modules.finnishModules import parse_csv, clean_parsed, TABLE_NAME_FI
+from modules.swissModules import Switzerland, parse_workbook_streaming, workbook_date, append_deduplicated, TABLE_NAME_CH_MAKE, TABLE_NAME_CH_FT, SWITZERLAND_MAKE, SWITZERLAND_FT, UNIQUE_FIELDS_CH_MAKE, JOB_CONFIG_CH_MAKE
+from modules.sinkModules import LocalSink
+from modules.logModules import NullDispatcher
+from modules.timingModules import set_timings_file
+from modules import UNIQUE_FIELDS_2, JOB_CONFIG_2
+import argparse
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+import pandas as pd
+
+# create a command-line argument parser
+# each stage is timed on every recorded source file, so parser regressions show up before deployment
+parser = argparse.ArgumentParser(description = 'This script times the fetch, parse, clean and load stages of the scrapers on recorded source files.')
+parser.add_argument('--fixtures',
+                    help = "Choose a directory of recorded source files, laid out as 'finland/*.csv' and 'switzerland/MOFISPW{year}_{month}.xlsx'.",
+                    default = 'fixtures',
+                    type = str)
+parser.add_argument('--repeat',
+                    help = "Choose the number of times each file is processed.",
+                    default = 3,
+                    type = int)
+parser.add_argument('--baseline',
+                    help = "Choose a JSON file of median stage timings to compare against.",
+                    default = None,
+                    type = str)
+parser.add_argument('--save-baseline',
+                    help = "Choose a JSON file in which the median stage timings are saved.",
+                    default = None,
+                    type = str)
+parser.add_argument('--tolerance',
+                    help = "Choose the relative slowdown against the baseline flagged as a regression (e.g. 0.2 for 20%%).",
+                    default = 0.2,
+                    type = float)
+args = parser.parse_args()
+
+# keep benchmark runs out of the production timing history
+set_timings_file(None)
+
+results = []
+
+def timed(country : str,
+          file_name : str,
+          stage : str,
+          function,
+          *function_args):
+    """
+    Runs one stage and records its duration.
+
+    :param country: The country code.
+    :param file_name: The name of the recorded source file.
+    :param stage: The name of the stage ("fetch", "parse", "clean" or "load").
+    :param function: The function running the stage.
+    :return: The value returned by the function.
+    """
+    start = time.perf_counter()
+    value = function(*function_args)
+    results.append({'country' : country,
+                    'file' : file_name,
+                    'stage' : stage,
+                    'seconds' : time.perf_counter() - start})
+    return value
+
+def read_file(path_file : str) -> bytes:
+    """
+    Reads a recorded source file, standing in for the HTTP download.
+
+    :param path_file: The path of the file.
+    :return: The content of the file.
+    """
+    with open(path_file, 'rb') as file:
+        return file.read()
+
+for _ in range(args.repeat):
+    # each repeat loads into an empty sink, so later repeats do not time a growing table
+    with tempfile.TemporaryDirectory() as sink_dir:
+        sink = LocalSink(path = sink_dir)
+        for path_file in sorted(glob.glob(os.path.join(args.fixtures, 'finland', '*.csv'))):
+            file_name = os.path.basename(path_file)
+            content = timed('FI', file_name, 'fetch', read_file, path_file)
+            df = timed('FI', file_name, 'parse', parse_csv, content)
+            df = timed('FI', file_name, 'clean', clean_parsed, df)
+            timed('FI', file_name, 'load', sink.replace_table, TABLE_NAME_FI, df)
+        for path_file in sorted(glob.glob(os.path.join(args.fixtures, 'switzerland', 'MOFISPW*.xlsx'))):
+            file_name = os.path.basename(path_file)
+            switzerland_instance = Switzerland(date = workbook_date(file_name),
+                                               bq = sink,
+                                               slack = NullDispatcher())
+            content = timed('CH', file_name, 'fetch', read_file, path_file)
+            switzerland_instance.df = timed('CH', file_name, 'parse', parse_workbook_streaming, content)
+            make_df = timed('CH', file_name, 'clean', switzerland_instance.clean_make_data)
+            fuel_type_df = timed('CH', file_name, 'clean', switzerland_instance.clean_fuel_type_data)
+            # the load goes through the dedupe index, as in production
+            timed('CH', file_name, 'load', append_deduplicated, sink, TABLE_NAME_CH_MAKE, SWITZERLAND_MAKE, make_df, UNIQUE_FIELDS_CH_MAKE, JOB_CONFIG_CH_MAKE)
+            timed('CH', file_name, 'load', append_deduplicated, sink, TABLE_NAME_CH_FT, SWITZERLAND_FT, fuel_type_df, UNIQUE_FIELDS_2, JOB_CONFIG_2)
+
+if len(results) == 0:
+    print(f'no recorded source files found in {args.fixtures}...')
+    sys.exit(0)
+
+df = pd.DataFrame(results)
+# sum the stages run several times per file (e.g. the two Swiss cleaners), then take the median over repeats and files
+per_file = df.groupby(['country', 'file', 'stage'])['seconds'].sum() / args.repeat
+summary = per_file.groupby(['country', 'stage']).median().unstack('stage')
+print(summary.round(4).to_string())
+
+medians = {f'{country}/{stage}' : seconds for (country, stage), seconds in per_file.groupby(['country', 'stage']).median().items()}
+if args.save_baseline is not None:
+    with open(args.save_baseline, 'w') as file:
+        json.dump(medians, file, indent = 4)
+
+if args.baseline is not None:
+    with open(args.baseline, 'r') as file:
+        baseline = json.load(file)
+    regressions = [f'{key}: {seconds:.4f}s vs {baseline[key]:.4f}s' for key, seconds in medians.items() if key in baseline and seconds > baseline[key] * (1 + args.tolerance)]
+    if len(regressions) > 0:
+        print('\nregressions:\n' + '\n'.join(regressions))
+        sys.exit(1)
+    print('\nno regressions against the baseline')
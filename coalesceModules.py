@@ -0,0 +1,75 @@
+import copy
+import functools
+import threading
+from concurrent.futures import Future
+
+class SingleFlight:
+
+    def __init__(self) -> None:
+        """
+        Initialises the SingleFlight class, which coalesces concurrent calls sharing a key into one computation.
+
+        The first caller of a key runs the computation; the callers arriving while it runs wait for it and share its result, or its exception. The next call after it finishes runs again.
+
+        :return: None
+        """
+        self.lock = threading.Lock()
+        self.calls = {}
+        return None
+
+    def do(self,
+           key,
+           function,
+           *function_args,
+           copy_result : bool = False,
+           **function_kwargs):
+        """
+        Runs a function once for all the concurrent callers of a key.
+
+        :param key: The key identifying identical calls.
+        :param function: The function.
+        :param copy_result: Whether each caller, the one running the function included, gets its own deep copy of the result, so one caller modifying it (e.g. a DataFrame) does not affect the others. The shared result is a copy made before any caller gets it, so the copies are never taken while a caller modifies its result.
+        :return: The value returned by the function.
+        """
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self.calls[key] = future
+        if not leader:
+            result = future.result()
+            return copy.deepcopy(result) if copy_result else result
+        try:
+            result = function(*function_args, **function_kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+        if copy_result:
+            # the callers copy the shared result, which none of them holds
+            result, shared = copy.deepcopy(result), result
+            future.set_result(shared)
+            return result
+        future.set_result(result)
+        return result
+
+def coalesced(function):
+    """
+    Decorates a function so concurrent calls with the same arguments run it once and share a copy of its result.
+
+    Placed under @cache.memoize, it makes the callers missing the cache at the same time wait for one computation, instead of each querying the database.
+
+    :param function: The function.
+    :return: The decorated function.
+    """
+    flights = SingleFlight()
+
+    @functools.wraps(function)
+    def wrapper(*function_args, **function_kwargs):
+        key = (function_args, tuple(sorted(function_kwargs.items())))
+        return flights.do(key, function, *function_args, copy_result = True, **function_kwargs)
+
+    return wrapper
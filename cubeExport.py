@@ -0,0 +1,34 @@
+from modules.mysql import MySQL
+from modules.cubeModules import export_cube, get_cube, CUBE_DIR, CUBE_DIR_ENV, COUNTRY_LIST, MAKE_COUNTRY_LIST
+from modules.snapshotModules import read_data_version, version_tables
+import argparse
+import os
+from dotenv import load_dotenv
+
+# create a command-line argument parser
+# run after the explorer database is refreshed, so the API and dashboard workers map the new data without querying it
+parser = argparse.ArgumentParser(description = 'This script exports the explorer database to the memory-mapped registrations cube shared by the API and the dashboard.')
+parser.add_argument('--dir',
+                    help = "Choose the directory in which the cubes are exported.",
+                    default = os.getenv(CUBE_DIR_ENV, CUBE_DIR),
+                    type = str)
+parser.add_argument('--force',
+                    help = "Export the cube even if the data version did not change.",
+                    action = 'store_true')
+args = parser.parse_args()
+
+load_dotenv()
+sql = MySQL(db = "explorer",
+            credentials_file = "./credentials/explorer_credentials.json",
+            verbose = False,
+            GCR = os.getenv("ENV_API") is not None)
+
+version = read_data_version(sql, version_tables(COUNTRY_LIST, MAKE_COUNTRY_LIST))
+cube = get_cube(args.dir)
+if not args.force and version is not None and cube is not None and cube.version == version:
+    print(f'cube already exported at version {version}...')
+else:
+    cube_dir = export_cube(sql = sql,
+                           version = version,
+                           path = args.dir)
+    print(f'cube exported to {cube_dir}!')
@@ -0,0 +1,466 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from modules.summaryModules import MISSING, NULL_SUM, country_summaries, registration_counts
+from modules.topMakesModules import top_makes_frame, looker_top_makes, TOP_MAKES_COLUMNS
+
+CUBE_DIR = 'data/cube'
+CUBE_DIR_ENV = 'ECC_CUBE_DIR'
+CUBE_KEEP_VERSIONS = 2
+
+COUNTRY_LIST = ['austria',
+                'belgium',
+                'bulgaria',
+                'china',
+                'croatia',
+                'cyprus',
+                'czechia',
+                'denmark',
+                'estonia',
+                'finland',
+                'france',
+                'germany',
+                'greece',
+                'hungary',
+                'india',
+                'ireland',
+                'italy',
+                'japan',
+                'latvia',
+                'lithuania',
+                'luxembourg',
+                'malta',
+                'netherlands',
+                'norway',
+                'poland',
+                'portugal',
+                'romania',
+                'slovakia',
+                'slovenia',
+                'sweden',
+                'uk',
+                'mexico',
+                'spain',
+                'brazil',
+                'thailand',
+                'canada',
+                'us',
+                'switzerland',
+                'iceland',
+                'australia',
+                'singapore',
+                'turkey',
+                'nz',
+                'hk',
+                'chile',
+                'taiwan']
+
+MAKE_COUNTRY_LIST = ['uk',
+                     'italy',
+                     'china',
+                     'netherlands',
+                     'japan',
+                     'czechia',
+                     'spain',
+                     'portugal',
+                     'india',
+                     'germany',
+                     'sweden',
+                     'finland',
+                     'singapore',
+                     'nz',
+                     'hk']
+
+_cube = None
+_cube_lock = threading.Lock()
+
+def null_sums(rows : np.ndarray,
+              length : int) -> np.ndarray:
+    """
+    Sums the registrations of make-level rows by month, leaving NULL registrations out as SUM() does.
+
+    :param rows: A 2D int32 array of (month, make, fuel type, registrations) rows.
+    :param length: The number of months.
+    :return: A NumPy array of sums, NaN for the months whose rows only hold NULL registrations (or that have no row).
+    """
+    registered = rows[rows[:, 3] >= 0]
+    sums = np.bincount(registered[:, 0], weights = registered[:, 3], minlength = length)
+    return np.where(np.bincount(registered[:, 0], minlength = length) > 0, sums, np.nan)
+
+def fuel_type_axis(frames : list) -> list:
+    """
+    Lists the fuel types of the fuel type axis of a cube.
+
+    :param frames: DataFrames with a fuelType column.
+    :return: The fuel types, sorted, followed by None if some rows have no fuel type, so they still count towards the totals as they do in SQL.
+    """
+    fuel_types = sorted(set().union(*[set(df['fuelType'].dropna()) for df in frames]))
+    return fuel_types + ([None] if any(df['fuelType'].isna().any() for df in frames) else [])
+
+def fuel_type_codes(fuel_type : pd.Series,
+                    fuel_types : list) -> np.ndarray:
+    """
+    Maps fuel types to their positions on the fuel type axis of a cube.
+
+    :param fuel_type: The fuel types, with NaN or None for the rows without one.
+    :param fuel_types: The fuel type axis, as returned by fuel_type_axis().
+    :return: A NumPy array of positions.
+    """
+    codes = fuel_type.map({value : i for i, value in enumerate(fuel_types) if value is not None})
+    if None in fuel_types:
+        codes = codes.where(fuel_type.notna(), fuel_types.index(None))
+    return codes.to_numpy(dtype = 'int64')
+
+def export_cube(sql,
+                version : str,
+                path : str = CUBE_DIR,
+                country_list : list = COUNTRY_LIST,
+                make_country_list : list = MAKE_COUNTRY_LIST) -> str:
+    """
+    Exports the explorer database to a memory-mappable registrations cube.
+
+    The cube is a directory holding:
+    - registrations.npy, a dense int32 array (country × month × fuel type), with -1 where a fuel type has no row in a month and -2 where its registrations are all NULL, the rows without a fuel type under a None fuel type;
+    - months.npy, the months of the second axis;
+    - makes.npy, a sparse int32 companion with one (month, make, fuel type, registrations) row per make-level aggregate, sorted by country and month;
+    - top_makes.parquet, the top makes table of each country with make-level data (see top_makes_frame());
+    - meta.json, the countries, fuel types and makes indexing the arrays, the make rows of each country, the latest rows of looker_national_top_makers, the makes ranking in its top makers of any month and the rolling-12-month and year-over-year summaries of each country.
+
+    Each export is written to its own directory, then published by atomically replacing the CURRENT file, so readers never see a partial cube.
+
+    :param sql: The MySQL connector of the explorer database.
+    :param version: The data version of the database (see read_data_version() in snapshotModules).
+    :param path: The directory in which the cubes are stored.
+    :param country_list: The countries with national data.
+    :param make_country_list: The countries with make-level data.
+    :return: The directory of the exported cube.
+    """
+    national = {}
+    make_level = {}
+    for country in country_list:
+        if country in make_country_list:
+            df = sql.read_df(f"""
+                             SELECT
+                                 date,
+                                 make,
+                                 fuelType,
+                                 SUM(registrations) AS registrations
+                             FROM
+                                 `{country}`
+                             GROUP BY
+                                 date,
+                                 make,
+                                 fuelType
+                             """)
+            df['date'] = pd.to_datetime(df['date'])
+            make_level[country] = df
+            national[country] = df.groupby(['date', 'fuelType'], as_index = False, dropna = False)['registrations'].sum(min_count = 1)
+        else:
+            df = sql.read_df(f"""
+                             SELECT
+                                 date,
+                                 fuelType,
+                                 SUM(registrations) AS registrations
+                             FROM
+                                 `{country}`
+                             GROUP BY
+                                 date,
+                                 fuelType
+                             """)
+            df['date'] = pd.to_datetime(df['date'])
+            national[country] = df
+    top_makers = sql.read_df("""
+                             SELECT
+                                 country,
+                                 make,
+                                 BEV_sales,
+                                 BEV_percentage
+                             FROM
+                                 `looker_national_top_makers` AS Looker
+                             WHERE
+                                 date = (SELECT MAX(date) FROM `looker_national_top_makers` WHERE country = Looker.country)
+                             """)
+    looker = sql.read_df("""
+                         SELECT
+                             country,
+                             date,
+                             make,
+                             BEV_sales
+                         FROM
+                             `looker_national_top_makers`
+                         """)
+
+    countries = list(national.keys())
+    months = np.array(sorted(set().union(*[set(df['date']) for df in national.values()])), dtype = 'datetime64[D]')
+    fuel_types = fuel_type_axis(list(national.values()))
+    registrations = np.full((len(countries), len(months), len(fuel_types)), MISSING, dtype = 'int32')
+    for i, country in enumerate(countries):
+        df = national[country]
+        registrations[i,
+                      np.searchsorted(months, df['date'].values.astype('datetime64[D]')),
+                      fuel_type_codes(df['fuelType'], fuel_types)] = registration_counts(df['registrations'], country)
+
+    # the summaries of the countries whose data did not change since the previous export are reused
+    previous_meta = {}
+    previous_dir = current_cube(path)
+    if previous_dir is not None and os.path.isfile(os.path.join(previous_dir, 'meta.json')):
+        with open(os.path.join(previous_dir, 'meta.json'), 'r') as file:
+            previous_meta = json.load(file)
+    previous_summaries = previous_meta.get('summaries', {})
+    summaries = {country : country_summaries(dates = months,
+                                             fuel_types = np.array(fuel_types, dtype = object),
+                                             registrations = registrations[i],
+                                             previous = previous_summaries.get(country)) for i, country in enumerate(countries)}
+
+    makes = sorted(set().union(*[set(df['make'].dropna()) for df in make_level.values()]))
+    make_index = {make : i for i, make in enumerate(makes)}
+    make_rows = []
+    make_offsets = {}
+    make_digests = {}
+    start = 0
+    for country, df in make_level.items():
+        df = df.sort_values('date')
+        rows = np.column_stack([np.searchsorted(months, df['date'].values.astype('datetime64[D]')),
+                                df['make'].map(make_index).fillna(MISSING).to_numpy(),
+                                fuel_type_codes(df['fuelType'], fuel_types),
+                                registration_counts(df['registrations'], country)]).astype('int32')
+        make_rows.append(rows)
+        make_offsets[country] = [start, start + rows.shape[0]]
+        start += rows.shape[0]
+        make_digests[country] = hashlib.sha256(rows.tobytes() + '\x00'.join(map(str, df['make'].drop_duplicates())).encode()).hexdigest()[:16]
+    make_rows = np.concatenate(make_rows) if len(make_rows) > 0 else np.empty((0, 4), dtype = 'int32')
+
+    # the top makes of the countries whose make-level data did not change since the previous export are reused
+    previous_top_makes = {}
+    if previous_dir is not None and os.path.isfile(os.path.join(previous_dir, 'top_makes.parquet')):
+        previous_top_makes = dict(tuple(pd.read_parquet(os.path.join(previous_dir, 'top_makes.parquet')).groupby('country')))
+    top_makes = []
+    for country, df in make_level.items():
+        if country in previous_top_makes and previous_meta.get('make_digests', {}).get(country) == make_digests[country]:
+            top_makes.append(previous_top_makes[country])
+        else:
+            top_makes.append(top_makes_frame(df).assign(country = country))
+    top_makes = pd.concat(top_makes, ignore_index = True) if len(top_makes) > 0 else pd.DataFrame(columns = ['country'] + TOP_MAKES_COLUMNS)
+
+    meta = {'version' : version,
+            'exported' : datetime.now().isoformat(timespec = 'seconds'),
+            'countries' : countries,
+            'fuel_types' : fuel_types,
+            'makes' : makes,
+            'make_offsets' : make_offsets,
+            'make_digests' : make_digests,
+            'summaries' : summaries,
+            'top_makers' : {country : group.drop(columns = 'country').fillna(0).to_dict(orient = 'list') for country, group in top_makers.groupby('country')},
+            'looker_top_makes' : looker_top_makes(looker)}
+
+    # write the cube next to the published one, then publish it
+    name = re.sub(r'[^0-9A-Za-z]+', '', version) if version is not None else datetime.now().strftime('%Y%m%d%H%M%S')
+    cube_dir = os.path.join(path, name)
+    staging_dir = cube_dir + '.tmp'
+    shutil.rmtree(staging_dir,
+                  ignore_errors = True)
+    os.makedirs(staging_dir)
+    np.save(os.path.join(staging_dir, 'registrations.npy'), registrations)
+    np.save(os.path.join(staging_dir, 'months.npy'), months)
+    np.save(os.path.join(staging_dir, 'makes.npy'), make_rows)
+    top_makes.to_parquet(os.path.join(staging_dir, 'top_makes.parquet'),
+                         index = False)
+    with open(os.path.join(staging_dir, 'meta.json'), 'w') as file:
+        json.dump(meta, file)
+    shutil.rmtree(cube_dir,
+                  ignore_errors = True)
+    os.replace(staging_dir, cube_dir)
+    with open(os.path.join(path, 'CURRENT.tmp'), 'w') as file:
+        file.write(name)
+    os.replace(os.path.join(path, 'CURRENT.tmp'), os.path.join(path, 'CURRENT'))
+
+    # processes still mapping an older cube keep reading it after it is removed
+    previous = sorted([entry for entry in os.listdir(path) if entry != name and os.path.isdir(os.path.join(path, entry)) and not entry.endswith('.tmp')],
+                      key = lambda entry : os.path.getmtime(os.path.join(path, entry)))
+    for entry in previous[:max(len(previous) - CUBE_KEEP_VERSIONS + 1, 0)]:
+        shutil.rmtree(os.path.join(path, entry),
+                      ignore_errors = True)
+    return cube_dir
+
+def current_cube(path : str = CUBE_DIR) -> str:
+    """
+    Retrieves the directory of the published cube.
+
+    :param path: The directory in which the cubes are stored.
+    :return: The directory of the published cube, or None if no cube was exported.
+    """
+    try:
+        with open(os.path.join(path, 'CURRENT'), 'r') as file:
+            return os.path.join(path, file.read().strip())
+    except FileNotFoundError:
+        return None
+
+class Cube:
+
+    def __init__(self,
+                 cube_dir : str) -> None:
+        """
+        Initialises the Cube class, which maps an exported registrations cube read-only.
+
+        The arrays are memory-mapped rather than read, so every process mapping the same cube shares one copy in the page cache.
+
+        :param cube_dir: The directory of the cube.
+        :return: None
+        """
+        self.cube_dir = cube_dir
+        with open(os.path.join(cube_dir, 'meta.json'), 'r') as file:
+            meta = json.load(file)
+        self.version = meta['version']
+        self.countries = {country : i for i, country in enumerate(meta['countries'])}
+        self.fuel_types = np.array(meta['fuel_types'], dtype = object)
+        # the make rows without a make point to the last entry (index -1)
+        self.makes = np.array(meta['makes'] + [None], dtype = object)
+        self.make_offsets = meta['make_offsets']
+        self.top_makers = meta['top_makers']
+        # None for cubes exported before the ranking was stored
+        self.looker_top_makes = meta.get('looker_top_makes')
+        self.summaries = meta.get('summaries', {})
+        self.top_makes_frames = None
+        self.top_makes_lock = threading.Lock()
+        self.registrations = np.load(os.path.join(cube_dir, 'registrations.npy'),
+                                     mmap_mode = 'r')
+        self.months = np.load(os.path.join(cube_dir, 'months.npy'),
+                              mmap_mode = 'r')
+        self.make_rows = np.load(os.path.join(cube_dir, 'makes.npy'),
+                                 mmap_mode = 'r')
+        return None
+
+    def national(self,
+                 country : str) -> np.ndarray:
+        """
+        Returns the month × fuel type registrations of a country, as a view on the mapped cube.
+
+        :param country: The country.
+        :return: A 2D int32 array, with -1 where a fuel type has no row in a month.
+        """
+        return self.registrations[self.countries[country]]
+
+    def make_level(self,
+                   country : str) -> np.ndarray:
+        """
+        Returns the make-level rows of a country, as a view on the mapped cube.
+
+        :param country: The country.
+        :return: A 2D int32 array of (month, make, fuel type, registrations) rows sorted by month, empty if the country has no make-level data.
+        """
+        start, end = self.make_offsets.get(country, [0, 0])
+        return self.make_rows[start:end]
+
+    def top_makes(self,
+                  country : str) -> pd.DataFrame:
+        """
+        Returns the top makes table of a country, reading the table of every country on first use.
+
+        :param country: The country.
+        :return: A Pandas DataFrame with the date, fuel_scope, rank, make, fuelType and registrations columns, empty if the country has no make-level data.
+        """
+        with self.top_makes_lock:
+            if self.top_makes_frames is None:
+                path_file = os.path.join(self.cube_dir, 'top_makes.parquet')
+                df = pd.read_parquet(path_file) if os.path.isfile(path_file) else pd.DataFrame(columns = ['country'] + TOP_MAKES_COLUMNS)
+                self.top_makes_frames = {country : group.drop(columns = 'country').reset_index(drop = True) for country, group in df.groupby('country')}
+        return self.top_makes_frames.get(country, pd.DataFrame(columns = TOP_MAKES_COLUMNS))
+
+    def national_frame(self,
+                       country : str,
+                       start_date : str = None) -> pd.DataFrame:
+        """
+        Returns the registrations of a country by month and fuel type, as the national_area_plot() query does.
+
+        :param country: The country.
+        :param start_date: An optional first month (e.g. '2018-01-01').
+        :return: A Pandas DataFrame with the date, fuelType and registrations columns, the registrations NaN where their sum is NULL.
+        """
+        values = self.national(country)
+        month_indices, fuel_indices = np.nonzero(values != MISSING)
+        if start_date is not None:
+            keep = self.months[month_indices] >= np.datetime64(start_date)
+            month_indices, fuel_indices = month_indices[keep], fuel_indices[keep]
+        registrations = values[month_indices, fuel_indices]
+        return pd.DataFrame({'date' : pd.to_datetime(self.months[month_indices]),
+                             'fuelType' : self.fuel_types[fuel_indices],
+                             'registrations' : np.where(registrations != NULL_SUM, registrations, np.nan)})
+
+    def scurve_frame(self,
+                     country : str,
+                     start_date : str = None) -> pd.DataFrame:
+        """
+        Returns the BEV and total registrations of a country by month, as the SCurve_query() query does.
+
+        Only the months with BEV rows are kept, as in the inner join of the query, including those whose BEV registrations are all NULL. NULL registrations are left out of the sums, and a sum over NULL registrations only is NaN, as SUM() returns NULL.
+
+        :param country: The country.
+        :param start_date: An optional first month (e.g. '2018-01-01').
+        :return: A Pandas DataFrame indexed by date, with the BEV and Total columns.
+        """
+        values = self.national(country)
+        registered = values >= 0
+        bev = np.flatnonzero(self.fuel_types == 'BEV')
+        rows = (values[:, bev] != MISSING).any(axis = 1) if len(bev) > 0 else np.zeros(values.shape[0], dtype = bool)
+        if start_date is not None:
+            rows &= self.months >= np.datetime64(start_date)
+        totals = np.where(registered.any(axis = 1), np.where(registered, values, 0).sum(axis = 1, dtype = 'float64'), np.nan)
+        bev_totals = np.where(registered[:, bev].any(axis = 1), np.where(registered[:, bev], values[:, bev], 0).sum(axis = 1, dtype = 'float64'), np.nan)
+        df = pd.DataFrame({'date' : pd.to_datetime(self.months[rows]),
+                           'BEV' : bev_totals[rows],
+                           'Total' : totals[rows]})
+        return df.set_index('date').sort_index()
+
+    def make_share_frame(self,
+                         country : str,
+                         fuel_type : str,
+                         makes : list,
+                         start_date : str = None) -> pd.DataFrame:
+        """
+        Returns the registrations of a group of makes and of every make for one fuel type by month, as the get_national_mkt_share() query does.
+
+        :param country: The country.
+        :param fuel_type: The fuel type.
+        :param makes: The makes of the group (e.g. the spellings of one manufacturer).
+        :param start_date: An optional first month (e.g. '2019-01-01').
+        :return: A Pandas DataFrame with the date, partial and total columns, ordered by date. NULL registrations are left out of the sums, and a sum over NULL registrations only is NaN, as SUM() returns NULL.
+        """
+        rows = self.make_level(country)
+        fuel = np.flatnonzero(self.fuel_types == fuel_type)
+        if len(fuel) == 0:
+            return pd.DataFrame(columns = ['date', 'partial', 'total'])
+        rows = rows[rows[:, 2] == fuel[0]]
+        makes = set(makes)
+        make_indices = [i for i, make in enumerate(self.makes) if make in makes]
+        group = rows[np.isin(rows[:, 1], make_indices)]
+        totals = null_sums(rows, len(self.months))
+        partials = null_sums(group, len(self.months))
+        months = np.zeros(len(self.months), dtype = bool)
+        months[group[:, 0]] = True
+        if start_date is not None:
+            months &= self.months >= np.datetime64(start_date)
+        return pd.DataFrame({'date' : pd.to_datetime(self.months[months]),
+                             'partial' : partials[months],
+                             'total' : totals[months]})
+
+def get_cube(path : str = None) -> Cube:
+    """
+    Returns the published cube shared by the process, mapping it on first use and again whenever a new cube is published.
+
+    :param path: The directory in which the cubes are stored. Defaults to the ECC_CUBE_DIR environment variable, or data/cube.
+    :return: The published cube, or None if no cube was exported.
+    """
+    global _cube
+    cube_dir = current_cube(path if path is not None else os.getenv(CUBE_DIR_ENV, CUBE_DIR))
+    if cube_dir is None:
+        return None
+    with _cube_lock:
+        if _cube is None or _cube.cube_dir != cube_dir:
+            _cube = Cube(cube_dir)
+    return _cube
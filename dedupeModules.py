@@ -0,0 +1,172 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from google.api_core.exceptions import NotFound
+from modules.sinkModules import BigQuerySink, key_frame
+
+# the index is rebuilt from the whole table when it is older than this number of days
+DEDUPE_MAX_AGE = 30
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def hash_keys(df : pd.DataFrame,
+              fields : list) -> np.ndarray:
+    """
+    Hashes the key tuples of a DataFrame.
+
+    :param df: The DataFrame.
+    :param fields: The fields identifying duplicate rows.
+    :return: A NumPy array of 64-bit hashes, one per row.
+    """
+    return pd.util.hash_pandas_object(key_frame(df, fields),
+                                      index = False).to_numpy()
+
+class DedupeIndex:
+
+    def __init__(self,
+                 bq : BigQuerySink,
+                 table_id : str,
+                 unique_fields : list,
+                 path : str = None) -> None:
+        """
+        Initialises the DedupeIndex class, a locally cached index of the key tuples stored in a BigQuery table.
+
+        The index holds one 64-bit hash per stored key tuple, along with the last modification time of the table it reflects, read from the table metadata. Before each append, the modification time is checked: if the table was not modified since the index was last synced, which is the case when only this index's owner loads into it, no query is run. Otherwise, the index is refreshed with the rows stored for the dates being appended, so rows loaded for those dates by another process are seen. It is rebuilt from the whole table every DEDUPE_MAX_AGE days. A missing table is indexed as empty.
+
+        :param bq: The sink of the table (a BigQuerySink, or a LocalSink in replay mode).
+        :param table_id: The fully qualified ID of the table.
+        :param unique_fields: The fields identifying duplicate rows.
+        :param path: The directory in which the index is cached. Defaults to the dedupe directory of the sink.
+        :return: None
+        """
+        self.bq = bq
+        self.table_id = table_id
+        self.unique_fields = unique_fields
+        self.path_file = os.path.join(path if path is not None else bq.dedupe_dir, f"{table_id.split('.')[-1]}.npz")
+        self.lock = threading.Lock()
+        self.hashes = np.array([], dtype = np.uint64)
+        self.refreshed_at = None
+        self.table_modified = None
+        if os.path.isfile(self.path_file):
+            cache = np.load(self.path_file)
+            if list(cache['unique_fields']) == list(unique_fields) and 'table_modified' in cache:
+                self.hashes = cache['hashes']
+                self.refreshed_at = datetime.fromisoformat(str(cache['refreshed_at']))
+                self.table_modified = str(cache['table_modified']) or None
+        return None
+
+    def save(self) -> None:
+        """
+        Writes the index to its cache file.
+
+        :return: None
+        """
+        os.makedirs(os.path.dirname(self.path_file),
+                    exist_ok = True)
+        with open(self.path_file + '.tmp', 'wb') as file:
+            np.savez(file,
+                     hashes = self.hashes,
+                     unique_fields = np.array(self.unique_fields),
+                     refreshed_at = np.array(self.refreshed_at.isoformat()),
+                     table_modified = np.array(self.table_modified or ''))
+        os.replace(self.path_file + '.tmp', self.path_file)
+        return None
+
+    def refresh(self,
+                dates : list = None) -> None:
+        """
+        Adds the key tuples stored for the provided dates, or rebuilds the index from the whole table when it is missing or too old. No query is run if the table was not modified since the index was last synced.
+
+        :param dates: An optional list of dates in the format '%Y-%m-%d'. Defaults to a full rebuild.
+        :return: None
+        """
+        with self.lock:
+            full_rebuild = dates is None or self.refreshed_at is None or (datetime.now() - self.refreshed_at).days >= DEDUPE_MAX_AGE
+            if not full_rebuild and len(dates) == 0:
+                return None
+            # read before the query, so a load landing during the query is picked up by the next refresh
+            table_modified = self.bq.table_modified(self.table_id)
+            if table_modified is None:
+                # the first load creates the table
+                self.hashes = np.array([], dtype = np.uint64)
+                self.refreshed_at = datetime.now()
+                self.table_modified = None
+                self.save()
+                return None
+            if not full_rebuild and table_modified == self.table_modified:
+                return None
+            date_list = ', '.join(f"'{date}'" for date in sorted(set(dates or [])))
+            where = '' if full_rebuild else f'WHERE date IN ({date_list})'
+            query = f"""
+                    SELECT
+                        {', '.join(self.unique_fields)}
+                    FROM
+                        `{self.table_id}`
+                    {where}
+                    """
+            try:
+                df = self.bq.read_df(query)
+            except NotFound:
+                # the table was deleted since its metadata was read
+                df = pd.DataFrame(columns = self.unique_fields)
+            hashes = hash_keys(df, self.unique_fields)
+            self.hashes = np.unique(hashes if full_rebuild else np.concatenate([self.hashes, hashes])).astype(np.uint64)
+            self.refreshed_at = datetime.now() if full_rebuild else self.refreshed_at
+            self.table_modified = table_modified
+            self.save()
+        return None
+
+    def filter_new(self,
+                   df : pd.DataFrame) -> pd.DataFrame:
+        """
+        Drops the rows whose key tuples are already stored, or repeated within the DataFrame.
+
+        :param df: The DataFrame to be appended.
+        :return: A Pandas DataFrame containing only the new rows.
+        """
+        hashes = hash_keys(df, self.unique_fields)
+        with self.lock:
+            is_new = ~np.isin(hashes, self.hashes)
+        is_new &= ~pd.Series(hashes).duplicated().to_numpy()
+        return df.loc[is_new]
+
+    def add(self,
+            df : pd.DataFrame) -> None:
+        """
+        Adds the key tuples of rows that have just been appended to the table, and records the modification time of the table after the load, so the load does not trigger a query on the next refresh.
+
+        :param df: The appended DataFrame.
+        :return: None
+        """
+        if df.shape[0] == 0:
+            return None
+        with self.lock:
+            self.hashes = np.union1d(self.hashes, hash_keys(df, self.unique_fields))
+            self.table_modified = self.bq.table_modified(self.table_id)
+            self.save()
+        return None
+
+def get_dedupe_index(bq : BigQuerySink,
+                     table_id : str,
+                     unique_fields : list) -> DedupeIndex:
+    """
+    Returns the dedupe index shared by every scraper in the process for a table of a sink, creating it on first use.
+
+    The index is read from its cache file; refresh() must be called with the dates about to be appended before filtering them.
+
+    :param bq: The sink of the table (a BigQuerySink, or a LocalSink in replay mode).
+    :param table_id: The fully qualified ID of the table.
+    :param unique_fields: The fields identifying duplicate rows.
+    :return: The shared dedupe index.
+    """
+    # each sink caches its indexes in its own directory
+    key = (bq.dedupe_dir, table_id)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = DedupeIndex(bq = bq,
+                                        table_id = table_id,
+                                        unique_fields = unique_fields)
+    return _indexes[key]
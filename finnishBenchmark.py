@@ -0,0 +1,91 @@
+from modules.finnishModules import clean_csv
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+
+# create a command-line argument parser
+parser = argparse.ArgumentParser(description = 'This script compares the legacy and in-memory cleaning of Finnish ECC data on a recorded fixture.')
+parser.add_argument('--fixture',
+                    help = "Choose a CSV file recorded from the saved query (e.g. 'fixtures/finland/all_data.csv').",
+                    default = 'fixtures/finland/all_data.csv',
+                    type = str)
+parser.add_argument('--repeat',
+                    help = "Choose the number of times the fixture is cleaned.",
+                    default = 5,
+                    type = int)
+args = parser.parse_args()
+
+def legacy_clean(content : bytes) -> pd.DataFrame:
+    """
+    Cleans the data as Finland.clean_data() did before cleaning moved in memory: through a temporary CSV file, string dates and object columns.
+
+    :param content: The content of the CSV file.
+    :return: A Pandas DataFrame containing the cleaned data.
+    """
+    with tempfile.NamedTemporaryFile(suffix = '.csv',
+                                     delete = False) as csv_file:
+        csv_file.write(content)
+    df = pd.read_csv(csv_file.name)
+    os.remove(csv_file.name)
+    df = pd.melt(df,
+                 id_vars = ["Month", "Year", "Driving power"],
+                 var_name = "make",
+                 value_name = "registrations")
+    df["date"] = df["Year"].astype(str) + "-" + df["Month"].astype(str) + "-01"
+    df["date"] = pd.to_datetime(df["date"],
+                                format = "%Y-%B-%d")
+    df = df.loc[:, ["Driving power", "make", "registrations", "date"]]
+    df = df.rename(columns = {"Driving power" : "fuelType"})
+    df["registrations"] = pd.to_numeric(df["registrations"].replace("-", "0"))
+    df = df.loc[df["registrations"] != 0]
+    return df
+
+def measure(clean_function,
+            content : bytes) -> tuple:
+    """
+    Cleans the data and measures the elapsed time and the peak memory allocated by Python.
+
+    :param clean_function: The cleaning function to measure.
+    :param content: The content of the CSV file.
+    :return: A tuple of the cleaned DataFrame, the elapsed time in seconds and the peak memory in MiB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = clean_function(content)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+with open(args.fixture, 'rb') as file:
+    content = file.read()
+
+results = []
+outputs = {}
+for name, clean_function in [('legacy', legacy_clean),
+                             ('in-memory', clean_csv)]:
+    for _ in range(args.repeat):
+        df, elapsed, peak = measure(clean_function, content)
+        results.append({'implementation' : name,
+                        'seconds' : elapsed,
+                        'peak_mib' : peak,
+                        'result_mib' : df.memory_usage(deep = True).sum() / 2 ** 20})
+    outputs[name] = df
+
+# check that both implementations return the same rows
+keys = ["fuelType", "make", "date"]
+legacy_df = outputs['legacy'].astype({"fuelType" : str, "make" : str, "registrations" : int}).sort_values(keys).reset_index(drop = True)
+in_memory_df = outputs['in-memory'].astype({"fuelType" : str, "make" : str, "registrations" : int}).sort_values(keys).reset_index(drop = True)
+if not legacy_df.equals(in_memory_df):
+    print('implementations disagree!')
+
+print(pd.DataFrame(results)\
+        .groupby('implementation')\
+        .agg({'seconds' : 'median',
+              'peak_mib' : 'max',
+              'result_mib' : 'max'})\
+        .round(3)\
+        .to_string())
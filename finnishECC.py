@@ -1,5 +1,14 @@
 from modules.finnishModules import Finland
 import os
+import argparse
+
+# create a command-line argument parser
+# by default, only the months after the latest stored date are requested and appended
+parser = argparse.ArgumentParser(description = 'This script retrieves Finnish ECC data from Traficom.')
+parser.add_argument('--full-refresh', 
+                    help = "Replace the whole table instead of appending the new months (e.g. after a correction).", 
+                    action = 'store_true')
+args = parser.parse_args()
 
 # make a subdirectory called finland within a directory called data
 path = os.path.join('data', 
@@ -8,5 +17,4 @@ os.makedirs(path,
             exist_ok = True)
 
 finland_instance = Finland()
-finland_instance.make_request()
-finland_instance.data_to_BQ()
\ No newline at end of file
+finland_instance.run(full_refresh = args.full_refresh)
@@ -1,33 +1,130 @@
 import requests
 import pandas as pd
-from modules.connector import MyBigQuery, SlackBot, MyBucket
-from modules import DATASET_NAME, UNIQUE_FIELDS, JOB_CONFIG, BUCKET_NAME
+import numpy as np
+from modules.archiveModules import Archiver, get_archiver
+from modules.logModules import LogDispatcher, get_log_dispatcher
+from modules.httpModules import get_session, get_source_metadata
+from modules.sinkModules import BigQuerySink
+from google.api_core.exceptions import NotFound
+from modules.timingModules import stage
+from modules import DATASET_NAME, UNIQUE_FIELDS, JOB_CONFIG
+from concurrent.futures import Future
 import os
+import io
+import calendar
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
-FILE_PATH_FI = 'data/finland/all_data.csv'
 FINLAND = 'rugged-baton-283921.globalECC.finland'
 TABLE_NAME_FI = 'finland'
+FINLAND_STAGING = 'rugged-baton-283921.globalECC.finland_staging'
+TABLE_NAME_FI_STAGING = 'finland_staging'
 DESTINATION_BLOB_NAME_FI = 'finland'
+SAVED_QUERY_URL_FI = 'https://trafi2.stat.fi:443/PXWeb/sq/d0f731e4-7a84-444e-9abb-af9aeb2ca1f2'
+MONTH_NUMBERS = {name : number for number, name in enumerate(calendar.month_name) if name}
+# months in which the full history is retrieved and the table is replaced
+FULL_REFRESH_MONTHS_FI = [1]
+
+def parse_csv(content : bytes) -> pd.DataFrame:
+    """
+    Parses the content of a CSV file in the saved query layout, in memory.
+
+    :param content: The content of the CSV file.
+    :return: A Pandas DataFrame with one row per month and driving power and one column per make.
+    """
+    return pd.read_csv(io.BytesIO(content), 
+                       na_values = ["-"], 
+                       dtype = {"Month" : "category",
+                                "Driving power" : "category"})
+
+def clean_parsed(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    Cleans and filters a DataFrame returned by parse_csv().
+
+    Dates are built once per month and driving power before melting, through a vectorised month name lookup. The make and fuel type columns are categorical and registrations are stored as 32-bit integers.
+
+    :param df: The parsed DataFrame.
+    :return: A Pandas DataFrame containing the cleaned data.
+    """
+    # add a date column, mapping each month name category to its number
+    if (df["Month"].cat.codes == -1).any():
+        raise ValueError(f'{int((df["Month"].cat.codes == -1).sum())} rows have no month')
+    unknown_months = [name for name in df["Month"].cat.categories if name not in MONTH_NUMBERS]
+    if len(unknown_months) > 0:
+        raise ValueError(f'unknown month names: {unknown_months}')
+    month_numbers = np.array([MONTH_NUMBERS[name] for name in df["Month"].cat.categories])
+    df["date"] = pd.to_datetime({"year" : df["Year"],
+                                 "month" : month_numbers[df["Month"].cat.codes],
+                                 "day" : 1})
+    df = df.drop(columns = ["Month", "Year"])
+    # melt the DataFrame
+    df = pd.melt(df, 
+                 id_vars = ["Driving power", "date"], 
+                 var_name = "make", 
+                 value_name = "registrations")
+    # drop the missing and zero registrations
+    df = df.loc[df["registrations"].notna() & (df["registrations"] != 0)]
+    df = df.rename(columns = {"Driving power" : "fuelType"})
+    df["make"] = df["make"].astype("category")
+    df["registrations"] = df["registrations"].astype("int32")
+    return df.loc[:, ["fuelType", "make", "registrations", "date"]].reset_index(drop = True)
+
+def to_load_types(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts the compact columns of a DataFrame returned by clean_parsed() to the types of the BigQuery table (strings and 64-bit integers).
+
+    :param df: The cleaned DataFrame.
+    :return: A Pandas DataFrame ready to be loaded.
+    """
+    return df.astype({"fuelType" : str,
+                      "make" : str,
+                      "registrations" : "int64"})
+
+def clean_csv(content : bytes) -> pd.DataFrame:
+    """
+    Cleans and filters the content of a CSV file in the saved query layout, in memory.
+
+    :param content: The content of the CSV file.
+    :return: A Pandas DataFrame containing the cleaned data.
+    """
+    return clean_parsed(parse_csv(content))
 
 class Finland:
 
-    def __init__(self) -> None:
+    COUNTRY_CODE = 'FI'
+
+    def __init__(self,
+                 bq : BigQuerySink = None,
+                 slack : LogDispatcher = None,
+                 session : requests.Session = None,
+                 fixtures_dir : str = None,
+                 archiver : Archiver = None) -> None:
         """
         Initialises the Finland class.
 
+        :param bq: An optional BigQuery sink to share between scrapers, or a LocalSink in replay mode.
+        :param slack: An optional Slack log dispatcher to share between scrapers.
+        :param session: An optional HTTP session to share between scrapers.
+        :param fixtures_dir: An optional directory of recorded source files. When provided, the data is replayed from "{fixtures_dir}/finland/all_data.csv" instead of being requested.
+        :param archiver: An optional archiver for the raw source files. Defaults to the archiver shared by every scraper.
         :return: None
         """  
-        self.bq = MyBigQuery()
-        self.slack = SlackBot(token_file = './credentials/slack.json',
-                              slack_channel = '#global-ecc-scraper')
+        self.bq = bq if bq is not None else BigQuerySink()
+        self.slack = slack if slack is not None else get_log_dispatcher(slack_channel = '#global-ecc-scraper')
+        self.session = session if session is not None else get_session()
+        self.sources = get_source_metadata()
+        self.source_key = None
+        self.unreleased = False
+        self.failed = False
+        self.fixtures_dir = fixtures_dir
+        self.archiver = archiver if archiver is not None else get_archiver()
+        self.content = None
         return None
 
     def print_and_send(self,
                        text : str) -> None:
         """
-        Prints the provided text with the prefix "FI" (the two-letter country code for Finland) and sends it to the "global-ecc-scraper" Slack channel.
+        Prints the provided text with the prefix "FI" (the two-letter country code for Finland) and queues it for the "global-ecc-scraper" Slack channel.
 
         :param text: The text to be printed and sent.
         """
@@ -36,88 +133,177 @@ class Finland:
         self.slack.send_log(text)
         return None
     
-    def make_request(self) -> None:
+    def report_archive(self,
+                       future : Future) -> None:
+        """
+        Reports the failure of a background archival.
+
+        :param future: The Future returned by the archiver.
+        :return: None
+        """
+        if future.exception() is not None:
+            self.print_and_send(f"{future.exception()} : failed to archive the source file...\n\n")
+        return None
+
+    def make_request(self,
+                     forced : bool = False) -> bool:
         """
         Retrieves and processes data up to the most recent date.
 
-        :return: None.
-        """
-        # make a request to retrieve the relevant data in CSV format
-        url = "https://trafi2.stat.fi:443/PXWeb/sq/d0f731e4-7a84-444e-9abb-af9aeb2ca1f2"
-        response = requests.get(url)
-        if response.status_code == 200:
-            # save the response data to a locally stored CSV file
-            with open(FILE_PATH_FI, "wb") as csv_file:
-                csv_file.write(response.content)
-            self.print_and_send(f"successfully retrieved data...\n\n")
-
-            # upload the CSV file to the global_ecc bucket
-            bucket = MyBucket(bucket_name = BUCKET_NAME)
-            bucket.upload_file_to_bucket(path_file = FILE_PATH_FI,
-                                         destination_blob_name = DESTINATION_BLOB_NAME_FI)
-        else:
+        The full history is retrieved through the saved query, with a conditional request. The raw file is archived in the background. The run ends early, before archival, if the source has not changed since it was last ingested, unless the request is forced: a full refresh or a missing table always reloads the full history, so it is requested unconditionally.
+
+        :param forced: Whether to request and process the data even if the source has not changed.
+        :return: True if new data was retrieved, False otherwise.
+        """
+        if self.fixtures_dir is not None:
+            # replay the recorded data, without requests or bucket upload
+            with open(os.path.join(self.fixtures_dir, 'finland', 'all_data.csv'), 'rb') as csv_file:
+                self.content = csv_file.read()
+            self.print_and_send(f"replayed recorded data...\n\n")
+            return True
+        # make a request to retrieve the relevant data in CSV format, unless it has not changed since the last run
+        source_key = SAVED_QUERY_URL_FI
+        with stage(self.COUNTRY_CODE, 'fetch') as measures:
+            response = self.session.get(SAVED_QUERY_URL_FI,
+                                        headers = {} if forced else self.sources.conditional_headers(source_key))
+            measures['bytes'] = len(response.content)
+        if response.status_code not in [200, 304]:
+            self.failed = True
             self.print_and_send(f"failed to retrieve data...\n\n")
-        return None
+            return False
+        content = response.content
+        # the new metadata is recorded either way, so it is committed once the data is ingested
+        if self.sources.is_unchanged(source_key, response) and not forced:
+            self.print_and_send(f"source unchanged since the last run...\n\n")
+            return False
+        self.source_key = source_key
+        # keep the response data in memory for cleaning
+        self.content = content
+        self.print_and_send(f"successfully retrieved data...\n\n")
+
+        # archive the CSV file in the background
+        future = self.archiver.archive(country = DESTINATION_BLOB_NAME_FI,
+                                       date = datetime.now().strftime('%Y-%m-%d'),
+                                       content = content,
+                                       extension = 'csv',
+                                       timing_country = self.COUNTRY_CODE)
+        future.add_done_callback(self.report_archive)
+        return True
 
     def clean_data(self) -> pd.DataFrame:
         """
-        Cleans and filters the data.
+        Cleans and filters the data retrieved by make_request().
 
         :return: A Pandas DataFrame containing the cleaned data.
         """
-        # read the contents of the locally stored CSV file
-        df = pd.read_csv(FILE_PATH_FI)
-        # remove the CSV file
-        os.system(f'rm {FILE_PATH_FI}')
-        # melt the DataFrame
-        df = pd.melt(df, 
-                     id_vars = ["Month", "Year", "Driving power"], 
-                     var_name = "make", 
-                     value_name = "registrations")
-        # add a date column
-        df["date"] = df["Year"].astype(str) + "-" + df["Month"].astype(str) + "-01"
-        df["date"] = pd.to_datetime(df["date"], 
-                                    format = "%Y-%B-%d")
-        # get rid of unnecessary columns
-        df = df.loc[:, ["Driving power", "make", "registrations", "date"]]
-        # rename the columns
-        df = df.rename(columns = {"Driving power" : "fuelType",
-                                  "make" : "make",
-                                  "registrations" : "registrations",
-                                  "date" : "date"})
-        # modify the registrations column by replacing "-" with "0"
-        df["registrations"] = pd.to_numeric(df["registrations"].replace("-", "0"))
-        df = df.loc[df["registrations"] != 0]
-        return df
+        with stage(self.COUNTRY_CODE, 'parse') as measures:
+            measures['bytes'] = len(self.content)
+            df = parse_csv(self.content)
+        with stage(self.COUNTRY_CODE, 'clean'):
+            return clean_parsed(df)
     
-    def data_to_BQ(self) -> None:
+    def get_latest_date(self) -> pd.Timestamp:
+        """
+        Retrieves the latest date stored in the BigQuery table.
+
+        Only a missing table is treated as empty; other errors are raised, so a transient failure does not trigger a full reload.
+
+        :return: The latest stored date, or None if the table is missing or empty.
+        """
+        try:
+            df = self.bq.read_df(f"""SELECT MAX(date) AS latest FROM `{FINLAND}`""")
+        except NotFound:
+            return None
+        if df.shape[0] == 0 or pd.isna(df["latest"].iloc[0]):
+            return None
+        return pd.to_datetime(df["latest"].iloc[0])
+
+    def replace_table(self,
+                      df : pd.DataFrame) -> None:
+        """
+        Atomically replaces the content of the BigQuery table with the provided data.
+
+        The data is loaded into a staging table, which is then copied over the live table in a single copy job, so the live table is never missing.
+
+        :param df: A Pandas DataFrame containing the full history.
+        :return: None
+        """
+        self.bq.delete_table(FINLAND_STAGING)
+        self.bq.append_from_df(table_name = TABLE_NAME_FI_STAGING,
+                               df = df,
+                               dataset_name = DATASET_NAME,
+                               job_config = JOB_CONFIG)
+        self.bq.copy_table(FINLAND_STAGING, 
+                           FINLAND)
+        self.bq.delete_table(FINLAND_STAGING)
+        return None
+
+    def data_to_BQ(self,
+                   latest_date : pd.Timestamp = None) -> None:
         """
         Uploads the data to BigQuery.
 
+        Only the months after the latest stored date are appended. Without a latest date (a full refresh or a missing table), the whole table is atomically replaced instead.
+
+        :param latest_date: The latest date stored in the BigQuery table, as returned by get_latest_date(), or None to replace the whole table.
         :return: None
         """
-        df = self.clean_data()
+        df = to_load_types(self.clean_data())
         # get the current date in the format '%Y-%m' 
         current_date = datetime.now()
         # get the date of the previous month in the format '%Y-%m-01'
         prev_month_date = current_date - relativedelta(months = 1)
         prev_month_date_format = prev_month_date.strftime('%Y-%m') + "-01"
-        if str(df["date"].max()).split()[0] != str(prev_month_date_format):
-            self.print_and_send(f"data for {prev_month_date_format} has not been released yet...\n\n")
-        else:
-            # drop the BigQuery table if it already exists
-            try:
-                self.bq.bq_client.query(f"""DROP TABLE `{FINLAND}`""").result()
-                self.print_and_send(f'{FINLAND} dropped!\n\n')
-            except:
-                pass
-            # push the DataFrame to BigQuery
+        # recorded data is replayed whatever its latest date
+        if self.fixtures_dir is None and str(df["date"].max()).split()[0] != str(prev_month_date_format):
+            self.unreleased = True
+            self.print_and_send(f"data for {prev_month_date.strftime('%Y-%m')} has not been released yet...\n\n")
+            return None
+        if latest_date is None:
+            # replace the whole table
             try:
+                with stage(self.COUNTRY_CODE, 'load') as measures:
+                    measures['bytes'] = int(df.memory_usage(deep = True).sum())
+                    self.replace_table(df)
+                self.print_and_send(f'{FINLAND} refreshed!\n\n')
+            except Exception as e:
+                self.failed = True
+                self.print_and_send(f"{e} : failed to refresh {FINLAND}...\n\n")
+            return None
+        # keep only the months after the latest stored date
+        df = df.loc[df["date"] > latest_date]
+        if df.shape[0] == 0:
+            self.print_and_send(f'{FINLAND} already up to date...\n\n')
+            return None
+        # push the DataFrame to BigQuery
+        try:
+            with stage(self.COUNTRY_CODE, 'load') as measures:
+                measures['bytes'] = int(df.memory_usage(deep = True).sum())
                 self.bq.append_from_df(table_name = TABLE_NAME_FI,
                                        df = df,
                                        dataset_name = DATASET_NAME,
                                        job_config = JOB_CONFIG)
-                self.print_and_send(f'{FINLAND} updated!\n\n')
-            except Exception as e:
-                self.print_and_send(f"{e} : failed to update {FINLAND}...\n\n")
+            self.print_and_send(f'{FINLAND} updated with data from {", ".join(sorted(df["date"].dt.strftime("%Y-%m").unique()))}!\n\n')
+        except Exception as e:
+            self.failed = True
+            self.print_and_send(f"{e} : failed to update {FINLAND}...\n\n")
         return None
+
+    def run(self,
+            full_refresh : bool = False) -> bool:
+        """
+        Retrieves the data and uploads it to BigQuery.
+
+        The saved query always returns the full history. The whole table is replaced with it in the months listed in FULL_REFRESH_MONTHS_FI, when requested, or when the table is missing. Otherwise, only the months after the latest stored date are appended, and nothing is processed if the source has not changed.
+
+        :param full_refresh: Whether to retrieve the full history and replace the whole table.
+        :return: False if the data could not be retrieved or uploaded, True otherwise (including when there was nothing new or the previous month has not been released yet).
+        """
+        full_refresh = full_refresh or datetime.now().month in FULL_REFRESH_MONTHS_FI
+        latest_date = None if full_refresh else self.get_latest_date()
+        if self.make_request(forced = latest_date is None):
+            self.data_to_BQ(latest_date = latest_date)
+            # only remember the source once its data has been ingested
+            if not self.failed:
+                self.sources.commit(self.source_key)
+        return not self.failed
@@ -0,0 +1,31 @@
+from modules.orchestratorModules import Orchestrator, COUNTRY_TIMEOUT, COUNTRY_RETRIES
+import argparse
+import os
+
+# create a command-line argument parser
+# by default, every discovered country scraper is run for its latest data
+parser = argparse.ArgumentParser(description = 'This script runs every country scraper concurrently.')
+parser.add_argument('--countries',
+                    help = "Choose a comma-separated list of country codes (e.g. 'FI,CH').",
+                    default = None,
+                    type = str)
+parser.add_argument('--timeout',
+                    help = "Choose the maximum number of seconds allowed per country.",
+                    default = COUNTRY_TIMEOUT,
+                    type = float)
+parser.add_argument('--retries',
+                    help = "Choose the number of times a country is retried after an error.",
+                    default = COUNTRY_RETRIES,
+                    type = int)
+args = parser.parse_args()
+
+# make a subdirectory per country within a directory called data
+for country in ['finland', 'switzerland']:
+    os.makedirs(os.path.join('data', country),
+                exist_ok = True)
+
+country_codes = None if args.countries is None else [code.strip().upper() for code in args.countries.split(',')]
+orchestrator = Orchestrator(country_codes = country_codes,
+                            timeout = args.timeout,
+                            retries = args.retries)
+orchestrator.run()
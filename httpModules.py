@@ -0,0 +1,151 @@
+import requests
+import threading
+import hashlib
+import json
+import os
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_MAXSIZE = 16
+HTTP_RETRIES = 3
+HTTP_TIMEOUT = 60
+SOURCE_METADATA_FILE = 'data/source_metadata.json'
+
+_session = None
+_source_metadata = None
+_session_lock = threading.Lock()
+
+class TimeoutSession(requests.Session):
+
+    def request(self,
+                *args,
+                **kwargs) -> requests.Response:
+        """
+        Sends a request, applying the default timeout when none is provided.
+
+        :return: The response.
+        """
+        kwargs.setdefault('timeout', HTTP_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+def make_session(pool_maxsize : int = POOL_MAXSIZE) -> requests.Session:
+    """
+    Creates an HTTP session with a connection pool and retries on transient errors.
+
+    :param pool_maxsize: The maximum number of connections kept alive per host.
+    :return: The HTTP session.
+    """
+    session = TimeoutSession()
+    retry = Retry(total = HTTP_RETRIES,
+                  backoff_factor = 1,
+                  status_forcelist = [429, 500, 502, 503, 504],
+                  allowed_methods = ['GET', 'POST'])
+    adapter = HTTPAdapter(pool_connections = pool_maxsize,
+                          pool_maxsize = pool_maxsize,
+                          max_retries = retry)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def get_session() -> requests.Session:
+    """
+    Returns the HTTP session shared by every scraper in the process, creating it on first use.
+
+    :return: The shared HTTP session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+    return _session
+
+class SourceMetadata:
+
+    def __init__(self,
+                 path_file : str = SOURCE_METADATA_FILE) -> None:
+        """
+        Initialises the SourceMetadata class, a persisted store of the ETag, Last-Modified header and content hash of each source.
+
+        Metadata is only persisted once the data retrieved from a source has been ingested (see commit()), so a failed run is retried in full.
+
+        :param path_file: The path of the JSON file in which the metadata is stored.
+        :return: None
+        """
+        self.path_file = path_file
+        self.lock = threading.Lock()
+        self.pending = {}
+        if os.path.isfile(path_file):
+            with open(path_file, 'r') as file:
+                self.metadata = json.load(file)
+        else:
+            self.metadata = {}
+        return None
+
+    def conditional_headers(self,
+                            key : str) -> dict:
+        """
+        Builds the conditional request headers for a source.
+
+        :param key: The key of the source (usually its URL).
+        :return: A dictionary containing the If-None-Match and If-Modified-Since headers known for the source.
+        """
+        with self.lock:
+            metadata = self.metadata.get(key, {})
+        headers = {}
+        if metadata.get('etag') is not None:
+            headers['If-None-Match'] = metadata['etag']
+        if metadata.get('last_modified') is not None:
+            headers['If-Modified-Since'] = metadata['last_modified']
+        return headers
+
+    def is_unchanged(self,
+                     key : str,
+                     response : requests.Response) -> bool:
+        """
+        Checks whether a source has changed since it was last ingested, and records its new metadata until commit() is called.
+
+        :param key: The key of the source (usually its URL).
+        :param response: The response returned by the source.
+        :return: True if the source answered 304 Not Modified or returned the same content as last time, False otherwise.
+        """
+        if response.status_code == 304:
+            return True
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        with self.lock:
+            unchanged = self.metadata.get(key, {}).get('sha256') == content_hash
+            self.pending[key] = {'etag' : response.headers.get('ETag'),
+                                 'last_modified' : response.headers.get('Last-Modified'),
+                                 'sha256' : content_hash}
+        return unchanged
+
+    def commit(self,
+               key : str) -> None:
+        """
+        Persists the metadata recorded for a source once its data has been ingested.
+
+        :param key: The key of the source (usually its URL).
+        :return: None
+        """
+        with self.lock:
+            if key not in self.pending:
+                return None
+            self.metadata[key] = self.pending.pop(key)
+            os.makedirs(os.path.dirname(self.path_file) or '.',
+                        exist_ok = True)
+            # write to a temporary file first, so the store is never left half-written
+            with open(self.path_file + '.tmp', 'w') as file:
+                json.dump(self.metadata, file, indent = 4)
+            os.replace(self.path_file + '.tmp', self.path_file)
+        return None
+
+def get_source_metadata() -> SourceMetadata:
+    """
+    Returns the source metadata store shared by every scraper in the process, creating it on first use.
+
+    :return: The shared source metadata store.
+    """
+    global _source_metadata
+    with _session_lock:
+        if _source_metadata is None:
+            _source_metadata = SourceMetadata()
+    return _source_metadata
@@ -0,0 +1,114 @@
+import os
+import tempfile
+import pandas as pd
+from google.cloud import bigquery
+from modules.sinkModules import BigQuerySink
+from modules import DATASET_NAME
+
+def conform(df : pd.DataFrame,
+            schema : list) -> pd.DataFrame:
+    """
+    Casts the columns of a DataFrame to the types of a BigQuery schema, so they are written to Parquet with matching types.
+
+    :param df: The DataFrame.
+    :param schema: A list of BigQuery SchemaField objects.
+    :return: A Pandas DataFrame with conforming column types.
+    """
+    df = df.copy()
+    for field in schema:
+        if field.name not in df.columns:
+            continue
+        if field.field_type in ['FLOAT', 'FLOAT64']:
+            df[field.name] = pd.to_numeric(df[field.name]).astype('float64')
+        elif field.field_type in ['INTEGER', 'INT64']:
+            df[field.name] = pd.to_numeric(df[field.name]).astype('int64')
+        elif field.field_type == 'DATE':
+            df[field.name] = pd.to_datetime(df[field.name]).dt.date
+        elif field.field_type == 'STRING':
+            # keep the nulls null rather than the string 'nan'
+            df[field.name] = df[field.name].astype(str).where(df[field.name].notna(), None)
+    return df
+
+class BatchLoader:
+
+    def __init__(self,
+                 bq : BigQuerySink,
+                 dataset_name : str = DATASET_NAME) -> None:
+        """
+        Initialises the BatchLoader class, which collects cleaned DataFrames and loads them in a few bulk jobs.
+
+        Every DataFrame added for a table is concatenated and written to one Parquet file, and one load job per table is submitted. The jobs for the different tables run concurrently.
+
+        It is used by the Swiss backfill, which loads many months per table. The monthly runs started by the orchestrator append one month per table and keep loading straight away: each scraper must know whether its own load succeeded before it commits its source metadata and before the orchestrator decides whether to retry it, which a load deferred to a shared flush would not tell it.
+
+        :param bq: The sink of the tables (a BigQuerySink, or a LocalSink in replay mode).
+        :param dataset_name: The name of the dataset the tables belong to.
+        :return: None
+        """
+        self.bq = bq
+        self.dataset_name = dataset_name
+        self.tables = {}
+        return None
+
+    def add(self,
+            table_name : str,
+            df : pd.DataFrame,
+            job_config : bigquery.LoadJobConfig = None,
+            on_loaded = None) -> None:
+        """
+        Queues a DataFrame for a table.
+
+        The rows are expected to be deduplicated already (see append_deduplicated()).
+
+        :param table_name: The name of the table.
+        :param df: The DataFrame to load.
+        :param job_config: The load job configuration of the table, whose schema is kept.
+        :param on_loaded: An optional function called with the DataFrame once it has been loaded.
+        :return: None
+        """
+        table = self.tables.setdefault(table_name, {'frames' : [],
+                                                    'job_config' : job_config,
+                                                    'callbacks' : []})
+        table['frames'].append(df)
+        if on_loaded is not None:
+            table['callbacks'].append((on_loaded, df))
+        return None
+
+    def flush(self) -> dict:
+        """
+        Loads every queued DataFrame and empties the queue.
+
+        :return: A dictionary mapping each table name to the number of loaded rows.
+        """
+        tables, self.tables = self.tables, {}
+        tables = {table_name : table for table_name, table in tables.items() if sum(df.shape[0] for df in table['frames']) > 0}
+        loaded = {}
+        errors = []
+        with tempfile.TemporaryDirectory() as staging_dir:
+            jobs = {}
+            # submit one load job per table, then wait for all of them
+            for table_name, table in tables.items():
+                df = pd.concat(table['frames'],
+                               ignore_index = True)
+                schema = table['job_config'].schema if table['job_config'] is not None and table['job_config'].schema else None
+                if schema is not None:
+                    df = conform(df, schema)
+                path_file = os.path.join(staging_dir, f'{table_name}.parquet')
+                df.to_parquet(path_file,
+                              index = False)
+                jobs[table_name] = (self.bq.load_parquet(path_file = path_file,
+                                                         table_name = table_name,
+                                                         dataset_name = self.dataset_name,
+                                                         schema = schema), df.shape[0])
+            for table_name, (job, rows) in jobs.items():
+                try:
+                    job.result()
+                    loaded[table_name] = rows
+                except Exception as e:
+                    errors.append(f'{table_name}: {e}')
+        for table_name in loaded:
+            for on_loaded, df in tables[table_name]['callbacks']:
+                on_loaded(df)
+        if len(errors) > 0:
+            raise RuntimeError(f"failed to load {'; '.join(errors)}")
+        return loaded
@@ -0,0 +1,151 @@
+import atexit
+import queue
+import threading
+import time
+from modules.connector import SlackBot
+
+SLACK_TOKEN_FILE = './credentials/slack.json'
+LOG_INTERVAL = 5
+LOG_MAX_BATCH = 50
+LOG_CLOSE_TIMEOUT = 10
+# after a failed post, Slack is retried after this number of seconds, doubling on each failure up to the maximum
+LOG_RETRY_BACKOFF = 30
+LOG_MAX_RETRY_BACKOFF = 600
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+class LogDispatcher:
+
+    def __init__(self,
+                 slack_channel : str,
+                 token_file : str = SLACK_TOKEN_FILE,
+                 interval : float = LOG_INTERVAL,
+                 max_batch : int = LOG_MAX_BATCH) -> None:
+        """
+        Initialises the LogDispatcher class, which sends log messages to a Slack channel from a background thread.
+
+        Messages are queued and sent in batches, so several scrapers running at the same time post one digest rather than one message per log line. Queued messages are flushed once on exit. If Slack cannot be reached, the batches are printed locally instead of being sent and Slack is retried after a growing backoff, so logging never delays ingestion.
+
+        :param slack_channel: The Slack channel to send the messages to.
+        :param token_file: The path of the Slack credentials file.
+        :param interval: The number of seconds between two batches.
+        :param max_batch: The maximum number of messages per batch.
+        :return: None
+        """
+        self.slack_channel = slack_channel
+        self.token_file = token_file
+        self.interval = interval
+        self.max_batch = max_batch
+        self.slack = None
+        self.retry_at = None
+        self.retry_backoff = LOG_RETRY_BACKOFF
+        self.queue = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target = self.worker,
+                                       daemon = True)
+        self.thread.start()
+        atexit.register(self.close)
+        return None
+
+    def send_log(self,
+                 text : str) -> None:
+        """
+        Queues a message without blocking.
+
+        :param text: The message to be sent.
+        :return: None
+        """
+        self.queue.put(text)
+        return None
+
+    def worker(self) -> None:
+        """
+        Sends the queued messages every interval until the dispatcher is closed.
+
+        :return: None
+        """
+        while True:
+            stopping = self.stop_event.wait(self.interval)
+            self.flush()
+            if stopping:
+                return None
+
+    def flush(self) -> None:
+        """
+        Sends every queued message, in batches of at most max_batch messages.
+
+        :return: None
+        """
+        messages = []
+        while True:
+            try:
+                messages.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for i in range(0, len(messages), self.max_batch):
+            self.post(''.join(messages[i : i + self.max_batch]))
+        return None
+
+    def post(self,
+             text : str) -> None:
+        """
+        Sends one batch to Slack, printing it locally if Slack fails or is backing off after a failure.
+
+        :param text: The batch to be sent.
+        :return: None
+        """
+        if self.retry_at is not None and time.monotonic() < self.retry_at:
+            print(f'Slack unavailable, batch not sent:\n{text}')
+            return None
+        try:
+            if self.slack is None:
+                self.slack = SlackBot(token_file = self.token_file,
+                                      slack_channel = self.slack_channel)
+            self.slack.send_log(text)
+        except Exception as e:
+            # reconnect on the next attempt, after a longer wait each time
+            self.slack = None
+            self.retry_at = time.monotonic() + self.retry_backoff
+            self.retry_backoff = min(self.retry_backoff * 2, LOG_MAX_RETRY_BACKOFF)
+            print(f'{e} : failed to send to Slack, batch not sent:\n{text}')
+            return None
+        self.retry_at = None
+        self.retry_backoff = LOG_RETRY_BACKOFF
+        return None
+
+    def close(self,
+              timeout : float = LOG_CLOSE_TIMEOUT) -> None:
+        """
+        Flushes the queued messages and stops the background thread.
+
+        :param timeout: The maximum number of seconds to wait for the last batch.
+        :return: None
+        """
+        self.stop_event.set()
+        self.thread.join(timeout)
+        return None
+
+def get_log_dispatcher(slack_channel : str = '#global-ecc-scraper') -> LogDispatcher:
+    """
+    Returns the log dispatcher shared by every scraper in the process for a Slack channel, creating it on first use.
+
+    :param slack_channel: The Slack channel to send the messages to.
+    :return: The shared log dispatcher.
+    """
+    with _dispatchers_lock:
+        if slack_channel not in _dispatchers:
+            _dispatchers[slack_channel] = LogDispatcher(slack_channel = slack_channel)
+    return _dispatchers[slack_channel]
+
+class NullDispatcher:
+
+    def send_log(self,
+                 text : str) -> None:
+        """
+        Discards a message, for runs that must not reach Slack (e.g. replay mode and benchmarks).
+
+        :param text: The message to be discarded.
+        :return: None
+        """
+        return None
@@ -0,0 +1,124 @@
+import importlib
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from modules.sinkModules import BigQuerySink
+from modules.logModules import get_log_dispatcher
+from modules.httpModules import get_session
+
+COUNTRY_TIMEOUT = 1800
+COUNTRY_RETRIES = 2
+RETRY_BACKOFF = 30
+# the modules defining country scrapers, so the API and dashboard modules are never imported by the ingestion
+SCRAPER_MODULES = ['finnishModules', 'swissModules']
+
+def discover_scrapers(module_names : list = SCRAPER_MODULES) -> dict:
+    """
+    Discovers the country scraper classes defined in the scraper modules of the modules package.
+
+    A scraper class is any class defining a COUNTRY_CODE attribute and a run() method (e.g. Finland, Switzerland).
+
+    :param module_names: The names of the scraper modules.
+    :return: A dictionary mapping each country code to its scraper class.
+    """
+    scrapers = {}
+    for module_name in module_names:
+        module = importlib.import_module(f'modules.{module_name}')
+        for _, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ == module.__name__ and hasattr(cls, 'COUNTRY_CODE') and callable(getattr(cls, 'run', None)):
+                scrapers[cls.COUNTRY_CODE] = cls
+    return scrapers
+
+class Orchestrator:
+
+    def __init__(self,
+                 country_codes : list = None,
+                 timeout : float = COUNTRY_TIMEOUT,
+                 retries : int = COUNTRY_RETRIES) -> None:
+        """
+        Initialises the Orchestrator class, which runs the country scrapers concurrently.
+
+        Every scraper shares the same BigQuery sink, Slack log dispatcher and pooled HTTP session, so one country's BigQuery upload overlaps with the other countries' downloads.
+
+        :param country_codes: An optional list of country codes to run. Defaults to every discovered scraper.
+        :param timeout: The maximum number of seconds allowed per country, retries included.
+        :param retries: The number of times a country is retried after an error.
+        :return: None
+        """
+        scrapers = discover_scrapers()
+        if country_codes is not None:
+            unknown = [code for code in country_codes if code not in scrapers]
+            if len(unknown) > 0:
+                raise ValueError(f"no scraper found for {', '.join(unknown)}")
+            scrapers = {code : scrapers[code] for code in country_codes}
+        self.scrapers = scrapers
+        self.timeout = timeout
+        self.retries = retries
+        self.bq = BigQuerySink()
+        self.slack = get_log_dispatcher(slack_channel = '#global-ecc-scraper')
+        self.session = get_session()
+        return None
+
+    def print_and_send(self,
+                       text : str) -> None:
+        """
+        Prints the provided text with the prefix "ALL" and queues it for the "global-ecc-scraper" Slack channel.
+
+        :param text: The text to be printed and sent.
+        """
+        text = 'ALL - ' + text
+        print(text)
+        self.slack.send_log(text)
+        return None
+
+    def run_country(self,
+                    country_code : str) -> str:
+        """
+        Runs one country scraper, retrying after an error or a run reporting a failure.
+
+        A scraper finding that its latest month has not been released yet does not fail, so it is not retried.
+
+        :param country_code: The country code of the scraper.
+        :return: The status of the country ("ok" or "not released").
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                scraper = self.scrapers[country_code](bq = self.bq,
+                                                      slack = self.slack,
+                                                      session = self.session)
+                # the scrapers report their own retrieval and upload errors, and return False after one
+                if scraper.run() is False:
+                    raise RuntimeError(f'{country_code} scraper reported a failure')
+                return 'not released' if getattr(scraper, 'unreleased', False) else 'ok'
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                self.print_and_send(f"{e} : {country_code} failed, retrying ({attempt + 1}/{self.retries})...\n\n")
+                time.sleep(RETRY_BACKOFF * (attempt + 1))
+
+    def run(self) -> dict:
+        """
+        Runs every scraper concurrently and waits for each of them until its timeout.
+
+        The timeout only bounds how long this method waits: a scraper that timed out is reported as such, but its thread cannot be stopped and keeps running in the background, and the interpreter still waits for it on exit.
+
+        :return: A dictionary mapping each country code to its status ("ok", "not released", "failed" or "timed out").
+        """
+        statuses = {}
+        start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers = max(len(self.scrapers), 1))
+        futures = {country_code : executor.submit(self.run_country, country_code) for country_code in self.scrapers}
+        for country_code, future in futures.items():
+            try:
+                statuses[country_code] = future.result(timeout = max(0, start + self.timeout - time.monotonic()))
+            except TimeoutError:
+                statuses[country_code] = 'timed out'
+                self.print_and_send(f"{country_code} timed out after {self.timeout} seconds...\n\n")
+            except Exception as e:
+                statuses[country_code] = 'failed'
+                self.print_and_send(f"{e} : {country_code} failed...\n\n")
+        # do not wait for the scrapers that timed out (their threads are still joined on exit)
+        executor.shutdown(wait = False,
+                          cancel_futures = True)
+        self.print_and_send(f"monthly refresh finished in {time.monotonic() - start:.0f} seconds: {', '.join(f'{code} {status}' for code, status in statuses.items())}\n\n")
+        return statuses
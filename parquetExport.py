@@ -0,0 +1,31 @@
+from modules.mysql import MySQL
+from modules.backendModules import export_parquet, PARQUET_DIR, PARQUET_DIR_ENV
+from modules.cubeModules import COUNTRY_LIST
+import argparse
+import os
+from dotenv import load_dotenv
+
+# create a command-line argument parser
+# the exported dataset lets the dashboard run offline with ECC_BACKEND=duckdb, e.g. for load tests
+parser = argparse.ArgumentParser(description = 'This script exports the explorer tables read by the dashboard to a local Parquet dataset.')
+parser.add_argument('--dir',
+                    help = "Choose the directory of the Parquet dataset.",
+                    default = os.getenv(PARQUET_DIR_ENV, PARQUET_DIR),
+                    type = str)
+parser.add_argument('--tables',
+                    help = "Choose a comma-separated list of tables (e.g. 'uk,finland'). Defaults to every country table, looker_national_top_makers and world_scurve.",
+                    default = None,
+                    type = str)
+args = parser.parse_args()
+tables = [table.strip() for table in args.tables.split(',')] if args.tables is not None else COUNTRY_LIST + ['looker_national_top_makers', 'world_scurve']
+
+load_dotenv()
+sql = MySQL(db = "explorer",
+            credentials_file = "./credentials/explorer_credentials.json",
+            verbose = False,
+            GCR = os.getenv("ENV_API") is not None)
+
+export_parquet(sql = sql,
+               tables = tables,
+               path = args.dir)
+print(f'{len(tables)} tables exported to {args.dir}!')
@@ -0,0 +1,129 @@
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+import pandas as pd
+
+POOL_SIZE = 8
+POOL_TIMEOUT = 10
+QUERY_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 30
+
+def with_timeout(sql_query : str,
+                 timeout : float) -> str:
+    """
+    Adds a MAX_EXECUTION_TIME optimizer hint to a SELECT query, so the server aborts it after the timeout.
+
+    Queries not starting with SELECT (e.g. with a WITH clause) are returned unchanged, since MySQL only applies the hint to top-level SELECT statements.
+
+    :param sql_query: The query.
+    :param timeout: The timeout in seconds.
+    :return: The query with the hint.
+    """
+    return re.sub(r'^(\s*SELECT)\b', rf'\1 /*+ MAX_EXECUTION_TIME({int(timeout * 1000)}) */', sql_query, count = 1, flags = re.IGNORECASE)
+
+class ConnectionPool:
+
+    def __init__(self,
+                 connect,
+                 max_size : int = POOL_SIZE,
+                 pool_timeout : float = POOL_TIMEOUT,
+                 query_timeout : float = QUERY_TIMEOUT,
+                 health_check_interval : float = HEALTH_CHECK_INTERVAL) -> None:
+        """
+        Initialises the ConnectionPool class, a bounded pool of database connectors shared by the threads of a process.
+
+        Connectors are created on demand, up to the maximum size, and reused most recently used first. A connector idle for longer than the health check interval is checked with "SELECT 1" before it is handed out, and replaced if the check fails; a connector whose query failed is dropped rather than returned to the pool.
+
+        :param connect: A function creating a connector exposing read_df() (e.g. a MySQL object).
+        :param max_size: The maximum number of connectors.
+        :param pool_timeout: The number of seconds to wait for a free connector before giving up.
+        :param query_timeout: The number of seconds after which the server aborts a SELECT query.
+        :param health_check_interval: The number of idle seconds after which a connector is checked before use.
+        :return: None
+        """
+        self.connect = connect
+        self.max_size = max_size
+        self.pool_timeout = pool_timeout
+        self.query_timeout = query_timeout
+        self.health_check_interval = health_check_interval
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(max_size)
+        return None
+
+    def checkout(self):
+        """
+        Takes an idle connector, checking it if it was idle for long, or creates a new one.
+
+        :return: A connector.
+        """
+        while True:
+            try:
+                connection, last_used = self.idle.get_nowait()
+            except queue.Empty:
+                return self.connect()
+            if time.monotonic() - last_used < self.health_check_interval or self.healthy(connection):
+                return connection
+            self.discard(connection)
+
+    def healthy(self,
+                connection) -> bool:
+        """
+        Checks that a connector can still run a query.
+
+        :param connection: The connector.
+        :return: True if the connector answered, False otherwise.
+        """
+        try:
+            connection.read_df(with_timeout("SELECT 1", self.pool_timeout))
+            return True
+        except Exception:
+            return False
+
+    def discard(self,
+                connection) -> None:
+        """
+        Closes a connector that is not returned to the pool.
+
+        :param connection: The connector.
+        :return: None
+        """
+        close = getattr(connection, 'close', None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+        return None
+
+    @contextmanager
+    def connection(self):
+        """
+        Lends a connector for the duration of the context.
+
+        :return: None
+        """
+        if not self.slots.acquire(timeout = self.pool_timeout):
+            raise TimeoutError(f'no database connection available within {self.pool_timeout} seconds')
+        try:
+            connection = self.checkout()
+            try:
+                yield connection
+            except Exception:
+                self.discard(connection)
+                raise
+            self.idle.put((connection, time.monotonic()))
+        finally:
+            self.slots.release()
+
+    def read_df(self,
+                sql_query : str) -> pd.DataFrame:
+        """
+        Runs a query on a pooled connector, with the query timeout.
+
+        :param sql_query: The query.
+        :return: A Pandas DataFrame containing the result.
+        """
+        with self.connection() as connection:
+            return connection.read_df(with_timeout(sql_query, self.query_timeout))
@@ -0,0 +1,46 @@
+from modules.finnishModules import Finland
+from modules.swissModules import Switzerland, workbook_date, workbook_file_name, parsers_agree
+from modules.sinkModules import LocalSink
+from modules.logModules import NullDispatcher
+import argparse
+import os
+
+# create a command-line argument parser
+# recorded source files are replayed into a local sink, without requests, bucket uploads, BigQuery or Slack
+parser = argparse.ArgumentParser(description = 'This script replays recorded source files through the scrapers into a local sink.')
+parser.add_argument('--fixtures',
+                    help = "Choose a directory of recorded source files, laid out as 'finland/all_data.csv' and 'switzerland/MOFISPW{year}_{month}.xlsx'.",
+                    default = 'fixtures',
+                    type = str)
+parser.add_argument('--sink',
+                    help = "Choose the directory in which the tables are written.",
+                    default = 'data/sink',
+                    type = str)
+parser.add_argument('--countries',
+                    help = "Choose a comma-separated list of country codes (e.g. 'FI,CH').",
+                    default = 'FI,CH',
+                    type = str)
+args = parser.parse_args()
+country_codes = [code.strip().upper() for code in args.countries.split(',')]
+
+sink = LocalSink(path = args.sink)
+slack = NullDispatcher()
+
+if 'FI' in country_codes:
+    finland_instance = Finland(bq = sink,
+                               slack = slack,
+                               fixtures_dir = args.fixtures)
+    finland_instance.run()
+
+if 'CH' in country_codes:
+    dates = sorted(filter(None, [workbook_date(file_name) for file_name in os.listdir(os.path.join(args.fixtures, 'switzerland'))]))
+    for date in dates:
+        # the recorded workbooks double as a check of the streaming parser against the pandas one
+        with open(os.path.join(args.fixtures, 'switzerland', workbook_file_name(date)), 'rb') as file:
+            if not parsers_agree(file.read()):
+                raise ValueError(f'CH - the streaming and pandas parsers disagree on {workbook_file_name(date)}')
+        switzerland_instance = Switzerland(date = date,
+                                           bq = sink,
+                                           slack = slack,
+                                           fixtures_dir = args.fixtures)
+        switzerland_instance.run()
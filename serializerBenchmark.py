@@ -0,0 +1,91 @@
+from modules.cubeModules import get_cube, COUNTRY_LIST, CUBE_DIR, CUBE_DIR_ENV, MISSING
+from modules.snapshotModules import SnapshotStore
+from modules.serializerModules import encode
+from flask import Flask
+import argparse
+import json
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# create a command-line argument parser
+parser = argparse.ArgumentParser(description = 'This script compares the orjson serialiser of the API with the DataFrame-to-jsonify loop it replaced, on the largest countries of an exported cube.')
+parser.add_argument('--dir',
+                    help = "Choose the directory in which the cubes are exported.",
+                    default = os.getenv(CUBE_DIR_ENV, CUBE_DIR),
+                    type = str)
+parser.add_argument('--countries',
+                    help = "Choose the number of countries, taken by decreasing number of months × fuel types with data.",
+                    default = 5,
+                    type = int)
+parser.add_argument('--repeat',
+                    help = "Choose the number of times each payload is serialised.",
+                    default = 200,
+                    type = int)
+args = parser.parse_args()
+
+if get_cube(args.dir) is None:
+    print(f'no cube found in {args.dir}...')
+    sys.exit(0)
+
+snapshot = SnapshotStore(sql = None,
+                         country_list = COUNTRY_LIST,
+                         make_country_list = [],
+                         cube_path = args.dir).get()
+provider = Flask(__name__).json
+
+def legacy(payload : dict) -> str:
+    """
+    Serialises a payload as the endpoints did: DataFrame, fillna(0), one to_list() per column, then Flask's JSON provider.
+
+    :param payload: The payload.
+    :return: The encoded JSON.
+    """
+    columns = {column : values for column, values in payload.items() if column != 'lastUpdate'}
+    df = pd.DataFrame(columns)
+    if 'date' in df.columns:
+        df['date'] = pd.to_datetime(df['date'], format = '%a, %d %b %Y %H:%M:%S GMT')
+    df = df.fillna(0)
+    result = {}
+    for column in df.columns:
+        result[column] = df[column].to_list()
+    if 'lastUpdate' in payload:
+        result["lastUpdate"] = df["date"].max()
+    return provider.dumps(result)
+
+def timed(function,
+          *function_args) -> float:
+    """
+    Runs a function repeatedly and returns its mean duration.
+
+    :param function: The function.
+    :return: The mean duration in microseconds.
+    """
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        function(*function_args)
+    return (time.perf_counter() - start) / args.repeat * 1e6
+
+sizes = {country : int((cube.registrations != MISSING).sum()) for country, cube in snapshot.countries.items()}
+countries = sorted(sizes, key = sizes.get, reverse = True)[:args.countries]
+results = []
+for country in countries:
+    cube = snapshot.countries[country]
+    for endpoint, payload in [('historicals', cube.historicals), ('table', cube.table), ('table2', cube.table2)]:
+        data = payload()
+        if json.loads(legacy(data)) != json.loads(encode(data)):
+            print(f'{country} - {endpoint}: the serialisers disagree!')
+        snapshot.encoded(endpoint, country, payload)
+        results.append({'country' : country,
+                        'endpoint' : endpoint,
+                        'cells' : sizes[country],
+                        'legacy_us' : timed(legacy, data),
+                        'orjson_us' : timed(encode, data),
+                        'cached_us' : timed(snapshot.encoded, endpoint, country, payload)})
+
+df = pd.DataFrame(results)
+df['speedup'] = df['legacy_us'] / df['orjson_us']
+print(df.round(1).to_string(index = False))
+print(f"\nmedian speedup: {np.median(df['speedup']):.1f}x")
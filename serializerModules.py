@@ -0,0 +1,55 @@
+import decimal
+from datetime import date
+import numpy as np
+import orjson
+from werkzeug.http import http_date
+
+# dates are passed to encode_default(), which formats them as jsonify() does rather than in ISO 8601
+ENCODE_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE | orjson.OPT_PASSTHROUGH_DATETIME
+
+def http_date_labels(dates : np.ndarray) -> np.ndarray:
+    """
+    Formats dates once, in the HTTP-date format Flask's jsonify() gives them (e.g. 'Mon, 01 Jan 2024 00:00:00 GMT').
+
+    :param dates: An array of datetime64 dates.
+    :return: An array of strings.
+    """
+    return np.array([http_date(date) for date in np.asarray(dates, dtype = 'datetime64[D]').astype(object)], dtype = object)
+
+def encode_default(value) -> object:
+    """
+    Converts the values orjson does not encode natively, such as arrays of strings, which it leaves to this function.
+
+    Dates are formatted in the HTTP-date format and decimals (e.g. the SUM() of a MySQL column) are converted to floats, as in the responses of jsonify().
+
+    :param value: The value.
+    :return: A value orjson encodes.
+    """
+    if isinstance(value, (np.ndarray, np.datetime64)) and np.issubdtype(value.dtype, np.datetime64):
+        # NaT becomes None, encoded as null
+        value = value.astype('datetime64[s]').tolist()
+        if isinstance(value, list):
+            return [http_date(item) if item is not None else None for item in value]
+        return http_date(value) if value is not None else None
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, date):
+        return http_date(value)
+    raise TypeError(f'cannot serialise {type(value).__name__}')
+
+def encode(payload : dict) -> bytes:
+    """
+    Encodes a payload to JSON, with the keys sorted as jsonify() sorts them.
+
+    Numeric columns given as NumPy arrays are encoded straight from their buffers; dates are expected to be formatted already.
+
+    :param payload: The payload.
+    :return: The encoded JSON.
+    """
+    return orjson.dumps(payload,
+                        default = encode_default,
+                        option = ENCODE_OPTIONS)
@@ -0,0 +1,328 @@
+import os
+import re
+import shutil
+from datetime import datetime
+import pandas as pd
+from concurrent.futures import Future
+from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+from modules.connector import MyBigQuery
+from modules import DATASET_NAME
+
+DEDUPE_DIR = 'data/dedupe'
+
+def table_name_from_id(table_id : str) -> str:
+    """
+    Returns the name of a table from its ID.
+
+    :param table_id: The ID of the table, fully qualified or not (e.g. 'rugged-baton-283921.globalECC.finland').
+    :return: The name of the table (e.g. 'finland').
+    """
+    return table_id.split('.')[-1]
+
+class BigQuerySink:
+
+    def __init__(self,
+                 bq : MyBigQuery = None) -> None:
+        """
+        Initialises the BigQuerySink class, which exposes the BigQuery operations the scrapers rely on.
+
+        LocalSink exposes the same methods, so the scrapers run unchanged against BigQuery and against a local directory in replay mode and in benchmarks.
+
+        :param bq: An optional BigQuery connector. Defaults to a new MyBigQuery.
+        :return: None
+        """
+        self.bq = bq if bq is not None else MyBigQuery()
+        self.dedupe_dir = DEDUPE_DIR
+        return None
+
+    def read_df(self,
+                sql_query : str) -> pd.DataFrame:
+        """
+        Runs a query.
+
+        :param sql_query: The query, with the tables referred to by their backtick-quoted IDs.
+        :return: A Pandas DataFrame containing the result.
+        """
+        return self.bq.bq_client.query(sql_query).to_dataframe()
+
+    def append_from_df(self,
+                       table_name : str,
+                       df : pd.DataFrame,
+                       dataset_name : str = DATASET_NAME,
+                       unique_fields : list = None,
+                       job_config : bigquery.LoadJobConfig = None) -> None:
+        """
+        Appends a DataFrame to a table.
+
+        :param table_name: The name of the table.
+        :param df: The DataFrame to append.
+        :param dataset_name: The name of the dataset the table belongs to.
+        :param unique_fields: An optional list of fields identifying duplicate rows.
+        :param job_config: The load job configuration.
+        :return: None
+        """
+        kwargs = {} if unique_fields is None else {'unique_fields' : unique_fields}
+        self.bq.append_from_df(table_name = table_name,
+                               df = df,
+                               dataset_name = dataset_name,
+                               job_config = job_config,
+                               **kwargs)
+        return None
+
+    def copy_table(self,
+                   source_id : str,
+                   destination_id : str) -> None:
+        """
+        Replaces the content of a table with the content of another table, in a single copy job.
+
+        :param source_id: The fully qualified ID of the table to copy.
+        :param destination_id: The fully qualified ID of the table to replace.
+        :return: None
+        """
+        job_config = bigquery.CopyJobConfig(write_disposition = bigquery.WriteDisposition.WRITE_TRUNCATE)
+        self.bq.bq_client.copy_table(source_id,
+                                     destination_id,
+                                     job_config = job_config).result()
+        return None
+
+    def delete_table(self,
+                     table_id : str) -> None:
+        """
+        Deletes a table, if it exists.
+
+        :param table_id: The fully qualified ID of the table.
+        :return: None
+        """
+        self.bq.bq_client.delete_table(table_id,
+                                       not_found_ok = True)
+        return None
+
+    def table_modified(self,
+                       table_id : str) -> str:
+        """
+        Retrieves the time a table was last modified, from its metadata, without running a query.
+
+        :param table_id: The fully qualified ID of the table.
+        :return: The last modification time in ISO format, or None if the table does not exist.
+        """
+        try:
+            return self.bq.bq_client.get_table(table_id).modified.isoformat()
+        except NotFound:
+            return None
+
+    def load_parquet(self,
+                     path_file : str,
+                     table_name : str,
+                     dataset_name : str = DATASET_NAME,
+                     schema : list = None) -> bigquery.LoadJob:
+        """
+        Submits a job appending a Parquet file to a table, without waiting for it.
+
+        :param path_file: The path of the Parquet file.
+        :param table_name: The name of the table.
+        :param dataset_name: The name of the dataset the table belongs to.
+        :param schema: An optional list of BigQuery SchemaField objects.
+        :return: The load job, whose result() waits for it.
+        """
+        job_config = bigquery.LoadJobConfig(source_format = bigquery.SourceFormat.PARQUET,
+                                            write_disposition = bigquery.WriteDisposition.WRITE_APPEND)
+        if schema is not None:
+            job_config.schema = schema
+        with open(path_file, 'rb') as file:
+            return self.bq.bq_client.load_table_from_file(file,
+                                                          f'{self.bq.bq_client.project}.{dataset_name}.{table_name}',
+                                                          job_config = job_config)
+
+class LocalSink:
+
+    def __init__(self,
+                 path : str) -> None:
+        """
+        Initialises the LocalSink class, a local stand-in for BigQuerySink that stores each table as a CSV file.
+
+        It exposes the same methods as BigQuerySink, so scrapers can write to it in replay mode and in benchmarks. Queries are run with an embedded DuckDB engine on the CSV files, and tables are referred to by their name, whatever the project and dataset of their ID.
+
+        :param path: The directory in which the tables are stored.
+        :return: None
+        """
+        self.path = path
+        self.dedupe_dir = os.path.join(path, 'dedupe')
+        os.makedirs(path,
+                    exist_ok = True)
+        return None
+
+    def path_table(self,
+                   table_name : str) -> str:
+        """
+        Returns the path of the CSV file storing a table.
+
+        :param table_name: The name of the table.
+        :return: The path of the CSV file.
+        """
+        return os.path.join(self.path, f'{table_name}.csv')
+
+    def read_table(self,
+                   table_name : str) -> pd.DataFrame:
+        """
+        Reads a table.
+
+        :param table_name: The name of the table.
+        :return: A Pandas DataFrame containing the table, or None if the table does not exist.
+        """
+        path_file = self.path_table(table_name)
+        if not os.path.isfile(path_file):
+            return None
+        columns = pd.read_csv(path_file, nrows = 0).columns
+        return pd.read_csv(path_file,
+                           parse_dates = ['date'] if 'date' in columns else False)
+
+    def read_df(self,
+                sql_query : str) -> pd.DataFrame:
+        """
+        Runs a query on the stored tables.
+
+        :param sql_query: The query, with the tables referred to by their backtick-quoted IDs.
+        :return: A Pandas DataFrame containing the result.
+        """
+        # DuckDB is only needed when the scrapers run against a local sink
+        import duckdb
+        table_names = sorted({table_name_from_id(table_id) for table_id in re.findall(r'`([^`]+)`', sql_query)})
+        missing = [name for name in table_names if not os.path.isfile(self.path_table(name))]
+        if len(missing) > 0:
+            raise NotFound(f"Not found: Table {', '.join(missing)}")
+        connection = duckdb.connect()
+        try:
+            for name in table_names:
+                connection.execute(f"""CREATE VIEW "{name}" AS SELECT * FROM read_csv_auto('{self.path_table(name).replace("'", "''")}')""")
+            return connection.execute(re.sub(r'`([^`]+)`', lambda match: f'"{table_name_from_id(match.group(1))}"', sql_query)).df()
+        finally:
+            connection.close()
+
+    def append_from_df(self,
+                       table_name : str,
+                       df : pd.DataFrame,
+                       dataset_name : str = None,
+                       unique_fields : list = None,
+                       job_config = None) -> None:
+        """
+        Appends a DataFrame to a table, skipping the rows whose unique fields are already stored.
+
+        :param table_name: The name of the table.
+        :param df: The DataFrame to append.
+        :param dataset_name: Ignored, kept for compatibility with BigQuerySink.
+        :param unique_fields: An optional list of fields identifying duplicate rows.
+        :param job_config: Ignored, kept for compatibility with BigQuerySink.
+        :return: None
+        """
+        existing = self.read_table(table_name)
+        if unique_fields is not None and existing is not None:
+            new_keys = pd.MultiIndex.from_frame(key_frame(df, unique_fields))
+            df = df.loc[~new_keys.isin(pd.MultiIndex.from_frame(key_frame(existing, unique_fields)))]
+        df.to_csv(self.path_table(table_name),
+                  mode = 'a',
+                  header = existing is None,
+                  index = False)
+        return None
+
+    def replace_table(self,
+                      table_name : str,
+                      df : pd.DataFrame) -> None:
+        """
+        Atomically replaces the content of a table.
+
+        :param table_name: The name of the table.
+        :param df: The DataFrame to store.
+        :return: None
+        """
+        path_file = self.path_table(table_name)
+        df.to_csv(path_file + '.tmp',
+                  index = False)
+        os.replace(path_file + '.tmp', path_file)
+        return None
+
+    def copy_table(self,
+                   source_id : str,
+                   destination_id : str) -> None:
+        """
+        Atomically replaces the content of a table with the content of another table.
+
+        :param source_id: The ID of the table to copy.
+        :param destination_id: The ID of the table to replace.
+        :return: None
+        """
+        path_file = self.path_table(table_name_from_id(destination_id))
+        shutil.copyfile(self.path_table(table_name_from_id(source_id)), path_file + '.tmp')
+        os.replace(path_file + '.tmp', path_file)
+        return None
+
+    def delete_table(self,
+                     table_id : str) -> None:
+        """
+        Deletes a table, if it exists.
+
+        :param table_id: The ID of the table.
+        :return: None
+        """
+        path_file = self.path_table(table_name_from_id(table_id))
+        if os.path.isfile(path_file):
+            os.remove(path_file)
+        return None
+
+    def table_modified(self,
+                       table_id : str) -> str:
+        """
+        Retrieves the time a table was last modified.
+
+        :param table_id: The ID of the table.
+        :return: The last modification time of its CSV file in ISO format, or None if the table does not exist.
+        """
+        path_file = self.path_table(table_name_from_id(table_id))
+        if not os.path.isfile(path_file):
+            return None
+        return datetime.fromtimestamp(os.stat(path_file).st_mtime_ns / 1e9).isoformat()
+
+    def load_parquet(self,
+                     path_file : str,
+                     table_name : str,
+                     dataset_name : str = None,
+                     schema : list = None) -> Future:
+        """
+        Appends a Parquet file to a table.
+
+        :param path_file: The path of the Parquet file.
+        :param table_name: The name of the table.
+        :param dataset_name: Ignored, kept for compatibility with BigQuerySink.
+        :param schema: Ignored, kept for compatibility with BigQuerySink.
+        :return: A completed Future, standing in for the load job.
+        """
+        future = Future()
+        try:
+            self.append_from_df(table_name = table_name,
+                                df = pd.read_parquet(path_file))
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+def key_frame(df : pd.DataFrame,
+              fields : list) -> pd.DataFrame:
+    """
+    Normalises the fields identifying duplicate rows, so values read back from a CSV file compare equal to freshly cleaned ones.
+
+    :param df: The DataFrame.
+    :param fields: The fields identifying duplicate rows.
+    :return: A Pandas DataFrame containing the normalised fields.
+    """
+    keys = pd.DataFrame(index = df.index)
+    for field in fields:
+        column = df[field]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            keys[field] = column.dt.strftime('%Y-%m-%d')
+        elif pd.api.types.is_numeric_dtype(column):
+            keys[field] = column.astype(float)
+        else:
+            # object columns holding numbers (e.g. registrations read from Excel) are compared as numbers
+            numeric = pd.to_numeric(column, errors = 'coerce')
+            keys[field] = numeric.astype(float) if numeric.notna().sum() == column.notna().sum() and column.notna().any() else column.astype(str)
+    return keys
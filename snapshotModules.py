@@ -0,0 +1,548 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from modules.cubeModules import Cube, get_cube, fuel_type_axis, fuel_type_codes
+from modules.summaryModules import MISSING, present_rows, country_summaries, registration_counts
+from modules.serializerModules import encode, http_date_labels
+from modules.coalesceModules import SingleFlight
+from modules.topMakesModules import latest_split, TOP_MAKES_COUNT
+
+SNAPSHOT_START_DATE = '2018-01-01'
+SNAPSHOT_CHECK_INTERVAL = 60
+SNAPSHOT_MAX_AGE = 86400
+# after a failed first load, the load is retried after this number of seconds, doubling on each failure up to the maximum
+SNAPSHOT_RETRY_BACKOFF = 10
+SNAPSHOT_MAX_RETRY_BACKOFF = 300
+# the loads scan whole country tables, so their queries get a longer timeout than interactive ones
+SNAPSHOT_QUERY_TIMEOUT = 600
+ENCODED_CACHE_SIZE = 1024
+TOP_MAKERS_TABLE = 'looker_national_top_makers'
+
+TABLES_QUERY = """
+               SELECT
+                   table_name AS table_name
+               FROM
+                   information_schema.tables
+               WHERE
+                   table_schema = 'explorer'
+               """
+
+def version_tables(country_list : list,
+                   make_country_list : list) -> list:
+    """
+    Lists the tables the data version is derived from, those the snapshot and the cube read.
+
+    :param country_list: The countries with national data.
+    :param make_country_list: The countries with make-level data.
+    :return: The sorted table names.
+    """
+    return sorted(set(country_list) | set(make_country_list) | {TOP_MAKERS_TABLE})
+
+def read_data_version(sql,
+                      tables : list) -> str:
+    """
+    Derives the data version of the explorer database from the latest date of each table.
+
+    MAX(date) is answered from the date index of each table without scanning it, so the check costs the same whatever the size of the tables. Row counts are not used, since COUNT(*) scans a whole index on InnoDB, and neither is UPDATE_TIME, since InnoDB does not persist it across restarts and MySQL 8 caches it for up to a day. Revisions of past months, which leave the latest dates unchanged, are picked up by the daily reload of the snapshot (SNAPSHOT_MAX_AGE). Tables missing from the database are skipped.
+
+    :param sql: The MySQL connector of the explorer database.
+    :param tables: The names of the tables.
+    :return: The data version, a hash of the latest date of each table, or None if none of the tables exists.
+    """
+    existing = set(sql.read_df(TABLES_QUERY)["table_name"])
+    tables = [table for table in tables if table in existing]
+    if len(tables) == 0:
+        return None
+    df = sql.read_df(" UNION ALL ".join(f"SELECT '{table}' AS table_name, MAX(date) AS latest FROM `{table}`" for table in tables))
+    return hashlib.sha256(df.sort_values("table_name").to_csv(index = False).encode()).hexdigest()[:16]
+
+def round_half_up(values : np.ndarray,
+                  decimals : int = 1) -> np.ndarray:
+    """
+    Rounds non-negative values half away from zero, as MySQL's ROUND() does.
+
+    :param values: The values to round.
+    :param decimals: The number of decimals kept.
+    :return: The rounded values.
+    """
+    factor = 10 ** decimals
+    return np.floor(values * factor + 0.5) / factor
+
+class CountryCube:
+
+    def __init__(self,
+                 dates : np.ndarray,
+                 fuel_types : np.ndarray,
+                 registrations : np.ndarray,
+                 date_labels : np.ndarray = None,
+                 summaries : dict = None) -> None:
+        """
+        Initialises the CountryCube class, a dense month × fuel type array of the registrations of one country.
+
+        :param dates: The months of the first axis, sorted.
+        :param fuel_types: The fuel types of the second axis, ending with None if some rows have no fuel type.
+        :param registrations: A 2D int32 array of registrations, with -1 where a fuel type has no row in a month, which the SQL joins treat differently from 0, and -2 where its registrations are all NULL. It may be a view on a memory-mapped cube.
+        :param date_labels: The months of the first axis in the HTTP-date format, if already formatted.
+        :param summaries: The rolling-12-month and year-over-year summaries of the country, if precomputed (e.g. by the cube export).
+        :return: None
+        """
+        self.dates = dates
+        self.date_labels = date_labels if date_labels is not None else http_date_labels(dates)
+        self.fuel_types = fuel_types
+        self.registrations = registrations
+        # the months in which the country has data, since a shared cube also holds the months of the other countries
+        self.rows = present_rows(registrations)
+        # the summaries only change with the data, so they are computed once per data version rather than per request
+        self.summaries = summaries if summaries is not None else country_summaries(dates, fuel_types, registrations)
+        return None
+
+    @classmethod
+    def from_frame(cls,
+                   df : pd.DataFrame) -> 'CountryCube':
+        """
+        Builds a CountryCube from the result of a SQL query.
+
+        :param df: A DataFrame with the date, fuelType and registrations columns, aggregated by date and fuel type.
+        :return: The CountryCube.
+        """
+        df = df.assign(date = pd.to_datetime(df['date']))\
+               .groupby(['date', 'fuelType'], as_index = False, dropna = False)['registrations'].sum(min_count = 1)
+        dates = np.unique(df['date'].values.astype('datetime64[D]'))
+        fuel_types = fuel_type_axis([df])
+        registrations = np.full((len(dates), len(fuel_types)), MISSING, dtype = 'int32')
+        registrations[np.searchsorted(dates, df['date'].values.astype('datetime64[D]')),
+                      fuel_type_codes(df['fuelType'], fuel_types)] = registration_counts(df['registrations'])
+        return cls(dates = dates,
+                   fuel_types = np.array(fuel_types, dtype = object),
+                   registrations = registrations)
+
+    def historicals(self) -> dict:
+        """
+        Computes the payload of the /historicals endpoint.
+
+        :return: A dictionary with the date column, one column per fuel type and the lastUpdate date, the columns as arrays.
+        """
+        rows = self.rows[self.dates[self.rows] >= np.datetime64(SNAPSHOT_START_DATE)]
+        # the pivot of the SQL query drops the NULL sums, and with them the months and fuel types holding only NULL sums
+        rows = rows[(self.registrations[rows] >= 0).any(axis = 1)]
+        values = self.registrations[rows]
+        # the rows without a fuel type have no column, as in the pivot of the SQL query
+        columns = (values >= 0).any(axis = 0) & np.array([fuel_type is not None for fuel_type in self.fuel_types], dtype = bool)
+        dates = self.date_labels[rows]
+        result = {'date' : dates}
+        # one contiguous array per column, so it is encoded straight from its buffer
+        values = np.asfortranarray(np.where(values >= 0, values, 0)[:, columns], dtype = 'float64')
+        for i, fuel_type in enumerate(self.fuel_types[columns]):
+            result[fuel_type] = values[:, i]
+        result["lastUpdate"] = dates[-1] if len(dates) > 0 else None
+        return result
+
+    def table(self) -> dict:
+        """
+        Returns the payload of the /table endpoint, comparing the last 12 months with the 12 months before.
+
+        :return: A dictionary with the fuelType, total, perc_change and share columns.
+        """
+        return self.summaries['table']
+
+    def table2(self) -> dict:
+        """
+        Returns the payload of the /table2 endpoint, comparing the latest month with the same month a year earlier.
+
+        :return: A dictionary with the fuelType, total, perc_change and share columns.
+        """
+        return self.summaries['table2']
+
+class MakeCube:
+
+    def __init__(self,
+                 makes : np.ndarray,
+                 fuel_types : np.ndarray,
+                 registrations : np.ndarray) -> None:
+        """
+        Initialises the MakeCube class, the make × fuel type registrations of one country in its latest month.
+
+        :param makes: The make of each aggregate.
+        :param fuel_types: The fuel type of each aggregate.
+        :param registrations: The registrations of each aggregate, NaN where their sum is NULL.
+        :return: None
+        """
+        self.makes = makes
+        self.fuel_types = fuel_types
+        self.registrations = registrations.astype('float64')
+        return None
+
+    @classmethod
+    def from_frame(cls,
+                   df : pd.DataFrame) -> 'MakeCube':
+        """
+        Builds a MakeCube from the result of a SQL query.
+
+        :param df: A DataFrame with the make, fuelType and registrations columns of the latest month, aggregated by make and fuel type.
+        :return: The MakeCube.
+        """
+        return cls(makes = df['make'].to_numpy(dtype = object),
+                   fuel_types = df['fuelType'].to_numpy(dtype = object),
+                   registrations = df['registrations'].to_numpy(dtype = 'float64'))
+
+    @classmethod
+    def from_cube(cls,
+                  cube : Cube,
+                  country : str) -> 'MakeCube':
+        """
+        Builds a MakeCube from the top makes table of a mapped cube, which holds the fuel type split of the top makes of the latest month.
+
+        Cubes exported without a top makes table fall back on their make-level rows.
+
+        :param cube: The mapped cube.
+        :param country: The country.
+        :return: The MakeCube.
+        """
+        split = latest_split(cube.top_makes(country))
+        if split.shape[0] > 0:
+            return cls.from_frame(split)
+        rows = cube.make_level(country)
+        if rows.shape[0] > 0:
+            # the rows are sorted by month, so the latest month is at the end
+            rows = rows[np.searchsorted(rows[:, 0], rows[-1, 0]):]
+        return cls(makes = cube.makes[rows[:, 1]],
+                   fuel_types = cube.fuel_types[rows[:, 2]],
+                   registrations = np.where(rows[:, 3] >= 0, rows[:, 3], np.nan))
+
+    def top_makers2(self) -> dict:
+        """
+        Computes the payload of the /top_makers2 endpoint, the fuel type split of the top 5 makes of the latest month.
+
+        :return: A dictionary with the make, fuelType and market_share columns as arrays.
+        """
+        codes, makes = pd.factorize(self.makes,
+                                    use_na_sentinel = False)
+        # NULL registrations are left out of the totals, as SUM() ignores NULL
+        totals = np.bincount(codes, weights = np.nan_to_num(self.registrations), minlength = len(makes))
+        top = np.argsort(-totals, kind = 'stable')[:TOP_MAKES_COUNT]
+        rows = np.flatnonzero(np.isin(codes, top))
+        # order the rows by the rank of their make
+        rank = np.empty(len(makes), dtype = int)
+        rank[top] = np.arange(len(top))
+        rows = rows[np.argsort(rank[codes[rows]], kind = 'stable')]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            market_share = np.where(totals[codes[rows]] != 0, self.registrations[rows] / totals[codes[rows]] * 100, 0)
+        return {'make' : self.makes[rows],
+                'fuelType' : self.fuel_types[rows],
+                'market_share' : round_half_up(market_share)}
+
+def snapshot_digest(countries : dict,
+                    makes : dict,
+                    top_makers : dict) -> str:
+    """
+    Computes a digest of the data served from a snapshot, which changes whenever a response may change.
+
+    :param countries: A dictionary mapping each country to its CountryCube.
+    :param makes: A dictionary mapping each country with make-level data to its MakeCube.
+    :param top_makers: A dictionary mapping each country with make-level data to its rows of looker_national_top_makers, as a dictionary of columns.
+    :return: The first 16 characters of the SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for country in sorted(countries):
+        digest.update(f"{country}\x00{countries[country].summaries['digest']}\x00".encode())
+    for country in sorted(makes):
+        digest.update('\x00'.join([country, *map(str, makes[country].makes), *map(str, makes[country].fuel_types), '']).encode())
+        digest.update(np.ascontiguousarray(makes[country].registrations, dtype = 'float64').tobytes())
+    digest.update(encode({country : top_makers[country] for country in sorted(top_makers)}))
+    return digest.hexdigest()[:16]
+
+class Snapshot:
+
+    def __init__(self,
+                 version : str,
+                 countries : dict,
+                 makes : dict,
+                 top_makers : dict,
+                 previous : 'Snapshot' = None) -> None:
+        """
+        Initialises the Snapshot class, an immutable in-memory copy of the data served by the API.
+
+        The ETags are derived from a digest of the loaded data, so a reload at the same data version with different data is not answered as not modified. The Last-Modified time is the UTC time at which that digest last changed.
+
+        :param version: The data version the snapshot was loaded at.
+        :param countries: A dictionary mapping each country to its CountryCube.
+        :param makes: A dictionary mapping each country with make-level data to its MakeCube.
+        :param top_makers: A dictionary mapping each country with make-level data to its rows of looker_national_top_makers in the latest month, as a dictionary of columns.
+        :param previous: The snapshot this one replaces, if any.
+        :return: None
+        """
+        self.version = version
+        self.countries = countries
+        self.makes = makes
+        self.top_makers = top_makers
+        self.loaded = time.monotonic()
+        self.encoded_cache = OrderedDict()
+        self.encoded_lock = threading.Lock()
+        self.encoded_flights = SingleFlight()
+        self.tag = snapshot_digest(countries, makes, top_makers)
+        if previous is not None and previous.tag == self.tag:
+            self.last_modified = previous.last_modified
+        else:
+            self.last_modified = datetime.now(timezone.utc).replace(microsecond = 0)
+        return None
+
+    def country_page(self,
+                     country : str) -> dict:
+        """
+        Computes the payloads of every widget of a country page from the snapshot of the country.
+
+        :param country: The country.
+        :return: A dictionary with the historicals, table, table2, top_makers and top_makers2 payloads; the make-level payloads are None for a country without make-level data.
+        """
+        cube = self.countries[country]
+        return {'historicals' : cube.historicals(),
+                'table' : cube.table(),
+                'table2' : cube.table2(),
+                'top_makers' : self.top_makers_payload(country) if country in self.makes else None,
+                'top_makers2' : self.makes[country].top_makers2() if country in self.makes else None}
+
+    def encoded(self,
+                endpoint : str,
+                country : str,
+                payload) -> bytes:
+        """
+        Returns the encoded JSON of a response, encoding it on first use.
+
+        The encoded responses are cached for the lifetime of the snapshot, so per (endpoint, country, data version); the least recently used ones are dropped beyond ENCODED_CACHE_SIZE entries. Concurrent requests missing the cache for the same key wait for one encoding.
+
+        :param endpoint: The name of the endpoint.
+        :param country: The country, or the comma-separated countries of a batch request.
+        :param payload: A function computing the payload.
+        :return: The encoded JSON.
+        """
+        key = (endpoint, country)
+        with self.encoded_lock:
+            if key in self.encoded_cache:
+                self.encoded_cache.move_to_end(key)
+                return self.encoded_cache[key]
+        content = self.encoded_flights.do(key, lambda : encode(payload()))
+        with self.encoded_lock:
+            self.encoded_cache[key] = content
+            if len(self.encoded_cache) > ENCODED_CACHE_SIZE:
+                self.encoded_cache.popitem(last = False)
+        return content
+
+    def etag(self,
+             endpoint : str,
+             country : str) -> str:
+        """
+        Returns the strong ETag of a response, derived from the endpoint, the country and the digest of the snapshot.
+
+        :param endpoint: The name of the endpoint.
+        :param country: The country.
+        :return: The ETag, without quotes.
+        """
+        return f'{endpoint}-{country}-{self.tag}'
+
+    def top_makers_payload(self,
+                           country : str) -> dict:
+        """
+        Computes the payload of the /top_makers endpoint.
+
+        :param country: The country.
+        :return: A dictionary with the make, BEV_sales and BEV_percentage columns.
+        """
+        return self.top_makers.get(country, {'make' : [], 'BEV_sales' : [], 'BEV_percentage' : []})
+
+class SnapshotStore:
+
+    def __init__(self,
+                 sql,
+                 country_list : list,
+                 make_country_list : list,
+                 cube_path : str = None,
+                 load_workers : int = 1,
+                 check_interval : int = SNAPSHOT_CHECK_INTERVAL,
+                 max_age : int = SNAPSHOT_MAX_AGE) -> None:
+        """
+        Initialises the SnapshotStore class, which serves the API from an in-memory snapshot of the explorer database.
+
+        The snapshot is loaded on first use; if that load fails, requests are answered as unavailable until it is retried, after a growing backoff. Afterwards, at most once per check interval, a background thread compares the data version (derived from the latest date of each table) with the version of the snapshot, and loads a new snapshot when it changed or when the snapshot is older than the maximum age. Requests keep being answered from the current snapshot while a new one loads, and the new snapshot replaces it in one assignment.
+
+        When a registrations cube has been exported, the snapshot maps it instead of querying the database, and its data version is the version the cube was exported at.
+
+        :param sql: The MySQL connector of the explorer database.
+        :param country_list: The countries with national data.
+        :param make_country_list: The countries with make-level data.
+        :param cube_path: The directory in which the registrations cubes are exported. Defaults to the ECC_CUBE_DIR environment variable, or data/cube.
+        :param load_workers: The number of countries queried concurrently when the snapshot is loaded from the database, which should not exceed the connections the connector can open (e.g. the size of a ConnectionPool).
+        :param check_interval: The minimum number of seconds between two data version checks.
+        :param max_age: The number of seconds after which the snapshot is reloaded, even if the data version did not change.
+        :return: None
+        """
+        self.sql = sql
+        self.country_list = country_list
+        self.make_country_list = make_country_list
+        self.cube_path = cube_path
+        self.load_workers = load_workers
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self.snapshot = None
+        self.checked = 0
+        self.retry_at = None
+        self.retry_backoff = SNAPSHOT_RETRY_BACKOFF
+        self.load_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        return None
+
+    def data_version(self) -> str:
+        """
+        Retrieves the data version of the explorer database, or of the exported cube.
+
+        :return: The data version (see read_data_version()), or None if none of the tables exists.
+        """
+        cube = get_cube(self.cube_path)
+        if cube is not None:
+            return cube.version
+        return read_data_version(self.sql, version_tables(self.country_list, self.make_country_list))
+
+    def load_country(self,
+                     country : str) -> CountryCube:
+        """
+        Loads the registrations of a country by month and fuel type from the explorer database.
+
+        :param country: The country.
+        :return: The CountryCube, or None if the table cannot be read.
+        """
+        try:
+            return CountryCube.from_frame(self.sql.read_df(f"""
+                                                           SELECT
+                                                               date,
+                                                               fuelType,
+                                                               SUM(registrations) AS registrations
+                                                           FROM
+                                                               `{country}`
+                                                           GROUP BY
+                                                               date,
+                                                               fuelType
+                                                           """))
+        except Exception as e:
+            print(f'failed to load the {country} snapshot: {e}')
+            return None
+
+    def load_makes(self,
+                   country : str) -> MakeCube:
+        """
+        Loads the registrations of a country by make and fuel type in its latest month from the explorer database.
+
+        :param country: The country.
+        :return: The MakeCube, or None if the table cannot be read.
+        """
+        try:
+            return MakeCube.from_frame(self.sql.read_df(f"""
+                                                        SELECT
+                                                            make,
+                                                            fuelType,
+                                                            SUM(registrations) AS registrations
+                                                        FROM
+                                                            `{country}`
+                                                        WHERE
+                                                            date = (SELECT MAX(date) FROM `{country}`)
+                                                        GROUP BY
+                                                            make,
+                                                            fuelType
+                                                        """))
+        except Exception as e:
+            print(f'failed to load the {country} make snapshot: {e}')
+            return None
+
+    def load(self,
+             version : str) -> Snapshot:
+        """
+        Loads a new snapshot from the exported cube if there is one, and from the explorer database otherwise.
+
+        On the first load, a country whose tables cannot be read is left out of the snapshot, so the other countries are still served. On later loads, the load fails instead if a country of the current snapshot cannot be read, so the current snapshot keeps being served.
+
+        :param version: The data version the snapshot is loaded at.
+        :return: The new snapshot.
+        """
+        cube = get_cube(self.cube_path)
+        if cube is not None:
+            date_labels = http_date_labels(cube.months)
+            return Snapshot(version = cube.version,
+                            countries = {country : CountryCube(dates = cube.months,
+                                                               fuel_types = cube.fuel_types,
+                                                               registrations = cube.national(country),
+                                                               date_labels = date_labels,
+                                                               summaries = cube.summaries.get(country)) for country in self.country_list if country in cube.countries},
+                            makes = {country : MakeCube.from_cube(cube, country) for country in self.make_country_list if country in cube.make_offsets},
+                            top_makers = cube.top_makers,
+                            previous = self.snapshot)
+        # the countries are queried concurrently, up to the number of load workers
+        with ThreadPoolExecutor(max_workers = self.load_workers) as executor:
+            countries = dict(zip(self.country_list, executor.map(self.load_country, self.country_list)))
+            makes = dict(zip(self.make_country_list, executor.map(self.load_makes, self.make_country_list)))
+        countries = {country : cube for country, cube in countries.items() if cube is not None}
+        makes = {country : cube for country, cube in makes.items() if cube is not None}
+        if self.snapshot is not None:
+            missing = sorted((set(self.snapshot.countries) - set(countries)) | (set(self.snapshot.makes) - set(makes)))
+            if len(missing) > 0:
+                raise RuntimeError(f"failed to load {', '.join(missing)}, keeping the current snapshot")
+        df = self.sql.read_df(f"""
+                              SELECT
+                                  country,
+                                  make,
+                                  BEV_sales,
+                                  BEV_percentage
+                              FROM
+                                  `{TOP_MAKERS_TABLE}` AS Looker
+                              WHERE
+                                  date = (SELECT MAX(date) FROM `{TOP_MAKERS_TABLE}` WHERE country = Looker.country)
+                              """)
+        top_makers = {country : group.drop(columns = 'country').fillna(0).to_dict(orient = 'list') for country, group in df.groupby('country')}
+        return Snapshot(version = version,
+                        countries = countries,
+                        makes = makes,
+                        top_makers = top_makers,
+                        previous = self.snapshot)
+
+    def refresh(self) -> None:
+        """
+        Loads a new snapshot if the data version changed or the snapshot is too old. Releases the refresh lock when done.
+
+        :return: None
+        """
+        try:
+            version = self.data_version()
+            if version != self.snapshot.version or time.monotonic() - self.snapshot.loaded > self.max_age:
+                self.snapshot = self.load(version)
+        except Exception as e:
+            print(f'failed to refresh the snapshot: {e}')
+        finally:
+            self.refresh_lock.release()
+        return None
+
+    def get(self) -> Snapshot:
+        """
+        Returns the current snapshot, loading it on first use and starting a background refresh when a check is due.
+
+        :return: The current snapshot, or None if the first load failed and is not due for a retry yet.
+        """
+        if self.snapshot is None:
+            with self.load_lock:
+                if self.snapshot is None and (self.retry_at is None or time.monotonic() >= self.retry_at):
+                    try:
+                        version = self.data_version()
+                        self.snapshot = self.load(version)
+                        self.checked = time.monotonic()
+                    except Exception as e:
+                        # answer the requests as unavailable until the retry, rather than reloading on each of them
+                        print(f'failed to load the snapshot, retrying in {self.retry_backoff} seconds: {e}')
+                        self.retry_at = time.monotonic() + self.retry_backoff
+                        self.retry_backoff = min(self.retry_backoff * 2, SNAPSHOT_MAX_RETRY_BACKOFF)
+            return self.snapshot
+        if time.monotonic() - self.checked > self.check_interval and self.refresh_lock.acquire(blocking = False):
+            self.checked = time.monotonic()
+            threading.Thread(target = self.refresh,
+                             daemon = True).start()
+        return self.snapshot
@@ -0,0 +1,144 @@
+import hashlib
+import numpy as np
+import pandas as pd
+
+MISSING = -1
+# a fuel type (or make) with rows in a month whose registrations are all NULL, which SQL keeps as a group with a NULL sum
+NULL_SUM = -2
+TABLE_WINDOW_MONTHS = 12
+# bump whenever the way the summaries are computed changes, so the summaries stored with a previous cube are recomputed
+SUMMARY_FORMAT_VERSION = 3
+
+def registration_counts(values,
+                        name : str = 'registrations') -> np.ndarray:
+    """
+    Converts summed registrations to the int32 counts stored in the cubes.
+
+    A NULL sum is stored as -2 (NULL_SUM), so it can be told apart from a missing row (-1) and left out of the sums. Fractional values are not rounded: they raise a ValueError, since the cubes only hold whole counts.
+
+    :param values: The summed registrations.
+    :param name: The name of the data, for the error message (e.g. the country).
+    :return: A NumPy array of int32 counts.
+    """
+    values = np.asarray(values, dtype = 'float64')
+    missing = np.isnan(values)
+    fractional = values[~missing] != np.rint(values[~missing])
+    if fractional.any():
+        raise ValueError(f'{name}: {int(fractional.sum())} fractional registrations (e.g. {values[~missing][fractional][0]}) cannot be stored as counts')
+    return np.where(missing, NULL_SUM, values).astype('int32')
+
+def window_summary(current : np.ndarray,
+                   previous : np.ndarray,
+                   fuel_types : np.ndarray) -> dict:
+    """
+    Compares the registrations of two windows of months by fuel type, as the /table and /table2 endpoints do.
+
+    Only the fuel types registered in both windows are kept, and the rows without a fuel type (None) only count towards the shares. The percentage change is 0 when the previous total is 0.
+
+    :param current: A 2D array of registrations (months × fuel types) in the current window, with -1 where a fuel type has no row and -2 where its registrations are NULL.
+    :param previous: A 2D array of registrations (months × fuel types) in the previous window, with -1 where a fuel type has no row and -2 where its registrations are NULL.
+    :param fuel_types: The fuel types matching the columns of the arrays.
+    :return: A dictionary with the fuelType, total, perc_change and share columns as arrays, ordered by total.
+    """
+    current_present = (current != MISSING).any(axis = 0)
+    previous_present = (previous != MISSING).any(axis = 0)
+    # NULL sums are left out, as SUM() ignores NULL
+    current_total = np.where(current >= 0, current, 0).sum(axis = 0, dtype = 'float64')
+    previous_total = np.where(previous >= 0, previous, 0).sum(axis = 0, dtype = 'float64')
+    share = current_total / current_total.sum() * 100 if current_total.sum() != 0 else np.zeros_like(current_total)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        perc_change = np.where(previous_total != 0, (current_total - previous_total) / previous_total * 100, 0)
+    named = np.array([fuel_type is not None for fuel_type in fuel_types], dtype = bool)
+    keep = np.flatnonzero(current_present & previous_present & named)
+    keep = keep[np.argsort(-current_total[keep], kind = 'stable')]
+    return {'fuelType' : fuel_types[keep],
+            'total' : current_total[keep],
+            'perc_change' : perc_change[keep],
+            'share' : share[keep]}
+
+def present_rows(registrations : np.ndarray) -> np.ndarray:
+    """
+    Finds the months in which a country has data.
+
+    :param registrations: A 2D int32 array of registrations (months × fuel types), with -1 where a fuel type has no row.
+    :return: The indices of the months with at least one row.
+    """
+    return np.flatnonzero((registrations != MISSING).any(axis = 1))
+
+def rolling_summary(registrations : np.ndarray,
+                    rows : np.ndarray,
+                    fuel_types : np.ndarray) -> dict:
+    """
+    Compares the last 12 months of a country with the 12 months before, by fuel type.
+
+    :param registrations: A 2D int32 array of registrations (months × fuel types), with -1 where a fuel type has no row.
+    :param rows: The indices of the months in which the country has data.
+    :param fuel_types: The fuel types of the second axis.
+    :return: A dictionary with the fuelType, total, perc_change and share columns as arrays.
+    """
+    return window_summary(current = registrations[rows[-TABLE_WINDOW_MONTHS:]],
+                          previous = registrations[rows[-2 * TABLE_WINDOW_MONTHS:-TABLE_WINDOW_MONTHS]],
+                          fuel_types = fuel_types)
+
+def yoy_summary(dates : np.ndarray,
+                registrations : np.ndarray,
+                rows : np.ndarray,
+                fuel_types : np.ndarray) -> dict:
+    """
+    Compares the latest month of a country with the same month a year earlier, by fuel type.
+
+    :param dates: The months of the first axis.
+    :param registrations: A 2D int32 array of registrations (months × fuel types), with -1 where a fuel type has no row.
+    :param rows: The indices of the months in which the country has data.
+    :param fuel_types: The fuel types of the second axis.
+    :return: A dictionary with the fuelType, total, perc_change and share columns as arrays.
+    """
+    latest = rows[-1:]
+    if len(latest) == 0:
+        return window_summary(registrations[latest], registrations[latest], fuel_types)
+    # the same day a year earlier, clipped to the end of February as MySQL's DATE_SUB() does
+    year_before = np.datetime64((pd.Timestamp(dates[latest[0]]) - pd.DateOffset(years = 1)).date())
+    return window_summary(current = registrations[latest],
+                          previous = registrations[rows[dates[rows] == year_before]],
+                          fuel_types = fuel_types)
+
+def country_digest(dates : np.ndarray,
+                   fuel_types : np.ndarray,
+                   registrations : np.ndarray,
+                   rows : np.ndarray) -> str:
+    """
+    Computes a digest of the data of a country, which changes whenever a month is added or revised, or the summary format version is bumped.
+
+    :param dates: The months of the first axis.
+    :param fuel_types: The fuel types of the second axis.
+    :param registrations: A 2D int32 array of registrations (months × fuel types), with -1 where a fuel type has no row.
+    :param rows: The indices of the months in which the country has data.
+    :return: The first 16 characters of the SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    digest.update(f'{SUMMARY_FORMAT_VERSION}\x00'.encode())
+    digest.update(np.ascontiguousarray(np.asarray(dates)[rows], dtype = 'datetime64[D]').tobytes())
+    digest.update('\x00'.join(map(str, fuel_types)).encode())
+    digest.update(np.ascontiguousarray(registrations[rows], dtype = 'int32').tobytes())
+    return digest.hexdigest()[:16]
+
+def country_summaries(dates : np.ndarray,
+                      fuel_types : np.ndarray,
+                      registrations : np.ndarray,
+                      previous : dict = None) -> dict:
+    """
+    Computes the rolling-12-month and year-over-year summaries of a country, reusing the previous ones when its data did not change.
+
+    :param dates: The months of the first axis.
+    :param fuel_types: The fuel types of the second axis.
+    :param registrations: A 2D int32 array of registrations (months × fuel types), with -1 where a fuel type has no row.
+    :param previous: The summaries computed at the previous data version, if any.
+    :return: A dictionary with the digest of the data and the table (rolling 12 months) and table2 (year over year) payloads, as lists.
+    """
+    rows = present_rows(registrations)
+    digest = country_digest(dates, fuel_types, registrations, rows)
+    if previous is not None and previous.get('digest') == digest:
+        return previous
+    return {'digest' : digest,
+            'table' : {column : values.tolist() for column, values in rolling_summary(registrations, rows, fuel_types).items()},
+            'table2' : {column : values.tolist() for column, values in yoy_summary(dates, registrations, rows, fuel_types).items()}}
@@ -0,0 +1,68 @@
+from modules.swissModules import parse_workbook, parse_workbook_streaming, parsers_agree
+import argparse
+import glob
+import os
+import time
+import tracemalloc
+import pandas as pd
+
+# create a command-line argument parser
+parser = argparse.ArgumentParser(description = 'This script compares the pandas and streaming parsers on archived auto.swiss workbooks.')
+parser.add_argument('--path',
+                    help = "Choose a directory containing archived MOFISPW workbooks (e.g. 'data/switzerland/archive').",
+                    default = 'data/switzerland/archive',
+                    type = str)
+parser.add_argument('--repeat',
+                    help = "Choose the number of times each workbook is parsed.",
+                    default = 3,
+                    type = int)
+args = parser.parse_args()
+
+def measure(parser_function,
+            content : bytes) -> tuple:
+    """
+    Parses a workbook and measures the elapsed time and the peak memory allocated by Python.
+
+    :param parser_function: The parser to measure.
+    :param content: The content of the workbook.
+    :return: A tuple of the parsed DataFrame, the elapsed time in seconds and the peak memory in MiB.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = parser_function(content)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return df, elapsed, peak
+
+results = []
+for path_file in sorted(glob.glob(os.path.join(args.path, '*.xlsx'))):
+    with open(path_file, 'rb') as file:
+        content = file.read()
+    for name, parser_function in [('pandas', parse_workbook),
+                                  ('streaming', parse_workbook_streaming)]:
+        for _ in range(args.repeat):
+            df, elapsed, peak = measure(parser_function, content)
+            results.append({'file' : os.path.basename(path_file),
+                            'parser' : name,
+                            'seconds' : elapsed,
+                            'peak_mib' : peak})
+    # check that both parsers extract the same rows
+    if not parsers_agree(content):
+        print(f'{os.path.basename(path_file)}: parsers disagree!')
+
+if len(results) == 0:
+    print(f'no workbooks found in {args.path}...')
+else:
+    df = pd.DataFrame(results)
+    summary = df.groupby(['file', 'parser'])\
+                .agg({'seconds' : 'median',
+                      'peak_mib' : 'max'})\
+                .unstack('parser')
+    print(summary.round(3).to_string())
+    print()
+    print(df.groupby('parser')\
+            .agg({'seconds' : 'median',
+                  'peak_mib' : 'median'})\
+            .round(3)\
+            .to_string())
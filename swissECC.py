@@ -1,9 +1,11 @@
 import os
-from modules.swissModules import Switzerland
+import re
+from modules.swissModules import Switzerland, backfill
 import argparse
+import pandas as pd
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
-from modules.connector import SlackBot
+from modules.logModules import get_log_dispatcher
 
 current_date = datetime.now()
 previous_date = current_date - relativedelta(months = 1)
@@ -22,7 +24,27 @@ parser.add_argument('--month',
                     help = "Choose a valid month (e.g. '10').", 
                     default = month,
                     type = str)
+parser.add_argument('--from', 
+                    dest = 'from_date',
+                    help = "Choose the first month of a backfill range (e.g. '2023-01'). Must be used with --to.", 
+                    default = None,
+                    type = str)
+parser.add_argument('--to', 
+                    dest = 'to_date',
+                    help = "Choose the last month of a backfill range (e.g. '2023-12'). Must be used with --from.", 
+                    default = None,
+                    type = str)
+parser.add_argument('--workers', 
+                    help = "Choose the maximum number of months fetched in parallel in backfill mode.", 
+                    default = 4,
+                    type = int)
 args = parser.parse_args()
+if (args.from_date is None) != (args.to_date is None):
+    parser.error('--from and --to must be used together')
+# the months are compared as strings, so they must be in the format '%Y-%m'
+for option, value in [('--from', args.from_date), ('--to', args.to_date)]:
+    if value is not None and re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', value) is None:
+        parser.error(f"{option} must be a month in the format 'YYYY-MM' (e.g. '2023-01')")
 year = str(args.year)
 month = str(args.month)
 
@@ -32,7 +54,7 @@ path = os.path.join('data',
 os.makedirs(path,
             exist_ok = True)
 
-slack = SlackBot(slack_channel = '#global-ecc-scraper')
+slack = get_log_dispatcher(slack_channel = '#global-ecc-scraper')
 def print_and_send(text : str,
                    slack = slack) -> None:
     text = 'CH - ' + text
@@ -40,9 +62,19 @@ def print_and_send(text : str,
     slack.send_log(text)
     return
 date = year + '-' + month
-if date > (datetime.now() - relativedelta(months = 1)).strftime('%Y-%m'):
+last_released = (datetime.now() - relativedelta(months = 1)).strftime('%Y-%m')
+if args.from_date is not None:
+    # backfill every released month between --from and --to
+    dates = [d.strftime('%Y-%m') for d in pd.date_range(start = args.from_date, 
+                                                         end = min(args.to_date, last_released), 
+                                                         freq = 'MS')]
+    if len(dates) == 0:
+        print_and_send(f"no released months between {args.from_date} and {args.to_date}...\n\n")
+    else:
+        backfill(dates = dates,
+                 max_workers = args.workers)
+elif date > last_released:
     print_and_send(f"data for {date} has not been released yet...\n\n")
 else:
     switzerland_instance = Switzerland(date = date)
-    switzerland_instance.make_data_to_BQ()
-    switzerland_instance.fuel_type_data_to_BQ()
\ No newline at end of file
+    switzerland_instance.run()
\ No newline at end of file
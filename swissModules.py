@@ -1,10 +1,24 @@
 import requests
 import pandas as pd
-from modules.connector import MyBigQuery, SlackBot, MyBucket
+import openpyxl
+from modules.archiveModules import Archiver, get_archiver
+from modules.logModules import LogDispatcher, get_log_dispatcher
+from modules.httpModules import get_session, get_source_metadata
+from modules.sinkModules import BigQuerySink
+from modules.dedupeModules import get_dedupe_index
+from modules.loaderModules import BatchLoader
+from modules.timingModules import stage
 import os
 import io
-from modules import  DATASET_NAME, BUCKET_NAME, UNIQUE_FIELDS_2, JOB_CONFIG_2
+import re
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
+from modules import  DATASET_NAME, UNIQUE_FIELDS_2, JOB_CONFIG_2
 from google.cloud import bigquery
+from google.api_core.exceptions import NotFound
+from datetime import datetime
 from dateutil.relativedelta import relativedelta
 
 FUEL_TYPE_DICT_CH = {"Benzin" : "petrol",
@@ -26,26 +40,196 @@ JOB_CONFIG_CH_MAKE = bigquery.LoadJobConfig(schema = [bigquery.SchemaField('make
                                                       bigquery.SchemaField('registrations', 'FLOAT'),
                                                       bigquery.SchemaField('date', 'DATE')])
 DESTINATION_BLOB_NAME_CH = 'switzerland'
+CACHE_DIR_CH = 'data/switzerland/cache'
+MAKE_HEADER_CH = 'Marken / marques'
+FUEL_ROWS_CH = 8
+
+def workbook_file_name(date : str) -> str:
+    """
+    Returns the file name under which auto.swiss publishes the workbook for a date.
+
+    :param date: The date in the format '%Y-%m'.
+    :return: The file name (e.g. 'MOFISPW2023_10.xlsx').
+    """
+    return f"MOFISPW{date.split('-')[0]}_{date.split('-')[1].lstrip('0')}.xlsx"
+
+def workbook_date(file_name : str) -> str:
+    """
+    Returns the date of a workbook from its file name.
+
+    :param file_name: The file name (e.g. 'MOFISPW2023_10.xlsx').
+    :return: The date in the format '%Y-%m', or None if the file name does not match.
+    """
+    match = re.match(r'MOFISPW(\d{4})_(\d{1,2})\.xlsx$', file_name)
+    if match is None:
+        return None
+    return f'{match.group(1)}-{int(match.group(2)):02d}'
+
+def parse_workbook(content : bytes) -> pd.DataFrame:
+    """
+    Parses the last sheet of an auto.swiss workbook with pandas, loading the whole workbook in memory.
+
+    :param content: The content of the workbook.
+    :return: A Pandas DataFrame containing the last sheet of the workbook.
+    """
+    excel_file = pd.ExcelFile(io.BytesIO(content))
+    return excel_file.parse(sheet_name = excel_file.sheet_names[-1], 
+                            header = 8)
+
+def parse_workbook_streaming(content : bytes) -> pd.DataFrame:
+    """
+    Parses the last sheet of an auto.swiss workbook in read-only streaming mode.
+
+    Only the last sheet is opened, rows are read from the "Marken / marques" header row onwards and reading stops after the fuel type rows starting at "Benzin". Blank rows below the header are kept as empty rows and count towards the fuel type rows, as they do in the DataFrame returned by parse_workbook(); trailing blank rows are dropped, as pandas drops them.
+
+    :param content: The content of the workbook.
+    :return: A Pandas DataFrame containing the make rows and the fuel type rows of the last sheet.
+    """
+    workbook = openpyxl.load_workbook(io.BytesIO(content), 
+                                      read_only = True, 
+                                      data_only = True)
+    try:
+        sheet = workbook.worksheets[-1]
+        header = None
+        rows = []
+        fuel_rows_left = None
+        for row in sheet.iter_rows(values_only = True):
+            # blank rows may come back as empty tuples
+            first = row[0] if len(row) > 0 else None
+            if header is None:
+                if first == MAKE_HEADER_CH:
+                    header = row
+                continue
+            rows.append(tuple(row[:len(header)]) + (None,) * (len(header) - len(row)))
+            if fuel_rows_left is None and first == "Benzin":
+                fuel_rows_left = FUEL_ROWS_CH
+            if fuel_rows_left is not None:
+                fuel_rows_left -= 1
+                if fuel_rows_left == 0:
+                    break
+    finally:
+        workbook.close()
+    if header is None:
+        raise ValueError(f'"{MAKE_HEADER_CH}" header not found in the last sheet')
+    while len(rows) > 0 and all(value is None for value in rows[-1]):
+        rows.pop()
+    return pd.DataFrame(rows, 
+                        columns = header)
+
+def extract_rows(df : pd.DataFrame) -> tuple:
+    """
+    Extracts the make rows and the fuel type rows from a parsed sheet, as the Switzerland cleaners do.
+
+    :param df: The parsed sheet.
+    :return: A tuple of the make rows and the fuel type rows.
+    """
+    df = df.reset_index(drop = True)
+    index_total = df.index[df[MAKE_HEADER_CH] == "Total"].tolist()[0]
+    index_benzin = df.index[df[MAKE_HEADER_CH] == "Benzin"].tolist()[0]
+    make_df = df.iloc[:index_total, [0, 3]].reset_index(drop = True)
+    fuel_type_df = df.iloc[index_benzin : index_benzin + FUEL_ROWS_CH, [0, 3]].reset_index(drop = True)
+    return make_df, fuel_type_df
+
+def same_rows(df1 : pd.DataFrame,
+              df2 : pd.DataFrame) -> bool:
+    """
+    Checks whether two extracts contain the same labels and the same registrations.
+
+    :param df1: The first extract.
+    :param df2: The second extract.
+    :return: True if both extracts match, False otherwise.
+    """
+    if df1.shape != df2.shape:
+        return False
+    same_labels = (df1.iloc[:, 0].astype(str) == df2.iloc[:, 0].astype(str)).all()
+    same_registrations = (pd.to_numeric(df1.iloc[:, 1], errors = 'coerce').fillna(-1) == pd.to_numeric(df2.iloc[:, 1], errors = 'coerce').fillna(-1)).all()
+    return bool(same_labels and same_registrations)
+
+def parsers_agree(content : bytes) -> bool:
+    """
+    Checks that the streaming parser extracts the same make and fuel type rows from a workbook as the pandas parser.
+
+    :param content: The content of the workbook.
+    :return: True if both parsers extract the same rows, False otherwise.
+    """
+    pandas_make_df, pandas_fuel_type_df = extract_rows(parse_workbook(content))
+    streaming_make_df, streaming_fuel_type_df = extract_rows(parse_workbook_streaming(content))
+    return same_rows(pandas_make_df, streaming_make_df) and same_rows(pandas_fuel_type_df, streaming_fuel_type_df)
+
+class RateLimiter:
+
+    def __init__(self,
+                 min_interval : float) -> None:
+        """
+        Initialises the RateLimiter class, which spaces out calls made from several threads.
+
+        :param min_interval: The minimum number of seconds between two consecutive calls.
+        :return: None
+        """
+        self.min_interval = min_interval
+        self.lock = threading.Lock()
+        self.next_call = 0.0
+        return None
+
+    def wait(self) -> None:
+        """
+        Blocks until the next call is allowed.
+
+        :return: None
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.min_interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+        return None
 
 class Switzerland:
 
+    COUNTRY_CODE = 'CH'
+
     def __init__(self,
-                 date : str) -> None:
+                 date : str = None,
+                 bq : BigQuerySink = None,
+                 slack : LogDispatcher = None,
+                 rate_limiter : RateLimiter = None,
+                 session : requests.Session = None,
+                 fixtures_dir : str = None,
+                 archiver : Archiver = None) -> None:
         """
         Initialises the Switzerland class.
 
+        :param date: The date of the data to retrieve, in the format '%Y-%m'. Defaults to the month preceding the current month, which is reported as not released yet (rather than as a failure) while the workbook is missing.
+        :param bq: An optional BigQuery sink to share between instances, or a LocalSink in replay mode.
+        :param slack: An optional Slack log dispatcher to share between instances.
+        :param rate_limiter: An optional rate limiter applied to requests made to the auto.swiss website.
+        :param session: An optional HTTP session to share between instances.
+        :param fixtures_dir: An optional directory of recorded source files. When provided, the workbook is replayed from "{fixtures_dir}/switzerland/MOFISPW{year}_{month}.xlsx" instead of being requested.
+        :param archiver: An optional archiver for the raw source files. Defaults to the archiver shared by every scraper.
         :return: None
         """  
-        self.bq = MyBigQuery()
-        self.slack = SlackBot(token_file = './credentials/slack.json',
-                              slack_channel = '#global-ecc-scraper')
-        self.date = date
+        self.bq = bq if bq is not None else BigQuerySink()
+        self.slack = slack if slack is not None else get_log_dispatcher(slack_channel = '#global-ecc-scraper')
+        self.session = session if session is not None else get_session()
+        self.sources = get_source_metadata()
+        self.source_key = None
+        self.unchanged = False
+        self.unreleased = False
+        self.failed = False
+        self.fixtures_dir = fixtures_dir
+        self.archiver = archiver if archiver is not None else get_archiver()
+        self.latest = date is None
+        self.date = date if date is not None else (datetime.now() - relativedelta(months = 1)).strftime('%Y-%m')
+        self.content = None
+        self.df = None
+        self.rate_limiter = rate_limiter
         return None
     
     def print_and_send(self,
                        text : str) -> None:
         """
-        Prints the provided text with the prefix "CH" (the two-letter country code for Switzerland) and sends it to the "global-ecc-scraper" Slack channel.
+        Prints the provided text with the prefix "CH" (the two-letter country code for Switzerland) and queues it for the "global-ecc-scraper" Slack channel.
 
         :param text: The text to be printed and sent.
         """
@@ -54,12 +238,70 @@ class Switzerland:
         self.slack.send_log(text)
         return None
     
-    def make_request(self) -> None:
+    def read_cache(self) -> bytes:
         """
-        Retrieves and processes data for the specified date.
+        Reads the cached workbook for the specified date, if one exists.
 
-        :return: None.
+        Cached workbooks are content-addressed and stored as "{date}_{hash}.xlsx", where the hash is the first 16 characters of the SHA-256 digest of the file.
+
+        :return: The content of the cached workbook, or None if the date has not been cached.
         """
+        if not os.path.isdir(CACHE_DIR_CH):
+            return None
+        for file_name in sorted(os.listdir(CACHE_DIR_CH)):
+            if not file_name.startswith(f'{self.date}_') or not file_name.endswith('.xlsx'):
+                continue
+            with open(os.path.join(CACHE_DIR_CH, file_name), 'rb') as file:
+                content = file.read()
+            # only trust the cached file if its content still matches its hash
+            if hashlib.sha256(content).hexdigest()[:16] == file_name[len(self.date) + 1 : -len('.xlsx')]:
+                return content
+        return None
+
+    def write_cache(self,
+                    content : bytes) -> str:
+        """
+        Writes the workbook for the specified date to the on-disk cache.
+
+        :param content: The content of the workbook.
+        :return: The path of the cached workbook.
+        """
+        os.makedirs(CACHE_DIR_CH,
+                    exist_ok = True)
+        content_hash = hashlib.sha256(content).hexdigest()[:16]
+        path_file = os.path.join(CACHE_DIR_CH, f'{self.date}_{content_hash}.xlsx')
+        with open(path_file, 'wb') as file:
+            file.write(content)
+        return path_file
+
+    def report_archive(self,
+                       future : Future) -> None:
+        """
+        Reports the failure of a background archival.
+
+        :param future: The Future returned by the archiver.
+        :return: None
+        """
+        if future.exception() is not None:
+            self.print_and_send(f"{future.exception()} : failed to archive the source file for {self.date}...\n\n")
+        return None
+
+    def fetch(self) -> bytes:
+        """
+        Retrieves the workbook for the specified date.
+
+        The workbook is retrieved at most once per instance. When it is already cached on disk, a conditional request is made and the cached copy is used if the source has not changed. A changed workbook is cached and archived in the background, while an unchanged one sets the unchanged attribute and is not archived again.
+
+        :return: The content of the workbook, or None if it could not be retrieved or has not been released yet.
+        """
+        if self.content is not None:
+            return self.content
+        if self.fixtures_dir is not None:
+            # replay the recorded workbook, without requests or bucket upload
+            with open(os.path.join(self.fixtures_dir, 'switzerland', workbook_file_name(self.date)), 'rb') as file:
+                self.content = file.read()
+            self.print_and_send(f"replayed recorded data for {self.date}...\n\n")
+            return self.content
         # make a request to retrieve the relevant data in Excel format
         headers = {'Referer' : 'https://www.auto.swiss/',
                    'Upgrade-Insecure-Requests' : '1',
@@ -68,31 +310,65 @@ class Switzerland:
                    'sec-ch-ua-mobile' : '?0',
                    'sec-ch-ua-platform' : '"macOS"'}
         one_month_after = (pd.to_datetime(self.date) + relativedelta(months = 1)).strftime('%Y-%m')
-        url = f"https://www.auto.swiss/wp-content/uploads/{one_month_after.split('-')[0]}/{one_month_after.split('-')[1]}/MOFISPW{self.date.split('-')[0]}_{self.date.split('-')[1].lstrip('0')}.xlsx"
-        response = requests.get(url, 
-                                headers = headers)
-        if response.status_code == 200:
-            excel_data = io.BytesIO(response.content)
-            excel_file = pd.ExcelFile(excel_data)
-            sheet_names = excel_file.sheet_names
-            last_sheet_name = sheet_names[-1]
-            df = pd.read_excel(excel_data, 
-                               sheet_name = last_sheet_name, 
-                               header = 8)
-            # save the response data to a locally stored Excel file
-            with open(f'data/switzerland/{self.date}.xlsx', 'wb') as file:
-                file.write(response.content)
+        url = f"https://www.auto.swiss/wp-content/uploads/{one_month_after.split('-')[0]}/{one_month_after.split('-')[1]}/{workbook_file_name(self.date)}"
+        cached_content = self.read_cache()
+        if cached_content is not None:
+            headers.update(self.sources.conditional_headers(url))
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        with stage(self.COUNTRY_CODE, 'fetch') as measures:
+            response = self.session.get(url, 
+                                        headers = headers)
+            measures['bytes'] = len(response.content)
+        if response.status_code == 304 and cached_content is not None:
+            content = cached_content
+            self.print_and_send(f"read cached data for {self.date}...\n\n")
+        elif response.status_code == 200:
+            content = response.content
             self.print_and_send(f"successfully retrieved data for {self.date}...\n\n")
-
-            # upload the Excel file to the global_ecc bucket
-            bucket = MyBucket(bucket_name = BUCKET_NAME)
-            bucket.upload_file_to_bucket(path_file = f'data/switzerland/{self.date}.xlsx',
-                                         destination_blob_name = DESTINATION_BLOB_NAME_CH)
-            # remove the Excel file
-            os.system(f'rm data/switzerland/{self.date}.xlsx')
+        elif response.status_code == 404 and self.latest:
+            # the workbook of the latest month is published during the following month
+            self.unreleased = True
+            self.print_and_send(f"data for {self.date} has not been released yet...\n\n")
+            return None
         else:
+            self.failed = True
             self.print_and_send(f"failed to retrieve data for {self.date}...\n\n")
-        return df
+            return None
+        self.source_key = url
+        self.unchanged = self.sources.is_unchanged(url, response)
+        if cached_content is None or content != cached_content:
+            # save the response data to the on-disk cache
+            self.write_cache(content)
+        if not self.unchanged:
+            # archive the Excel file in the background
+            future = self.archiver.archive(country = DESTINATION_BLOB_NAME_CH,
+                                           date = self.date,
+                                           content = content,
+                                           extension = 'xlsx',
+                                           timing_country = self.COUNTRY_CODE)
+            future.add_done_callback(self.report_archive)
+        self.content = content
+        return self.content
+
+    def make_request(self) -> pd.DataFrame:
+        """
+        Retrieves and parses the data for the specified date.
+
+        The workbook is parsed at most once per instance, so the make and fuel type cleaners share the same parsed sheet. It is parsed even if it has not changed since it was last ingested (e.g. to backfill a month missing from a table); run() checks the unchanged attribute after fetch() instead, so an unchanged workbook is not parsed there.
+
+        :return: A Pandas DataFrame containing the last sheet of the workbook, or None if the data could not be retrieved.
+        """
+        if self.df is not None:
+            return self.df
+        content = self.fetch()
+        if content is None:
+            return None
+        # stream the last sheet and stop after the fuel type rows
+        with stage(self.COUNTRY_CODE, 'parse') as measures:
+            measures['bytes'] = len(content)
+            self.df = parse_workbook_streaming(content)
+        return self.df
     
     def clean_make_data(self) -> pd.DataFrame:
         """
@@ -101,8 +377,19 @@ class Switzerland:
         :return: A Pandas DataFrame containing the cleaned make data.
         """
         df = self.make_request()
+        with stage(self.COUNTRY_CODE, 'clean'):
+            return self.extract_make_data(df)
+
+    def extract_make_data(self,
+                          df : pd.DataFrame) -> pd.DataFrame:
+        """
+        Extracts the make data from the parsed sheet.
+
+        :param df: The parsed sheet.
+        :return: A Pandas DataFrame containing the cleaned make data.
+        """
         # get rid of unnecessary rows and columns
-        index_total = df.index[df["Marken / marques"] == "Total"].tolist()[0]
+        index_total = df.index[df[MAKE_HEADER_CH] == "Total"].tolist()[0]
         make_df = df.iloc[:index_total, [0, 3]]
         # rename the columns
         make_df.columns = ["make",
@@ -119,9 +406,20 @@ class Switzerland:
         :return: A Pandas DataFrame containing the cleaned fuel type data.
         """
         df = self.make_request()
+        with stage(self.COUNTRY_CODE, 'clean'):
+            return self.extract_fuel_type_data(df)
+
+    def extract_fuel_type_data(self,
+                               df : pd.DataFrame) -> pd.DataFrame:
+        """
+        Extracts the fuel type data from the parsed sheet.
+
+        :param df: The parsed sheet.
+        :return: A Pandas DataFrame containing the cleaned fuel type data.
+        """
         # get rid of unnecessary rows and columns
-        index_benzin = df.index[df["Marken / marques"] == "Benzin"].tolist()[0]
-        fuel_type_df = df.iloc[index_benzin : index_benzin + 8, [0, 3]]
+        index_benzin = df.index[df[MAKE_HEADER_CH] == "Benzin"].tolist()[0]
+        fuel_type_df = df.iloc[index_benzin : index_benzin + FUEL_ROWS_CH, [0, 3]]
         # rename the columns
         fuel_type_df.columns = ["fuelType",
                                 "registrations"]
@@ -142,15 +440,20 @@ class Switzerland:
 
         :return: None
         """
-        # push the make DataFrame to BigQuery
+        # push the new rows of the make DataFrame to BigQuery
         try:
-            self.bq.append_from_df(table_name = TABLE_NAME_CH_MAKE,
-                                   df = self.clean_make_data(),
-                                   dataset_name = DATASET_NAME,
-                                   unique_fields = UNIQUE_FIELDS_CH_MAKE,
-                                   job_config = JOB_CONFIG_CH_MAKE)
-            self.print_and_send(f'{SWITZERLAND_MAKE} updated with data from {self.date}!\n\n')
+            df = self.clean_make_data()
+            with stage(self.COUNTRY_CODE, 'load') as measures:
+                measures['bytes'] = int(df.memory_usage(deep = True).sum())
+                rows = append_deduplicated(bq = self.bq,
+                                           table_name = TABLE_NAME_CH_MAKE,
+                                           table_id = SWITZERLAND_MAKE,
+                                           df = df,
+                                           unique_fields = UNIQUE_FIELDS_CH_MAKE,
+                                           job_config = JOB_CONFIG_CH_MAKE)
+            self.print_and_send(f'{SWITZERLAND_MAKE} updated with {rows} new rows from {self.date}!\n\n')
         except:
+            self.failed = True
             self.print_and_send(f"failed to update {SWITZERLAND_MAKE} with data from {self.date}...\n\n")
         return None
     
@@ -160,14 +463,175 @@ class Switzerland:
 
         :return: None
         """
-        # push the fuel type DataFrame to BigQuery
+        # push the new rows of the fuel type DataFrame to BigQuery
         try:
-            self.bq.append_from_df(table_name = TABLE_NAME_CH_FT,
-                                   df = self.clean_fuel_type_data(),
-                                   dataset_name = DATASET_NAME,
-                                   unique_fields = UNIQUE_FIELDS_2,
-                                   job_config = JOB_CONFIG_2)
-            self.print_and_send(f'{SWITZERLAND_FT} updated with data from {self.date}!\n\n')
+            df = self.clean_fuel_type_data()
+            with stage(self.COUNTRY_CODE, 'load') as measures:
+                measures['bytes'] = int(df.memory_usage(deep = True).sum())
+                rows = append_deduplicated(bq = self.bq,
+                                           table_name = TABLE_NAME_CH_FT,
+                                           table_id = SWITZERLAND_FT,
+                                           df = df,
+                                           unique_fields = UNIQUE_FIELDS_2,
+                                           job_config = JOB_CONFIG_2)
+            self.print_and_send(f'{SWITZERLAND_FT} updated with {rows} new rows from {self.date}!\n\n')
         except:
+            self.failed = True
             self.print_and_send(f"failed to update {SWITZERLAND_FT} with data from {self.date}...\n\n")
         return None
+
+    def run(self) -> bool:
+        """
+        Retrieves the data and uploads the make and fuel type data to BigQuery.
+
+        The run ends early, before the workbook is parsed and with no BigQuery work, if the workbook has not changed since it was last ingested.
+
+        :return: False if the data could not be retrieved or uploaded, True otherwise (including when the workbook was unchanged or has not been released yet).
+        """
+        if self.fetch() is None:
+            return not self.failed
+        if self.unchanged:
+            self.print_and_send(f"source unchanged since the last run for {self.date}...\n\n")
+            return True
+        self.make_data_to_BQ()
+        self.fuel_type_data_to_BQ()
+        # only remember the source once its data has been ingested
+        if not self.failed:
+            self.sources.commit(self.source_key)
+        return not self.failed
+
+def append_deduplicated(bq : BigQuerySink,
+                        table_name : str,
+                        table_id : str,
+                        df : pd.DataFrame,
+                        unique_fields : list,
+                        job_config : bigquery.LoadJobConfig,
+                        loader : BatchLoader = None) -> int:
+    """
+    Appends the rows of a DataFrame that are not stored yet.
+
+    Duplicates are dropped against the locally cached dedupe index of the table before the load job, which only queries the table (for the appended dates) when its metadata shows it was modified by another load since the index was last synced, so the monthly appends run no query at all. When a batch loader is provided, the rows are queued for its next flush instead of being loaded straight away.
+
+    :param bq: The BigQuery sink, or a LocalSink in replay mode.
+    :param table_name: The name of the table.
+    :param table_id: The fully qualified ID of the table.
+    :param df: The DataFrame to append.
+    :param unique_fields: The fields identifying duplicate rows.
+    :param job_config: The load job configuration.
+    :param loader: An optional batch loader.
+    :return: The number of appended (or queued) rows.
+    """
+    index = get_dedupe_index(bq = bq,
+                             table_id = table_id,
+                             unique_fields = unique_fields)
+    # pick up the rows stored for these dates since the index was cached, whoever loaded them
+    index.refresh(dates = list(pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d').unique()))
+    df = index.filter_new(df)
+    if df.shape[0] == 0:
+        return 0
+    if loader is not None:
+        loader.add(table_name = table_name,
+                   df = df,
+                   job_config = job_config,
+                   on_loaded = index.add)
+        return df.shape[0]
+    bq.append_from_df(table_name = table_name,
+                      df = df,
+                      dataset_name = DATASET_NAME,
+                      job_config = job_config)
+    index.add(df)
+    return df.shape[0]
+
+def get_ingested_months(bq : BigQuerySink,
+                        table_id : str) -> set:
+    """
+    Retrieves the months already stored in a BigQuery table.
+
+    :param bq: The BigQuery sink, or a LocalSink in replay mode.
+    :param table_id: The fully qualified ID of the table.
+    :return: A set of months in the format '%Y-%m', empty if the table does not exist yet.
+    """
+    query = f"""
+            SELECT 
+                DISTINCT date
+            FROM 
+                `{table_id}`
+            """
+    try:
+        return set(pd.to_datetime(bq.read_df(query)["date"]).dt.strftime('%Y-%m'))
+    except NotFound:
+        # any other error is raised, so a transient failure does not refetch every month
+        return set()
+
+def backfill(dates : list,
+             max_workers : int = 4,
+             min_interval : float = 1.0) -> None:
+    """
+    Retrieves the data for several months in parallel and uploads the missing months to BigQuery.
+
+    Months already stored in both tables are skipped. The remaining months are fetched through a bounded, rate-limited thread pool and each table is then updated with a single Parquet load job.
+
+    :param dates: A list of dates in the format '%Y-%m'.
+    :param max_workers: The maximum number of months fetched at the same time.
+    :param min_interval: The minimum number of seconds between two requests made to the auto.swiss website.
+    :return: None
+    """
+    bq = BigQuerySink()
+    slack = get_log_dispatcher(slack_channel = '#global-ecc-scraper')
+    rate_limiter = RateLimiter(min_interval = min_interval)
+    try:
+        make_months = get_ingested_months(bq, SWITZERLAND_MAKE)
+        fuel_type_months = get_ingested_months(bq, SWITZERLAND_FT)
+    except Exception as e:
+        text = f"CH - {e} : failed to retrieve the months already stored...\n\n"
+        print(text)
+        slack.send_log(text)
+        return None
+    missing_dates = [date for date in dates if date not in make_months or date not in fuel_type_months]
+    instances = [Switzerland(date = date,
+                             bq = bq,
+                             slack = slack,
+                             rate_limiter = rate_limiter) for date in missing_dates]
+    if len(instances) == 0:
+        text = f"CH - no missing months between {dates[0]} and {dates[-1]}...\n\n"
+        print(text)
+        slack.send_log(text)
+        return None
+
+    def clean(instance : Switzerland) -> tuple:
+        # clean only the tables for which the month is missing
+        try:
+            make_df = instance.clean_make_data() if instance.date not in make_months else None
+            fuel_type_df = instance.clean_fuel_type_data() if instance.date not in fuel_type_months else None
+        except Exception as e:
+            instance.print_and_send(f"{e} : failed to clean data for {instance.date}...\n\n")
+            return None, None
+        return make_df, fuel_type_df
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        results = list(executor.map(clean, instances))
+
+    # queue the new rows of every month, then push them to BigQuery with one Parquet load job per table
+    loader = BatchLoader(bq = bq)
+    months = sorted(instance.date for instance in instances)
+    try:
+        for index, (table_name, table_id, unique_fields, job_config) in enumerate([(TABLE_NAME_CH_MAKE, SWITZERLAND_MAKE, UNIQUE_FIELDS_CH_MAKE, JOB_CONFIG_CH_MAKE),
+                                                                                    (TABLE_NAME_CH_FT, SWITZERLAND_FT, UNIQUE_FIELDS_2, JOB_CONFIG_2)]):
+            df_list = [result[index] for result in results if result[index] is not None]
+            if len(df_list) == 0:
+                continue
+            append_deduplicated(bq = bq,
+                                table_name = table_name,
+                                table_id = table_id,
+                                df = pd.concat(df_list, 
+                                               ignore_index = True),
+                                unique_fields = unique_fields,
+                                job_config = job_config,
+                                loader = loader)
+        loaded = loader.flush()
+        text = f'CH - {", ".join(f"{table_name} ({rows} rows)" for table_name, rows in loaded.items()) or "no table"} updated with data from {", ".join(months)}!\n\n'
+    except Exception as e:
+        text = f"CH - {e} : failed to update the tables with data from {', '.join(months)}...\n\n"
+    print(text)
+    slack.send_log(text)
+    return None
@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+TIMINGS_FILE = 'data/timings.jsonl'
+RUN_ID = datetime.now().strftime('%Y%m%dT%H%M%S') + f'-{os.getpid()}'
+
+_timings_file = TIMINGS_FILE
+_timings_lock = threading.Lock()
+
+def set_timings_file(path_file : str) -> None:
+    """
+    Sets the JSONL file in which the stages of the process are recorded.
+
+    :param path_file: The path of the JSONL file, or None to stop recording (e.g. in benchmarks).
+    :return: None
+    """
+    global _timings_file
+    _timings_file = path_file
+    return None
+
+def record(entry : dict,
+           path_file : str = None) -> None:
+    """
+    Appends one entry to the JSONL timing history.
+
+    :param entry: The entry to append.
+    :param path_file: The path of the JSONL file. Defaults to the file set with set_timings_file().
+    :return: None
+    """
+    path_file = path_file if path_file is not None else _timings_file
+    if path_file is None:
+        return None
+    with _timings_lock:
+        os.makedirs(os.path.dirname(path_file) or '.',
+                    exist_ok = True)
+        with open(path_file, 'a') as file:
+            file.write(json.dumps(entry) + '\n')
+    return None
+
+@contextmanager
+def stage(country : str,
+          name : str,
+          path_file : str = None):
+    """
+    Records the duration of a stage (e.g. "fetch", "parse", "clean", "load" or "archive") for a country, per run.
+
+    The context yields a dictionary in which the caller can set the number of bytes processed by the stage, under the "bytes" key. The entry is recorded whether the stage succeeds or fails.
+
+    :param country: The country code (e.g. 'FI').
+    :param name: The name of the stage.
+    :param path_file: The path of the JSONL file. Defaults to the file set with set_timings_file().
+    """
+    measures = {'bytes' : None}
+    status = 'ok'
+    start = time.perf_counter()
+    try:
+        yield measures
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        record({'run_id' : RUN_ID,
+                'timestamp' : datetime.now().isoformat(timespec = 'seconds'),
+                'country' : country,
+                'stage' : name,
+                'seconds' : round(time.perf_counter() - start, 4),
+                'bytes' : measures['bytes'],
+                'status' : status},
+               path_file = path_file)
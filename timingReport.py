@@ -0,0 +1,68 @@
+from modules.timingModules import TIMINGS_FILE
+import argparse
+import sys
+import pandas as pd
+
+# create a command-line argument parser
+parser = argparse.ArgumentParser(description = 'This script reports the stage timings of the scrapers and flags regressions against the rolling median.')
+parser.add_argument('--file',
+                    help = "Choose the JSONL timing history.",
+                    default = TIMINGS_FILE,
+                    type = str)
+parser.add_argument('--runs',
+                    help = "Choose the number of most recent runs shown per country and stage.",
+                    default = 6,
+                    type = int)
+parser.add_argument('--window',
+                    help = "Choose the number of previous runs in the rolling median.",
+                    default = 6,
+                    type = int)
+parser.add_argument('--threshold',
+                    help = "Choose the ratio to the rolling median above which a stage is flagged (e.g. 1.5).",
+                    default = 1.5,
+                    type = float)
+parser.add_argument('--country',
+                    help = "Choose a country code to report on (e.g. 'FI').",
+                    default = None,
+                    type = str)
+args = parser.parse_args()
+
+try:
+    df = pd.read_json(args.file,
+                      lines = True)
+except (FileNotFoundError, ValueError):
+    print(f'no timings found in {args.file}...')
+    sys.exit(0)
+if args.country is not None:
+    df = df.loc[df['country'] == args.country.upper()]
+if df.shape[0] == 0:
+    print(f'no timings found in {args.file}...')
+    sys.exit(0)
+
+# sum the stages run several times per run (e.g. the two Swiss loads)
+runs = df.groupby(['country', 'stage', 'run_id'], as_index = False)\
+         .agg({'timestamp' : 'min',
+               'seconds' : 'sum',
+               'bytes' : 'sum'})\
+         .sort_values('timestamp')
+# compare each run with the median of the previous runs
+runs['median'] = runs.groupby(['country', 'stage'])['seconds']\
+                     .transform(lambda seconds : seconds.shift(1).rolling(args.window, min_periods = 1).median())
+runs['ratio'] = runs['seconds'] / runs['median']
+runs['flag'] = runs['ratio'] > args.threshold
+
+for (country, stage_name), stage_runs in runs.groupby(['country', 'stage']):
+    print(f'{country} - {stage_name}')
+    recent = stage_runs.tail(args.runs).loc[:, ['timestamp', 'seconds', 'bytes', 'median', 'ratio', 'flag']]
+    recent['flag'] = recent['flag'].map({True : 'REGRESSION', False : ''})
+    print(recent.round(3).to_string(index = False))
+    print()
+
+latest = runs.groupby(['country', 'stage']).tail(1)
+regressions = latest.loc[latest['flag']]
+if regressions.shape[0] > 0:
+    print('regressions in the latest run:')
+    for _, row in regressions.iterrows():
+        print(f"{row['country']} - {row['stage']}: {row['seconds']:.3f}s vs a rolling median of {row['median']:.3f}s ({row['ratio']:.1f}x)")
+    sys.exit(1)
+print('no regressions in the latest run')
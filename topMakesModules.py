@@ -0,0 +1,90 @@
+import pandas as pd
+
+TOP_MAKES_COUNT = 5
+ALL_FUEL_TYPES = 'ALL'
+TOP_MAKES_COLUMNS = ['date', 'fuel_scope', 'rank', 'make', 'fuelType', 'registrations']
+
+def rank_makes(df : pd.DataFrame,
+               keys : list) -> pd.Series:
+    """
+    Ranks the makes by decreasing registrations within groups, breaking ties by make.
+
+    :param df: A DataFrame with the make and registrations columns, and the grouping columns.
+    :param keys: The grouping columns.
+    :return: The rank of each row, starting at 1.
+    """
+    ordered = df.sort_values(keys + ['registrations', 'make'],
+                             ascending = [True] * len(keys) + [False, True])
+    return ordered.groupby(keys, dropna = False).cumcount().add(1).reindex(df.index)
+
+def top_makes_frame(df : pd.DataFrame,
+                    count : int = TOP_MAKES_COUNT) -> pd.DataFrame:
+    """
+    Derives the top makes table of a country from its make-level registrations.
+
+    The table holds two kinds of rows, told apart by the fuel_scope column:
+    - 'ALL': for each month, the top makes by registrations over every fuel type, with one row per fuel type of each make (the fuel type split);
+    - a fuel type: the makes ranked by registrations of that fuel type, for each month. A make is tracked, with a row in every month it registered that fuel type, when it ranks in the top makes of any month or of all time; rank is its rank in the month.
+    The all-time rankings have no date.
+
+    :param df: A DataFrame with the date, make, fuelType and registrations columns, aggregated by date, make and fuel type.
+    :param count: The number of top makes.
+    :return: A Pandas DataFrame with the date, fuel_scope, rank, make, fuelType and registrations columns.
+    """
+    df = df.loc[:, ['date', 'make', 'fuelType', 'registrations']].dropna(subset = ['fuelType'])
+    all_time = df.groupby(['make', 'fuelType'], dropna = False, as_index = False)['registrations'].sum().assign(date = pd.NaT)
+    data = pd.concat([df, all_time], ignore_index = True)
+
+    # top makes over every fuel type, split by fuel type
+    totals = data.groupby(['date', 'make'], dropna = False, as_index = False)['registrations'].sum()
+    totals['rank'] = rank_makes(totals, ['date'])
+    split = data.merge(totals.loc[totals['rank'] <= count, ['date', 'make', 'rank']],
+                       on = ['date', 'make'])
+    split['fuel_scope'] = ALL_FUEL_TYPES
+
+    # makes ranked by fuel type, keeping the full series of the tracked makes
+    data['rank'] = rank_makes(data, ['date', 'fuelType'])
+    tracked = data.loc[data['rank'] <= count, ['fuelType', 'make']].drop_duplicates()
+    by_fuel_type = data.merge(tracked,
+                              on = ['fuelType', 'make'])
+    by_fuel_type['fuel_scope'] = by_fuel_type['fuelType']
+
+    return pd.concat([split, by_fuel_type], ignore_index = True)\
+             .loc[:, TOP_MAKES_COLUMNS]\
+             .sort_values(['fuel_scope', 'date', 'rank', 'fuelType'])\
+             .reset_index(drop = True)
+
+def latest_split(frame : pd.DataFrame) -> pd.DataFrame:
+    """
+    Selects the fuel type split of the top makes of the latest month.
+
+    :param frame: The top makes table of a country.
+    :return: A Pandas DataFrame with the make, fuelType and registrations columns.
+    """
+    split = frame.loc[(frame['fuel_scope'] == ALL_FUEL_TYPES) & frame['date'].notna()]
+    return split.loc[split['date'] == split['date'].max(), ['make', 'fuelType', 'registrations']]
+
+def top_make_names(frame : pd.DataFrame,
+                   fuel_type : str) -> list:
+    """
+    Selects the top makes of all time of a fuel type, as the dashboard's first top makes query ranks them.
+
+    :param frame: The top makes table of a country.
+    :param fuel_type: The fuel type (e.g. 'BEV').
+    :return: The makes, by rank.
+    """
+    rows = frame.loc[(frame['fuel_scope'] == fuel_type) & frame['date'].isna() & (frame['rank'] <= TOP_MAKES_COUNT)]
+    return rows.sort_values('rank')['make'].drop_duplicates().tolist()
+
+def looker_top_makes(df : pd.DataFrame,
+                     count : int = TOP_MAKES_COUNT) -> dict:
+    """
+    Lists the makes ranking in the top BEV makers of any month of looker_national_top_makers, as the dashboard's second top makes query ranks them.
+
+    :param df: A DataFrame with the country, date, make and BEV_sales columns of looker_national_top_makers.
+    :param count: The number of top makes of each month.
+    :return: A dictionary mapping each country to its sorted makes.
+    """
+    df = df.rename(columns = {'BEV_sales' : 'registrations'})
+    ranked = df.loc[rank_makes(df, ['country', 'date']) <= count]
+    return {country : sorted(group['make'].dropna().unique().tolist()) for country, group in ranked.groupby('country')}